@@ -1,271 +1,613 @@
-"""
----------------------------------------------------------------------------
- EDARTUtility.py
- 09/2018
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- Script to: EDART post processing support functions.
- Many of these functions could in theory be moved to a more generic
-    raster module, but all should be assumed to make assumptions specific
-    to EDART outputs.
-
- V1. changes to working dir functions. remove support for older working dir methods
-
- Known limitations: python 3.x
----------------------------------------------------------------------------
-"""
-import os
-import glob
-import shutil
-import sys
-import time
-import calendar
-import numpy as np
-import arcpy
-sys.path.append(os.path.abspath(r'..'))
-import envi_header
-
-# ------------------------------
-# event timing raster (EVTY)
-EVENTSUFFIX = 'EVTY'
-# corresponding confidence raster (ConfEV)
-CONFSUFFIX = 'ConfEV'
-# low confidence suffix
-EVENTXSUFFIX = 'EVpTY'
-# event frame raster
-FRAMEEVENTSUFFIX = 'nFrEV'
-# prepost stat raster
-PPSUFFIX = 'PPEVdif'
-
-# ---------------------------------------------------------------------------
-# numpy related and for pool
-def testYear(a, intY, intYEnd=None):
-    """ Return 1 where intY <= a < intYEnd, else 0.
-        Works 2 and 3D.
-    """
-    if intYEnd is None:
-        intYEnd = intY + 1
-    return (np.where(a >= intY, 1, 0) & np.where(a < intYEnd, 1, 0)).astype(np.uint8)
-
-def testMoistureYear(a, intY):
-    """ Return 1 where intY < a >= intY else 0.
-        Works 2 and 3D.
-        Currently hardcoded for Oct 1 start date:
-            intY = 2000 --> from Oct1 2000 thru sept30 2001
-    """
-    intD = 274
-    intDL = 275
-    # set start and end
-    fltY = intY + intD/365
-    fltYEnd = intY + 1 + intD/365
-    # Check for leap year start and end
-    if calendar.isleap(intY):
-        fltY = intY + intDL/366
-    if calendar.isleap(intY + 1):
-        fltYEnd = intY + 1 + intDL/366
-
-    return testYear(a, fltY, fltYEnd)
-
-# ---------------------------------------------------------------------------
-# path and file related
-def getSceneDir(strPathTDIS):
-    """ Return scene folder given TDIS folder. """
-    if not r'envi_aux\TDIS' in strPathTDIS:
-        raise Exception(r'pattern match "envi_aux\TDIS" not found.')
-    return strPathTDIS.split(r'envi_aux\TDIS')[0]
-
-def getDMDir(strPathScene):
-    """ Return directory containing cloud masks
-        mask bsqs in this dir are named DM_yyyy.mm.dd_X.bsq
-    """
-    return strPathScene + r'envi_aux\Images'
-
-def getDartDir(strPathScene):
-    """ Return directory containing 
-    """
-    strWild = strPathScene + r'envi_aux\Images\DF_*'
-    lstDirs = [f for f in glob.glob(strWild) if os.path.isdir(f)]
-
-    if len(lstDirs) == 0:
-        raise Exception('No match found for: ' + strWild)
-    elif len(lstDirs) > 1:
-        raise Exception('Multiple matchs found for: ' + strWild)
-
-    return lstDirs[0]
-
-def getENVIframeDir(strPathScene, sSubDir=None):
-    """ Return directory containing envi frames
-        frame bsqs in this dir are named FR_yyyy.mm.dd_X.bsq
-        Optional subdirectory name sSubDir. workaround for non standard directory organization.
-    """
-    strWild = strPathScene + r'SEQhdr\ENVI_FR*'
-    if sSubDir is not None:
-        strWild = strWild + os.sep + sSubDir
-
-    lstDirs = [f for f in glob.glob(strWild) if os.path.isdir(f)]
-
-    if len(lstDirs) == 0:
-        raise Exception('No match found for: ' + strWild)
-    elif len(lstDirs) > 1:
-        raise Exception('Multiple matchs found for: ' + strWild)
-
-    return lstDirs[0]
-
-def get_workspace(strOrigPath, strType_='flatten', strSuff_=''):
-    """ Return TDIS working (flatten) path given TDIS path. """
-    if os.path.split(strOrigPath)[1].startswith('TDISm__'):
-        strScene = strOrigPath.split(os.sep)[-4].split('_')[0]
-        p, f = os.path.split(strOrigPath)
-        strWorkPath = p + os.sep + strScene + '_' + f + '_' + strType_ + strSuff_
-    else:
-        print('Archive style folder name.')
-        strWorkPath = strOrigPath + '_flatten'
-
-    return strWorkPath
-
-def expand2TDISpath(strPath):
-    """ Return full TDIS working folder (.../envi_aux/TDIS/TDISm__*) given only scene folder.
-        Raise exception if zero or more than one match is found.
-    """
-    if 'TDISm__' in os.path.split(strPath)[1]:
-        return strPath
-
-    strWild = strPath + r'\envi_aux\TDIS\TDISm__*'
-    lstDirs = glob.glob(strWild)
-    if len(lstDirs) == 0:
-        raise Exception('No match found for: ' + strWild)
-    elif len(lstDirs) > 1:
-        raise Exception('Multiple matchs found for: ' + strWild)
-
-    return lstDirs[0]
-
-def prep_workspace(strOriginalPath, strType_, strSuff_='', bolRedo_=False):
-    """ Determine and create workspace folder
-        Options:
-            bolRedo_: Delete existing working folder and redo.
-    """
-    print('\tPrep...')
-    strWorkingPath = get_workspace(strOriginalPath, strType_=strType_, strSuff_=strSuff_)
-    print('\t\tWorking path: ' + strWorkingPath)
-    if os.path.exists(strWorkingPath):
-        if bolRedo_:
-            print('\t\tRemoving old run.')
-            shutil.rmtree(strWorkingPath)
-            time.sleep(2)
-            os.makedirs(strWorkingPath)
-        else:
-            return None
-    else:
-        os.makedirs(strWorkingPath)
-
-    return strWorkingPath
-
-def ImgHdrPair(strPathImg, strExt='.hdr'):
-    """ Return raster and header path given raster. """
-    return (strPathImg, strPathImg[:-4] + strExt)
-
-def CopyBsq(lstBsq, strOutPath):
-    """ Copy all bsqs in lstBsq to strOutPath.
-        Optionally copy to os.cwd if strOutPath is None
-    """
-    lstCopied = []
-    for inB in lstBsq:
-        inB, inH = ImgHdrPair(inB)
-        outB, outH = [strOutPath + os.sep + os.path.basename(f) for f in [inB, inH]]
-        shutil.copy(inB, outB)
-        shutil.copy(inH, outH)
-
-        lstCopied.append(outB)
-
-    return lstCopied
-
-def get_PPEVdif(strPath, strBand_, strStat_='Median'):
-    """ Return FrEV raster name given TDIS path.
-        Should combine with below functions
-    """
-    lstSearch = glob.glob(strPath + os.sep + PPSUFFIX + '_' + strStat_ + '_' + strBand_ + '*.tif')
-    if len(lstSearch) != 1:
-        raise Exception('Non-unique or missing propost stat image: ' + str(lstSearch))
-    return lstSearch[0]
-
-def get_nFrEV(strPath):
-    """ Return FrEV raster name given TDIS path.
-        Should combine with below functions
-    """
-    lstSearch = glob.glob(strPath + os.sep + FRAMEEVENTSUFFIX + '_*.bsq')
-    if len(lstSearch) != 1:
-        raise Exception('Non-unique or missing nFrEV image: ' + str(lstSearch))
-    return lstSearch[0]
-
-def get_EVTY(strPath):
-    """ Return EVTY raster name given TDIS path. """
-    lstSearch = glob.glob(strPath + os.sep + EVENTSUFFIX + '_*.bsq')
-    if len(lstSearch) != 1:
-        raise Exception('Non-unique or missing event timing image: ' + str(lstSearch))
-    return lstSearch[0]
-
-def get_ConfEV(strPath):
-    """ Return ConfEVTY raster name given TDIS path. """
-    lstSearch = glob.glob(strPath + os.sep + CONFSUFFIX + '_*.bsq')
-    if len(lstSearch) != 1:
-        raise Exception('Non-unique or missing event confidence image: ' + str(lstSearch))
-    return lstSearch[0]
-
-def IngestFramesPartial(strPathScene_, BANDNAME_, tupShp, lRawDates=None, bReturnDateLU=False):
-    """ Return ND array of DF frames.
-        No cloud masking done.
-        No transform or change of arr dtype
-    """
-    strDartPath = getDartDir(strPathScene_)
-    strFramesPath = getENVIframeDir(strPathScene_, sSubDir='all_frames')
-    strMasksPath = getDMDir(strPathScene_)
-
-    print('\tIngest and mask frames...')
-    if lRawDates is None:
-        print('\tResiduals...')
-        lstFrames = glob.glob(strDartPath + r'/DF_*.bsq')
-        lstFrames.sort()
-    else:
-        print('\tRaw...')
-        lstFrames = glob.glob(strFramesPath + r'/FR_*.bsq')
-        lstFrames = [f for f in lstFrames if getDate_nF(f)[0] in lRawDates]
-        lstFrames.sort()
-
-    # intialize target
-    # note: arr3D_Index is NOT initiallized with an extra band [0,:,:] as in IngestFrames.
-    nrow, ncol = tupShp
-    arr3D_Index_ = np.zeros((len(lstFrames), nrow, ncol), dtype=np.int16)
-    arr3D_Mask_ = np.zeros((len(lstFrames), nrow, ncol), dtype=np.int16)
-    dicLU = {}
-    dicLUdate = {}
-    print('\t\tZeros: ', arr3D_Index_.shape)
-    for i, fr in enumerate(lstFrames):
-        iHDR = envi_header.HDR(fr)
-        strBand = iHDR.bandName_wild(BANDNAME_)
-        strPathFR = fr + os.sep + strBand
-        strDate, strnF = getDate_nF(fr)
-        strPathDM = strMasksPath + r'/DM_' + strDate + '_' + strnF + '.bsq'
-
-        print('\t\t' + strBand)
-        arr3D_Index_[i, :, :] = arcpy.RasterToNumPyArray(strPathFR, ncols=ncol, nrows=nrow)
-        arr3D_Mask_[i, :, :] = arcpy.RasterToNumPyArray(strPathDM, ncols=ncol, nrows=nrow)
-        dicLU[int(strnF)] = i
-        dicLUdate[i] = strDate
-
-    if bReturnDateLU:
-        return arr3D_Index_, arr3D_Mask_, dicLU, dicLUdate
-
-    return arr3D_Index_, arr3D_Mask_, dicLU
-
-def getDate_nF(r):
-    """ Return date and frame number given raster name.
-        Works for DM, DF and FR bsqs.
-    """
-    return os.path.splitext(os.path.basename(r))[0].split('_')[1:3]
-
-if __name__ == "__main__":
-    pass
+"""
+---------------------------------------------------------------------------
+ EDARTUtility.py
+ 09/2018
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ Script to: EDART post processing support functions.
+ Many of these functions could in theory be moved to a more generic
+    raster module, but all should be assumed to make assumptions specific
+    to EDART outputs.
+
+ V1. changes to working dir functions. remove support for older working dir methods
+
+ Known limitations: python 3.x
+---------------------------------------------------------------------------
+"""
+import os
+import glob
+import shutil
+import sys
+import time
+import calendar
+import functools
+import concurrent.futures
+import numpy as np
+sys.path.append(os.path.abspath(r'..'))
+import envi_header
+import raster.rasterIO as rastIO
+import frame_cache
+
+# ------------------------------
+# event timing raster (EVTY)
+EVENTSUFFIX = 'EVTY'
+# corresponding confidence raster (ConfEV)
+CONFSUFFIX = 'ConfEV'
+# low confidence suffix
+EVENTXSUFFIX = 'EVpTY'
+# event frame raster
+FRAMEEVENTSUFFIX = 'nFrEV'
+# prepost stat raster
+PPSUFFIX = 'PPEVdif'
+# DM mask values kept (as prepost_utility.drop_masked): 0 or >= MASKKEEPMIN
+MASKKEEPMIN = 200
+# index value of dropped pixels with IngestFramesPartial sMask_='sentinel'
+MASKSENTINEL = np.iinfo(np.int16).min
+# FrameCache band name of the DM mask cube (see FrameCaches)
+MASKCACHE = 'DM'
+
+# ---------------------------------------------------------------------------
+# numpy related and for pool
+def testYear(a, intY, intYEnd=None):
+    """ Return 1 where intY <= a < intYEnd, else 0.
+        Works 2 and 3D.
+    """
+    if intYEnd is None:
+        intYEnd = intY + 1
+    return (np.where(a >= intY, 1, 0) & np.where(a < intYEnd, 1, 0)).astype(np.uint8)
+
+def testMoistureYear(a, intY):
+    """ Return 1 where intY < a >= intY else 0.
+        Works 2 and 3D.
+        Currently hardcoded for Oct 1 start date:
+            intY = 2000 --> from Oct1 2000 thru sept30 2001
+    """
+    return testYear(a, *YearBounds(intY, True))
+
+def YearBounds(intY, bolMoistureYear=False):
+    """ Return (start, end) of year intY as tested by testYear (calendar)
+            or testMoistureYear (bolMoistureYear, Oct 1 start).
+    """
+    if not bolMoistureYear:
+        return intY, intY + 1
+
+    intD = 274
+    intDL = 275
+    # set start and end
+    fltY = intY + intD/365
+    fltYEnd = intY + 1 + intD/365
+    # Check for leap year start and end
+    if calendar.isleap(intY):
+        fltY = intY + intDL/366
+    if calendar.isleap(intY + 1):
+        fltYEnd = intY + 1 + intDL/366
+
+    return fltY, fltYEnd
+
+def YearEdges(lstYears, bolMoistureYear=False, npType=np.float64):
+    """ Return (edges, lookup) for YearBucket of arrays of dtype npType: sorted year bounds
+            (YearBounds, leap years resolved once) and int8 (int16 if > 127 years) lookup
+            of searchsorted position to index into lstYears, -1 if none.
+    """
+    return BoundEdges([YearBounds(y, bolMoistureYear) for y in lstYears], npType)
+
+def BoundEdges(lstBounds, npType=np.float64):
+    """ Return (edges, lookup) for YearBucket of non overlapping (start, end) intervals
+            lstBounds (start <= value < end), as YearEdges. Index is into lstBounds.
+    """
+    arrBounds = np.array(lstBounds, dtype=np.float64).reshape(-1, 2)
+    if np.dtype(npType).kind == 'f':
+        # testYear compares in the array's dtype
+        arrBounds = arrBounds.astype(npType)
+    arrEdges = np.unique(arrBounds)
+
+    arrLU = np.full(len(arrEdges) + 1, -1, dtype=np.int8 if len(arrBounds) < 128 else np.int16)
+    for i, (s, e) in enumerate(arrBounds):
+        arrLU[np.searchsorted(arrEdges, s) + 1:np.searchsorted(arrEdges, e) + 1] = i
+    return arrEdges, arrLU
+
+def YearBucket(a, lstYears, bolMoistureYear=False, tupEdges=None):
+    """ Return int8 (int16 if > 127 years) array of index into lstYears of the year each
+            value of a falls in, -1 if none. Same bounds and comparisons as testYear /
+            testMoistureYear, but one pass for all years.
+        Works 2 and 3D, e.g. whole event cube to a compact year bucket cube.
+        Optional tupEdges: YearEdges(lstYears, bolMoistureYear, a.dtype), to reuse for many arrays.
+    """
+    arrEdges, arrLU = tupEdges or YearEdges(lstYears, bolMoistureYear, a.dtype)
+    return arrLU[np.searchsorted(arrEdges, a, side='right')]
+
+def YearReduce(arr3_Bucket, arr3_Val, intYears, strStat='sum'):
+    """ Return (year, row, col) statistic over bands of arr3_Val grouped by year bucket
+            cube arr3_Bucket (YearBucket): 'sum', 'max', 'min' or 'count'.
+        One pass over the bands for all intYears years.
+        Pixels without values in a year are 0, otherwise 'max' and 'min' are of the
+            values in the year only (running extremes start from the first value).
+    """
+    dicUfunc = {'sum': np.add, 'max': np.maximum, 'min': np.minimum, 'count': np.add}
+    if strStat not in dicUfunc:
+        raise Exception(f'YearReduce, strStat must be one of {list(dicUfunc)}.')
+    if strStat == 'sum':
+        # as np.sum: integers accumulate in int64
+        npType = np.int64 if arr3_Val.dtype.kind in 'biu' else arr3_Val.dtype
+    elif strStat == 'count':
+        npType = np.int32
+    else:
+        npType = arr3_Val.dtype
+
+    tupShp = arr3_Val.shape[1:]
+    arrOut = np.zeros((intYears, int(np.prod(tupShp))), dtype=npType)
+    # max, min: pixels with a value so far in each year
+    arrHas = np.zeros(arrOut.shape, dtype=bool) if strStat in ('max', 'min') else None
+    for b in range(arr3_Val.shape[0]):
+        arrK = arr3_Bucket[b].reshape(-1)
+        arrP = np.flatnonzero(arrK >= 0)
+        arrK = arrK[arrP]
+        # one value per pixel per band, so fancy index update has no duplicates
+        arrV = 1 if strStat == 'count' else arr3_Val[b].reshape(-1)[arrP]
+        if arrHas is None:
+            arrOut[arrK, arrP] = dicUfunc[strStat](arrOut[arrK, arrP], arrV)
+        else:
+            arrOut[arrK, arrP] = np.where(arrHas[arrK, arrP], dicUfunc[strStat](arrOut[arrK, arrP], arrV), arrV)
+            arrHas[arrK, arrP] = True
+
+    return arrOut.reshape((intYears,) + tupShp)
+
+# ---------------------------------------------------------------------------
+# path and file related
+def getSceneDir(strPathTDIS):
+    """ Return scene folder given TDIS folder. """
+    if not r'envi_aux\TDIS' in strPathTDIS:
+        raise Exception(r'pattern match "envi_aux\TDIS" not found.')
+    return strPathTDIS.split(r'envi_aux\TDIS')[0]
+
+def getDMDir(strPathScene):
+    """ Return directory containing cloud masks
+        mask bsqs in this dir are named DM_yyyy.mm.dd_X.bsq
+    """
+    return strPathScene + r'envi_aux\Images'
+
+def getDartDir(strPathScene):
+    """ Return directory containing 
+    """
+    strWild = strPathScene + r'envi_aux\Images\DF_*'
+    lstDirs = [f for f in glob.glob(strWild) if os.path.isdir(f)]
+
+    if len(lstDirs) == 0:
+        raise Exception('No match found for: ' + strWild)
+    elif len(lstDirs) > 1:
+        raise Exception('Multiple matchs found for: ' + strWild)
+
+    return lstDirs[0]
+
+def getENVIframeDir(strPathScene, sSubDir=None):
+    """ Return directory containing envi frames
+        frame bsqs in this dir are named FR_yyyy.mm.dd_X.bsq
+        Optional subdirectory name sSubDir. workaround for non standard directory organization.
+    """
+    strWild = strPathScene + r'SEQhdr\ENVI_FR*'
+    if sSubDir is not None:
+        strWild = strWild + os.sep + sSubDir
+
+    lstDirs = [f for f in glob.glob(strWild) if os.path.isdir(f)]
+
+    if len(lstDirs) == 0:
+        raise Exception('No match found for: ' + strWild)
+    elif len(lstDirs) > 1:
+        raise Exception('Multiple matchs found for: ' + strWild)
+
+    return lstDirs[0]
+
+def get_workspace(strOrigPath, strType_='flatten', strSuff_=''):
+    """ Return TDIS working (flatten) path given TDIS path. """
+    if os.path.split(strOrigPath)[1].startswith('TDISm__'):
+        strScene = strOrigPath.split(os.sep)[-4].split('_')[0]
+        p, f = os.path.split(strOrigPath)
+        strWorkPath = p + os.sep + strScene + '_' + f + '_' + strType_ + strSuff_
+    else:
+        print('Archive style folder name.')
+        strWorkPath = strOrigPath + '_flatten'
+
+    return strWorkPath
+
+def expand2TDISpath(strPath):
+    """ Return full TDIS working folder (.../envi_aux/TDIS/TDISm__*) given only scene folder.
+        Raise exception if zero or more than one match is found.
+    """
+    if 'TDISm__' in os.path.split(strPath)[1]:
+        return strPath
+
+    strWild = strPath + r'\envi_aux\TDIS\TDISm__*'
+    lstDirs = glob.glob(strWild)
+    if len(lstDirs) == 0:
+        raise Exception('No match found for: ' + strWild)
+    elif len(lstDirs) > 1:
+        raise Exception('Multiple matchs found for: ' + strWild)
+
+    return lstDirs[0]
+
+def prep_workspace(strOriginalPath, strType_, strSuff_='', bolRedo_=False, bolReuse_=False):
+    """ Determine and create workspace folder
+        Options:
+            bolRedo_: Delete existing working folder and redo.
+            bolReuse_: Return existing working folder instead of None (incremental runs).
+    """
+    print('\tPrep...')
+    strWorkingPath = get_workspace(strOriginalPath, strType_=strType_, strSuff_=strSuff_)
+    print('\t\tWorking path: ' + strWorkingPath)
+    if os.path.exists(strWorkingPath):
+        if bolRedo_:
+            print('\t\tRemoving old run.')
+            shutil.rmtree(strWorkingPath)
+            time.sleep(2)
+            os.makedirs(strWorkingPath)
+        elif not bolReuse_:
+            return None
+    else:
+        os.makedirs(strWorkingPath)
+
+    return strWorkingPath
+
+def ImgHdrPair(strPathImg, strExt='.hdr'):
+    """ Return raster and header path given raster. """
+    return (strPathImg, strPathImg[:-4] + strExt)
+
+def CopyBsq(lstBsq, strOutPath):
+    """ Copy all bsqs in lstBsq to strOutPath.
+        Optionally copy to os.cwd if strOutPath is None
+    """
+    lstCopied = []
+    for inB in lstBsq:
+        inB, inH = ImgHdrPair(inB)
+        outB, outH = [strOutPath + os.sep + os.path.basename(f) for f in [inB, inH]]
+        shutil.copy(inB, outB)
+        shutil.copy(inH, outH)
+
+        lstCopied.append(outB)
+
+    return lstCopied
+
+def get_PPEVdif(strPath, strBand_, strStat_='Median'):
+    """ Return FrEV raster name given TDIS path.
+        Should combine with below functions
+    """
+    lstSearch = glob.glob(strPath + os.sep + PPSUFFIX + '_' + strStat_ + '_' + strBand_ + '*.tif')
+    if len(lstSearch) != 1:
+        raise Exception('Non-unique or missing propost stat image: ' + str(lstSearch))
+    return lstSearch[0]
+
+def get_nFrEV(strPath):
+    """ Return FrEV raster name given TDIS path.
+        Should combine with below functions
+    """
+    lstSearch = glob.glob(strPath + os.sep + FRAMEEVENTSUFFIX + '_*.bsq')
+    if len(lstSearch) != 1:
+        raise Exception('Non-unique or missing nFrEV image: ' + str(lstSearch))
+    return lstSearch[0]
+
+def get_EVTY(strPath):
+    """ Return EVTY raster name given TDIS path. """
+    lstSearch = glob.glob(strPath + os.sep + EVENTSUFFIX + '_*.bsq')
+    if len(lstSearch) != 1:
+        raise Exception('Non-unique or missing event timing image: ' + str(lstSearch))
+    return lstSearch[0]
+
+def get_ConfEV(strPath):
+    """ Return ConfEVTY raster name given TDIS path. """
+    lstSearch = glob.glob(strPath + os.sep + CONFSUFFIX + '_*.bsq')
+    if len(lstSearch) != 1:
+        raise Exception('Non-unique or missing event confidence image: ' + str(lstSearch))
+    return lstSearch[0]
+
+def ReadBandMemmap(iHDR, band, tupShp):
+    """ Return band (name or index) of ENVI raster given its envi_header.HDR, read through
+            np.memmap so only that band's bytes are read.
+        Window as RasterToNumPyArray with nrows, ncols = tupShp (from lower left).
+    """
+    nrow, ncol = tupShp
+    return iHDR.band(band)[iHDR.lines - nrow:, :ncol]
+
+def MaskKeep(aM_):
+    """ Return boolean array, True where DM mask value aM_ is kept (0 or >= MASKKEEPMIN). """
+    return (aM_ == 0) | (aM_ >= MASKKEEPMIN)
+
+def UnpackMask(arr3D_Bits_, ncol):
+    """ Return boolean keep cube from IngestFramesPartial sMask_='bits' cube. """
+    return np.unpackbits(arr3D_Bits_, axis=-1, count=ncol).astype(bool)
+
+def ListFrames(strPathScene_, lRawDates=None):
+    """ Return sorted list of DF frame bsqs (residuals), or if lRawDates given,
+            FR frame bsqs (raw) for dates in lRawDates.
+    """
+    if lRawDates is None:
+        print('\tResiduals...')
+        lstFrames = glob.glob(getDartDir(strPathScene_) + r'/DF_*.bsq')
+    else:
+        print('\tRaw...')
+        strFramesPath = getENVIframeDir(strPathScene_, sSubDir='all_frames')
+        lstFrames = glob.glob(strFramesPath + r'/FR_*.bsq')
+        lstFrames = [f for f in lstFrames if getDate_nF(f)[0] in lRawDates]
+    lstFrames.sort()
+    return lstFrames
+
+def FramePaths(fr, lBANDNAME_, strMasksPath):
+    """ Return frame HDR, band names (resolved against the HDR), DM mask path, date and
+            frame number for frame fr and bands lBANDNAME_.
+        The frame HDR is parsed once for all bands.
+    """
+    iHDR = envi_header.HDR(fr)
+    lstBand = [iHDR.bandName_wild(b) for b in lBANDNAME_]
+    strDate, strnF = getDate_nF(fr)
+    return iHDR, lstBand, DMPath(fr, strMasksPath), strDate, strnF
+
+def DMPath(fr, strMasksPath):
+    """ Return path of DM mask of frame fr in strMasksPath. """
+    strDate, strnF = getDate_nF(fr)
+    return strMasksPath + r'/DM_' + strDate + '_' + strnF + '.bsq'
+
+def FrameCaches(strPathCache, strPathScene_, lBANDNAME_, lstFrames, tupShp, sMask_=None):
+    """ Return list of frame_cache.FrameCache of the index cube of each band of lBANDNAME_
+            and FrameCache of the shared DM mask cube (band MASKCACHE, None if sMask_='sentinel').
+        Index cubes depend on sMask_ only if 'sentinel' (dropped pixels set in the index),
+            the mask cube is also keyed by the DM files themselves.
+    """
+    sMaskIndex = sMask_ if sMask_ == 'sentinel' else None
+    lstCache = [frame_cache.FrameCache(strPathCache, strPathScene_, b, lstFrames, tupShp, sMaskIndex)
+                for b in lBANDNAME_]
+    iCacheMask = None
+    if sMask_ != 'sentinel':
+        strMasksPath = getDMDir(strPathScene_)
+        iCacheMask = frame_cache.FrameCache(strPathCache, strPathScene_, MASKCACHE, lstFrames, tupShp,
+                                            sMask_, [DMPath(fr, strMasksPath) for fr in lstFrames])
+    return lstCache, iCacheMask
+
+def IngestFramesPartial(strPathScene_, BANDNAME_, tupShp, lRawDates=None, bReturnDateLU=False,
+                        bMemmap=False, iThreads=1, strPathCache=None, sMask_=None):
+    """ Return ND array of DF frames.
+        No cloud masking done.
+        No transform or change of arr dtype
+        Single band IngestFramesMulti.
+        Optional bMemmap: read frames and masks directly from bsq via envi_header memmap
+            instead of the raster backend.
+        Optional iThreads: read up to iThreads frames concurrently (I/O releases the GIL),
+            progress is still reported in frame order. arcpy is not thread safe, so
+            threads are only used with bMemmap or the gdal backend.
+        Optional strPathCache: folder of frame_cache.FrameCache cubes (see FrameCaches).
+            Cubes for this scene, band and frame list are read from cache if present,
+            else ingested and written to it.
+        Optional sMask_: evaluate the DM keep test (MaskKeep) as masks are read and store
+            None: raw int16 DM cube (default)
+            'bool': boolean keep cube
+            'bits': keep cube bit packed along columns (np.packbits, see UnpackMask)
+            'sentinel': no mask cube (None returned), dropped index pixels set to MASKSENTINEL
+    """
+    arr4D_Index_, arr3D_Mask_, dicLU, dicLUdate = IngestFramesMulti(strPathScene_, [BANDNAME_], tupShp,
+                                                                    lRawDates, True, bMemmap, iThreads,
+                                                                    strPathCache, sMask_)
+    if bReturnDateLU:
+        return arr4D_Index_[0], arr3D_Mask_, dicLU, dicLUdate
+
+    return arr4D_Index_[0], arr3D_Mask_, dicLU
+
+def IngestFrameBands(i, fr, arr4D_Index_, arr3D_Mask_, lBANDNAME_, strMasksPath, bMemmap=False,
+                     sMask_=None):
+    """ Read bands lBANDNAME_ of frame fr into arr4D_Index_[:, i] and its DM mask once
+            into arr3D_Mask_[i].
+        Return band names, date and frame number.
+        Writes only frame i, so frames can be ingested concurrently.
+        sMask_: mask storage, see IngestFramesPartial.
+    """
+    iHDR, lstBand, strPathDM, strDate, strnF = FramePaths(fr, lBANDNAME_, strMasksPath)
+
+    tupShp = arr4D_Index_.shape[2:]
+    nrow, ncol = tupShp
+    for j, strBand in enumerate(lstBand):
+        if bMemmap:
+            arr4D_Index_[j, i, :, :] = ReadBandMemmap(iHDR, strBand, tupShp)
+        else:
+            arr4D_Index_[j, i, :, :] = rastIO.RasterToNumPyArray(fr + os.sep + strBand,
+                                                                 ncols=ncol, nrows=nrow)
+    if bMemmap:
+        aM = ReadBandMemmap(envi_header.HDR(strPathDM), 0, tupShp)
+    else:
+        aM = rastIO.RasterToNumPyArray(strPathDM, ncols=ncol, nrows=nrow)
+
+    if sMask_ is None:
+        arr3D_Mask_[i, :, :] = aM
+    elif sMask_ == 'bool':
+        arr3D_Mask_[i, :, :] = MaskKeep(aM)
+    elif sMask_ == 'bits':
+        arr3D_Mask_[i, :, :] = np.packbits(MaskKeep(aM), axis=-1)
+    else:
+        arr4D_Index_[:, i][:, ~MaskKeep(aM)] = MASKSENTINEL
+
+    return lstBand, strDate, strnF
+
+def IngestFramesMulti(strPathScene_, lBANDNAME_, tupShp, lRawDates=None, bReturnDateLU=False,
+                      bMemmap=False, iThreads=1, strPathCache=None, sMask_=None, bDict=False):
+    """ Multi band IngestFramesPartial.
+        Return (band, frame, row, col) index cube for bands lBANDNAME_ and one shared
+            (frame, row, col) mask cube, plus dicLU (and dicLUdate).
+        Frame directory is listed and each frame HDR and DM mask read once for all bands.
+        Whole frames are held for every band, for sample points use ExtractFramesPointsMulti.
+        Optional bDict: return index cubes as dictionary {band name: (frame, row, col) cube}
+            (views of the 4D cube).
+        Optional bMemmap, iThreads, sMask_: as IngestFramesPartial.
+        Optional strPathCache: index cube per band and one mask cube (FrameCaches).
+            Read from cache only if every cube is cached, else ingested and every cube
+            written (so later single band IngestFramesPartial calls are cache hits).
+    """
+    if sMask_ not in (None, 'bool', 'bits', 'sentinel'):
+        raise Exception(f'IngestFramesMulti, unknown sMask_: {sMask_}.')
+    if sMask_ == 'bits' and strPathCache:
+        raise Exception('IngestFramesMulti, bit packed mask can not be cached.')
+    if len(set(lBANDNAME_)) != len(lBANDNAME_):
+        raise Exception('IngestFramesMulti, duplicate band names: ' + str(lBANDNAME_))
+    strMasksPath = getDMDir(strPathScene_)
+
+    print('\tIngest and mask frames, ' + str(len(lBANDNAME_)) + ' bands...')
+    lstFrames = ListFrames(strPathScene_, lRawDates)
+    nrow, ncol = tupShp
+
+    arr4D_Index_ = None
+    if strPathCache:
+        lstCache, iCacheMask = FrameCaches(strPathCache, strPathScene_, lBANDNAME_, lstFrames, tupShp,
+                                           sMask_)
+        if all(iCache.exists() for iCache in lstCache) and (iCacheMask is None or iCacheMask.exists()):
+            print('\t\tFrom cache: ' + strPathCache)
+            arr4D_Index_ = np.zeros((len(lBANDNAME_), len(lstFrames), nrow, ncol), dtype=np.int16)
+            for j, iCache in enumerate(lstCache):
+                arr4D_Index_[j] = iCache.read()[0]
+            arr3D_Mask_ = iCacheMask.read()[1] if iCacheMask else None
+            dicLU, dicLUdate = lstCache[0].lookups()
+
+    if arr4D_Index_ is None:
+        # intialize target
+        # note: arr4D_Index is NOT initiallized with an extra frame [:,0,:,:] as in IngestFrames.
+        arr4D_Index_ = np.zeros((len(lBANDNAME_), len(lstFrames), nrow, ncol), dtype=np.int16)
+        if sMask_ is None:
+            arr3D_Mask_ = np.zeros((len(lstFrames), nrow, ncol), dtype=np.int16)
+        elif sMask_ == 'bool':
+            arr3D_Mask_ = np.zeros((len(lstFrames), nrow, ncol), dtype=bool)
+        elif sMask_ == 'bits':
+            arr3D_Mask_ = np.zeros((len(lstFrames), nrow, (ncol + 7) // 8), dtype=np.uint8)
+        else:
+            arr3D_Mask_ = None
+        dicLU = {}
+        dicLUdate = {}
+        print('\t\tZeros: ', arr4D_Index_.shape)
+
+        if iThreads > 1 and not (bMemmap or rastIO.isGDAL()):
+            print('\t\tarcpy backend, ingesting sequentially.')
+            iThreads = 1
+
+        fIngest = functools.partial(IngestFrameBands, arr4D_Index_=arr4D_Index_,
+                                    arr3D_Mask_=arr3D_Mask_, lBANDNAME_=lBANDNAME_,
+                                    strMasksPath=strMasksPath, bMemmap=bMemmap, sMask_=sMask_)
+        with concurrent.futures.ThreadPoolExecutor(iThreads) as pool:
+            # map yields in frame order as reads complete
+            for i, (lstBand, strDate, strnF) in enumerate(pool.map(fIngest, range(len(lstFrames)),
+                                                                   lstFrames)):
+                print(f'\t\t{os.path.basename(lstFrames[i])} ({i + 1}/{len(lstFrames)})')
+                dicLU[int(strnF)] = i
+                dicLUdate[i] = strDate
+
+        if strPathCache:
+            print('\t\tTo cache: ' + strPathCache)
+            for j, iCache in enumerate(lstCache):
+                iCache.write(arr4D_Index_[j], None, dicLU, dicLUdate)
+            if iCacheMask:
+                iCacheMask.write(None, arr3D_Mask_, dicLU, dicLUdate)
+
+    if bDict:
+        arr4D_Index_ = {b: arr4D_Index_[j] for j, b in enumerate(lBANDNAME_)}
+
+    if bReturnDateLU:
+        return arr4D_Index_, arr3D_Mask_, dicLU, dicLUdate
+
+    return arr4D_Index_, arr3D_Mask_, dicLU
+
+def ReadPoints(strPathRast, iHDR, band, aRows, aCols, tupShp, bMemmap=False):
+    """ Return 1D array of values of ENVI raster band at pixels aRows, aCols.
+        strPathRast: band path for raster backend, band: band name or index for memmap.
+        aRows, aCols index a raster of shape tupShp sharing the lower left corner
+            (as IngestFramesPartial windows).
+        bMemmap: fancy index the band memmap, only pages holding the points are read.
+            Else 1 x 1 pixel reads through the raster backend, anchored at pixel centers so
+            float error in large map coordinates can't shift the read by a pixel.
+    """
+    aRowsF = np.asarray(aRows) + iHDR.lines - tupShp[0]
+    aCols = np.asarray(aCols)
+    if bMemmap:
+        return np.asarray(iHDR.band(band)[aRowsF, aCols])
+
+    return np.array([rastIO.RasterToNumPyArray(strPathRast,
+                                               rastIO.Point(iHDR.XMin + (c + 0.5) * iHDR.CellSizeX,
+                                                            iHDR.YMax - (r + 0.5) * iHDR.CellSizeY),
+                                               1, 1)[0, 0]
+                     for r, c in zip(aRowsF, aCols)])
+
+def ExtractFrameBands(i, fr, aRows, aCols, tupShp, arr3D_Index_, arr2D_Mask_, lBANDNAME_, strMasksPath,
+                      bMemmap=False):
+    """ Read bands lBANDNAME_ of frame fr at pixels aRows, aCols into arr3D_Index_[:, i]
+            and its DM mask once into arr2D_Mask_[i].
+        Return band names, date and frame number.
+    """
+    iHDR, lstBand, strPathDM, strDate, strnF = FramePaths(fr, lBANDNAME_, strMasksPath)
+    for j, strBand in enumerate(lstBand):
+        arr3D_Index_[j, i, :] = ReadPoints(fr + os.sep + strBand, iHDR, strBand, aRows, aCols, tupShp,
+                                           bMemmap)
+    arr2D_Mask_[i, :] = ReadPoints(strPathDM, envi_header.HDR(strPathDM), 0, aRows, aCols, tupShp,
+                                   bMemmap)
+
+    return lstBand, strDate, strnF
+
+def ExtractFramesPoints(strPathScene_, BANDNAME_, tupShp, aRows, aCols, lRawDates=None,
+                        bMemmap=True, iThreads=1, strPathCache=None):
+    """ Point version of IngestFramesPartial, single band ExtractFramesPointsMulti.
+        Return (frame, point) index and mask arrays for pixels aRows, aCols of a
+            raster of shape tupShp, plus dicLU and dicLUdate.
+    """
+    arr3D_Index_, arr2D_Mask_, dicLU, dicLUdate = ExtractFramesPointsMulti(strPathScene_, [BANDNAME_],
+                                                                           tupShp, aRows, aCols,
+                                                                           lRawDates, bMemmap, iThreads,
+                                                                           strPathCache)
+    return arr3D_Index_[0], arr2D_Mask_, dicLU, dicLUdate
+
+def ExtractFramesPointsMulti(strPathScene_, lBANDNAME_, tupShp, aRows, aCols, lRawDates=None,
+                             bMemmap=True, iThreads=1, strPathCache=None):
+    """ Point version of IngestFramesMulti.
+        Return (band, frame, point) index array for bands lBANDNAME_ and shared (frame, point)
+            DM mask array for pixels aRows, aCols of a raster of shape tupShp, plus dicLU
+            and dicLUdate.
+        Each frame HDR and DM mask is read once for all bands, only the needed pixels
+            are read from each band and mask.
+        Optional strPathCache: if frame_cache.FrameCache cubes of every band and the raw
+            mask exist (IngestFramesMulti, sMask_ None), points are read from their pixel
+            major strips instead.
+    """
+    if len(set(lBANDNAME_)) != len(lBANDNAME_):
+        raise Exception('ExtractFramesPointsMulti, duplicate band names: ' + str(lBANDNAME_))
+    strMasksPath = getDMDir(strPathScene_)
+
+    print('\tExtract frame points, ' + str(len(lBANDNAME_)) + ' bands...')
+    lstFrames = ListFrames(strPathScene_, lRawDates)
+
+    if strPathCache:
+        lstCache, iCacheMask = FrameCaches(strPathCache, strPathScene_, lBANDNAME_, lstFrames, tupShp)
+        if all(iCache.exists() for iCache in lstCache + [iCacheMask]):
+            print('\t\tFrom cache: ' + strPathCache)
+            arr3D_Index_ = np.stack([iCache.read_pixels(aRows, aCols)[0] for iCache in lstCache])
+            arr2D_Mask_ = iCacheMask.read_pixels(aRows, aCols)[1]
+            dicLU, dicLUdate = lstCache[0].lookups()
+            return arr3D_Index_, arr2D_Mask_, dicLU, dicLUdate
+    arr3D_Index_ = np.zeros((len(lBANDNAME_), len(lstFrames), len(aRows)), dtype=np.int16)
+    arr2D_Mask_ = np.zeros((len(lstFrames), len(aRows)), dtype=np.int16)
+    dicLU = {}
+    dicLUdate = {}
+
+    if iThreads > 1 and not (bMemmap or rastIO.isGDAL()):
+        iThreads = 1
+
+    fExtract = functools.partial(ExtractFrameBands, aRows=aRows, aCols=aCols, tupShp=tupShp,
+                                 arr3D_Index_=arr3D_Index_, arr2D_Mask_=arr2D_Mask_,
+                                 lBANDNAME_=lBANDNAME_, strMasksPath=strMasksPath, bMemmap=bMemmap)
+    with concurrent.futures.ThreadPoolExecutor(iThreads) as pool:
+        for i, (lstBand, strDate, strnF) in enumerate(pool.map(fExtract, range(len(lstFrames)), lstFrames)):
+            dicLU[int(strnF)] = i
+            dicLUdate[i] = strDate
+    print(f'\t\t{len(lstFrames)} frames, {len(aRows)} points')
+
+    return arr3D_Index_, arr2D_Mask_, dicLU, dicLUdate
+
+def getDate_nF(r):
+    """ Return date and frame number given raster name.
+        Works for DM, DF and FR bsqs.
+    """
+    return os.path.splitext(os.path.basename(r))[0].split('_')[1:3]
+
+if __name__ == "__main__":
+    pass
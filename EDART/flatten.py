@@ -1,200 +1,562 @@
-"""
----------------------------------------------------------------------------
- flatten.py
- 09/2018
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- v1b. performing 'flattening' of EDART timing and confidence products
-
- Known limitations: python 3
----------------------------------------------------------------------------
-"""
-import os
-import sys
-import time
-import numpy as np
-import arcpy
-import edart_utility as edU
-import flatten_utility as flatU
-sys.path.append(os.path.abspath(r'..\..\py3_general'))
-import py3_general.generalARC as gARC
-import py3_general.general as g
-import py3_general.NDarrayUtility as NDarrU
-import raster.rasterARCUtility as rastArcU
-
-def flatten_conf(strOriginalPath, strWorkingPath, RASTEXT_, lstYears_, iOpt):
-    """
-        Options: See options class iOpt
-    """
-    strPathInYear = edU.get_EVTY(strOriginalPath)
-    strPathInConf = edU.get_ConfEV(strOriginalPath)
-    arcpy.env.workspace = strWorkingPath
-    # lists of inetrmediates which may or may not be deleted at end
-    lstIntermed = []
-
-    # Ingest event and confidence bands from orig folder
-    arcpy.env.workspace = strPathInYear
-    lstYBNames = arcpy.ListRasters()
-    intBands = len(lstYBNames)
-    print('\n\t' + str(intBands) + ' event band(s) found.')
-    arcpy.env.workspace = strWorkPath
-
-    iDesc = gARC.getSimpleDesc(strPathInYear + os.sep + lstYBNames[0])
-
-    print('\n\tIngesting event and confidence bands ...')
-    t = time.time()
-    arr3D_Conf = arcpy.RasterToNumPyArray(strPathInConf)
-    arr3D_Evt = arcpy.RasterToNumPyArray(strPathInYear)
-
-    arr3D_ConfM = np.where(arr3D_Conf >= 20, arr3D_Conf, 0)
-    arr3D_EvtM = np.where(arr3D_Conf >= 20, arr3D_Evt, 0)
-    print('\t\t', g.elapsed_time(t))
-
-    print('\tRead confidence flags...')
-    arrConfFlags = NDarrU.in_list(arr3D_Conf[0, :, :], lstConfidenceFlags)
-    arrConfFlags = arrConfFlags.astype(np.int8)
-
-    lstEventFOut, lstArrEventF = [], []
-    lstConfFOut, lstArrConfF = [], []
-    print('\n\tStarting years...')
-
-    for y in lstYears_:
-        t = time.time()
-        print('\n\t\t' + str(y))
-        if iOpt.bolDoAsMoistureYear:
-            # test on moisture year
-            arr3D_EvtM_bol = edU.testMoistureYear(arr3D_EvtM, y)
-            strFileSuffix = '_Wat'
-        else:
-            # test on calendar year
-            arr3D_EvtM_bol = edU.testYear(arr3D_EvtM, y)
-            strFileSuffix = '_Cal'
-
-        if iOpt.bolDoAsMaxConf:
-            # filter for max conf event of the year
-            arrOutEvent, arrOutConf = flatU.fMaxConfEV(arr3D_EvtM_bol, arr3D_EvtM, arr3D_ConfM)
-        else:
-            # filter for last event of the year
-            arrOutEvent, arrOutConf = flatU.fLastEV(arr3D_EvtM_bol, arr3D_EvtM, arr3D_ConfM)
-        arrOutConf = arrOutConf.astype(np.int8)
-
-        # add in Confidence flags
-        print('\tFlags...')
-        # This will need som adjusting to get the right flags in.
-        arrOutEventF = np.where(arrConfFlags, -1, arrOutEvent)
-        arrOutConfF = np.where(arrConfFlags, arrConfFlags, arrOutConf)
-        arrOutConfF = arrOutConfF.astype(np.int8)
-
-        strEventFOut = 'Event_' + str(y) + strFileSuffix + RASTEXT_
-        rastArcU.ArrayToRaster(arrOutEventF, strEventFOut, iDesc, val2NoData=-1, bolVerbose=False)
-        lstEventFOut.append(strEventFOut)
-        lstArrEventF.append(arrOutEventF)
-        lstIntermed.append(strEventFOut)
-        strConfFOut = 'Confidence_' + str(y) + strFileSuffix + RASTEXT_
-        rastArcU.ArrayToRaster(arrOutConfF, strConfFOut, iDesc, bolVerbose=False)
-        lstConfFOut.append(strConfFOut)
-        lstArrConfF.append(arrOutConfF)
-        lstIntermed.append(strConfFOut)
-
-        print('\t\t\t', g.elapsed_time(t))
-        
-    # ---------------------------------------------------------
-    # Optional outputs
-    if iOpt.bolDoMaxConf or iOpt.bolDoSumConf:
-        # This is max (highest) and sum of flattened confidences
-        # so results will vary with flattening method
-        arrOutConfND = np.stack(lstArrConfF)
-        if iOpt.bolDoMaxConf:
-            print('\tOptional: MaxConf...')
-            strMaxConf = 'MaxConf' + strFileSuffix + RASTEXT_
-            arrMax = arrOutConfND.max(axis=0)
-            arrMaxF = np.where(arrConfFlags, arrConfFlags, arrMax)
-            rastArcU.ArrayToRaster(arrMaxF, strMaxConf, iDesc, bolVerbose=False)
-            del arrMax, arrMaxF
-
-        if iOpt.bolDoSumConf:
-            print('\tOptional: SumConf...')
-            strSumConf = 'SumConf'+ strFileSuffix + RASTEXT_
-            arrSum = arrOutConfND.sum(axis=0)
-            arrSumF = np.where(arrConfFlags, arrConfFlags, arrSum)
-            rastArcU.ArrayToRaster(arrSumF, strSumConf, iDesc, bolVerbose=False)
-            del arrSum, arrSumF
-
-        del arrOutConfND
-
-    if iOpt.bolDoLastEV:
-        # This is max (last) of flattened events
-        # so results will vary with flattening method
-        print('\tOptional: Last EV...')
-        strLastEV = 'LastEV' + RASTEXT_
-        arrOutEventND = np.stack(lstArrEventF)
-        arrLast = arrOutEventND.max(axis=0)
-        rastArcU.ArrayToRaster(arrLast, strLastEV, iDesc, bolVerbose=False)
-
-        del arrOutEventND, arrLast
-
-    return lstEventFOut, lstConfFOut, strFileSuffix
-
-# -------------------------------------------------------------------------------------------
-if __name__ == '__main__':
-    # ------------------------------
-    # User Variables
-    lstOrigPath = [r'N:\project\EDART_vol\edartOps\data\sc_ca\sc305ns_v4',
-                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc306ns_v3',
-                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc307ns_v3',
-                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc309ns_v5']
-
-    # Output raster file extention
-    RASTEXT = '.tif'
-    # Start and end years (inclusive)
-    intYearStart = 2008
-    intYearEnd = 2018
-    # Options
-    bolRedoExisting = False
-    bolDoAsMoistureYear = False
-    bolDoSumConf = True
-    bolDoMaxConf = True
-    bolDoLastEV = False
-    bolStackOutputs = True
-    strScratchWS = r'E:\swap2'
-    # confidence flags (Don't change)
-    lstConfidenceFlags = [-1, 1, 2]
-
-    # ------------------------------
-    lstYears = range(intYearStart, intYearEnd + 1)
-    if os.path.exists(strScratchWS):
-        arcpy.env.scratchWorkspace = strScratchWS
-
-    for strOrigPath in lstOrigPath:
-        strOrigPath = edU.expand2TDISpath(strOrigPath)
-        print('\n' + strOrigPath)
-        strSuf = '_CalenderYear'
-        if bolDoAsMoistureYear:
-            strSuf = '_WaterYear'
-        strWorkPath = edU.prep_workspace(strOrigPath, 'flattenConf' + strSuf,
-                                         bolRedo_=bolRedoExisting)
-
-        if strWorkPath:
-            iOptions = flatU.flattenOptions(strWorkPath, bolRedoExisting, bolDoAsMoistureYear,
-                                            bolDoSumConf, bolDoMaxConf, bolDoLastEV)
-            iOptions.record()
-
-            lstRastEVT, lstRastConf, strFileSuf = flatten_conf(strOrigPath, strWorkPath, RASTEXT,
-                                                               lstYears, iOptions)
-
-            if bolStackOutputs:
-                print('\tStacking:')
-                print('\t\tEvents..')
-                strPathEventStacked = strWorkPath + os.sep + edU.EVENTSUFFIX + '_PerYear' + strFileSuf + RASTEXT
-                rastArcU.StackRaster(lstRastEVT, strPathEventStacked)
-                print('\t\tConfidence..')
-                strPathConfStacked = strWorkPath + os.sep + edU.CONFSUFFIX + '_PerYear' + strFileSuf + RASTEXT
-                rastArcU.StackRaster(lstRastConf, strPathConfStacked)
-        else:
-            print('\t\tAlready done. Skipping.')
-            
-    print('Done.')
+"""
+---------------------------------------------------------------------------
+ flatten.py
+ 09/2018
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ v1b. performing 'flattening' of EDART timing and confidence products
+
+ Known limitations: python 3
+---------------------------------------------------------------------------
+"""
+import os
+import sys
+import csv
+import copy
+import math
+import time
+import shutil
+import multiprocessing
+import numpy as np
+try:
+    import arcpy
+except ImportError:
+    # gdal backend, see raster.rasterIO
+    arcpy = None
+import edart_utility as edU
+import flatten_utility as flatU
+sys.path.append(os.path.abspath(r'..\..\py3_general'))
+import py3_general.general as g
+import raster.rasterIO as rastIO
+import raster.rasterARCUtility as rastArcU
+
+# confidence flags (Don't change)
+lstConfidenceFlags = [-1, 1, 2]
+
+def flatten_arrays(arr3D_Conf, arr3D_Evt, lstYears_, iOpt, lstConfFlags_):
+    """ Return dictionary of flattened outputs for event and confidence arrays
+            (whole scene or one block):
+            'Event', 'Confidence': (year, row, col), confidence flags added.
+            'MaxConf', 'SumConf', 'LastEV': (row, col), if set in iOpt.
+    """
+    arr3D_ConfM = np.where(arr3D_Conf >= 20, arr3D_Conf, 0)
+    arr3D_EvtM = np.where(arr3D_Conf >= 20, arr3D_Evt, 0)
+    arrConfFlags = flatU.ConfFlags(arr3D_Conf, lstConfFlags_)
+
+    # max conf event or last event of each year, all years in one pass over year bucket cube
+    arr3_Bucket = edU.YearBucket(arr3D_EvtM, lstYears_, iOpt.bolDoAsMoistureYear)
+    arr3D_OutEvent, arr3D_OutConf = flatU.fFlattenYears(arr3D_EvtM, arr3D_ConfM, lstYears_,
+                                                         iOpt.bolDoAsMoistureYear, iOpt.bolDoAsMaxConf,
+                                                         arr3_Bucket)
+    del arr3D_ConfM, arr3D_EvtM, arr3_Bucket
+    arr3D_OutConf = arr3D_OutConf.astype(np.int8)
+
+    # add in Confidence flags
+    # This will need som adjusting to get the right flags in.
+    dicOut = {}
+    dicOut['Event'] = np.where(arrConfFlags, -1, arr3D_OutEvent)
+    dicOut['Confidence'] = np.where(arrConfFlags, arrConfFlags, arr3D_OutConf).astype(np.int8)
+    del arr3D_OutEvent, arr3D_OutConf
+
+    # Optional outputs
+    # This is max (highest) and sum of flattened confidences
+    # so results will vary with flattening method
+    if iOpt.bolDoMaxConf:
+        arrMax = dicOut['Confidence'].max(axis=0)
+        dicOut['MaxConf'] = np.where(arrConfFlags, arrConfFlags, arrMax)
+    if iOpt.bolDoSumConf:
+        arrSum = dicOut['Confidence'].sum(axis=0, dtype=np.int32)
+        dicOut['SumConf'] = np.where(arrConfFlags, arrConfFlags, arrSum)
+    if iOpt.bolDoLastEV:
+        # This is max (last) of flattened events
+        dicOut['LastEV'] = dicOut['Event'].max(axis=0)
+
+    return dicOut
+
+def flatten_outputs(strWorkingPath, RASTEXT_, lstYears_, iOpt, strFileSuffix):
+    """ Return list of (key, year index, path, nodata value) of flatten_arrays outputs
+            to write, and event and confidence stack paths.
+        Yearly rasters are listed if written or stacked.
+    """
+    lstOut = []
+    if iOpt.bolYearlyOutputs or iOpt.bolStackOutputs:
+        for i, y in enumerate(lstYears_):
+            lstOut.append(('Event', i, strWorkingPath + os.sep + 'Event_' + str(y) + strFileSuffix + RASTEXT_, -1))
+        for i, y in enumerate(lstYears_):
+            lstOut.append(('Confidence', i, strWorkingPath + os.sep + 'Confidence_' + str(y) + strFileSuffix + RASTEXT_, None))
+    if iOpt.bolDoMaxConf:
+        lstOut.append(('MaxConf', None, strWorkingPath + os.sep + 'MaxConf' + strFileSuffix + RASTEXT_, None))
+    if iOpt.bolDoSumConf:
+        lstOut.append(('SumConf', None, strWorkingPath + os.sep + 'SumConf' + strFileSuffix + RASTEXT_, None))
+    if iOpt.bolDoLastEV:
+        lstOut.append(('LastEV', None, strWorkingPath + os.sep + 'LastEV' + RASTEXT_, None))
+
+    strPathEventStacked = strWorkingPath + os.sep + edU.EVENTSUFFIX + '_PerYear' + strFileSuffix + RASTEXT_
+    strPathConfStacked = strWorkingPath + os.sep + edU.CONFSUFFIX + '_PerYear' + strFileSuffix + RASTEXT_
+    return lstOut, strPathEventStacked, strPathConfStacked
+
+def flatten_conf(strOriginalPath, strWorkingPath, RASTEXT_, lstYears_, iOpt):
+    """
+        Options: See options class iOpt
+        iOpt.intBlockSize: process in blocks, see flatten_conf_tiled.
+        iOpt.bolIncremental: rerun in existing working folder. Input fingerprints
+            (flatU.FileFingerprint), options (iOpt.fingerprint) and a fingerprint of each
+            output array (per year for yearly outputs) are kept in the manifest (flatU.MANIFEST).
+            Nothing is done if inputs and options are unchanged and all outputs exist, else
+            years are flattened and only outputs (and stacks) whose values or options changed,
+            or that are missing, are rewritten.
+            Tiled: blocks are flattened once for the fingerprints and again to write the
+            changed or missing outputs, if any. Fingerprints depend on block size, so a
+            changed intBlockSize rewrites all outputs once.
+    """
+    strPathInYear = edU.get_EVTY(strOriginalPath)
+    strPathInConf = edU.get_ConfEV(strOriginalPath)
+
+    # Ingest event and confidence bands from orig folder
+    lstYBNames = rastIO.ListBands(strPathInYear)
+    intBands = len(lstYBNames)
+    print('\n\t' + str(intBands) + ' event band(s) found.')
+
+    iDesc = rastIO.getSimpleDesc(strPathInYear + os.sep + lstYBNames[0])
+
+    if iOpt.bolDoAsMoistureYear:
+        # test on moisture year
+        strFileSuffix = '_Wat'
+    else:
+        # test on calendar year
+        strFileSuffix = '_Cal'
+    lstOut, strPathEventStacked, strPathConfStacked = flatten_outputs(strWorkingPath, RASTEXT_, lstYears_,
+                                                                      iOpt, strFileSuffix)
+    lstEventFOut = [o[2] for o in lstOut if o[0] == 'Event']
+    lstConfFOut = [o[2] for o in lstOut if o[0] == 'Confidence']
+    lstPathWritten = [o[2] for o in lstOut if o[1] is None or iOpt.bolYearlyOutputs]
+    if iOpt.bolStackOutputs:
+        lstPathWritten += [strPathEventStacked, strPathConfStacked]
+
+    # fingerprints
+    dicManifest = {'inputs': {'EVTY': flatU.FileFingerprint(strPathInYear, iOpt.bolHashInputs),
+                              'ConfEV': flatU.FileFingerprint(strPathInConf, iOpt.bolHashInputs)},
+                   'options': iOpt.fingerprint(), 'outputs': {}}
+    dicFPOld = {}
+    if iOpt.bolIncremental:
+        dicManifestOld = flatU.ReadManifest(strWorkingPath)
+        if (dicManifestOld.get('inputs') == dicManifest['inputs'] and
+                dicManifestOld.get('options') == dicManifest['options'] and
+                all(os.path.exists(p) for p in lstPathWritten)):
+            print('\tInputs and options unchanged, outputs up to date.')
+            return flatten_return(lstEventFOut, lstConfFOut, strFileSuffix, iOpt)
+        dicFPOld = dicManifestOld.get('outputs', {})
+        # outputs change from here on, old manifest no longer valid
+        if os.path.exists(strWorkingPath + os.sep + flatU.MANIFEST):
+            os.remove(strWorkingPath + os.sep + flatU.MANIFEST)
+
+    if iOpt.intBlockSize:
+        dicFP = dicManifest['outputs']
+        bolWrite = True
+        if iOpt.bolIncremental and dicFPOld:
+            # fingerprint pass, then write pass for changed (deleted) or missing outputs only
+            print('\n\tFingerprinting outputs...')
+            flatten_conf_tiled(strPathInYear, strPathInConf, iDesc, lstYears_, iOpt, lstOut,
+                               strPathEventStacked, strPathConfStacked, dicFP, bolWrite=False)
+            lstStale = [p for p in lstPathWritten if flatten_stale(p, dicFP, dicFPOld, iOpt)]
+            bolWrite = bool(lstStale)
+            dicFP = None
+        if bolWrite:
+            flatten_conf_tiled(strPathInYear, strPathInConf, iDesc, lstYears_, iOpt, lstOut,
+                               strPathEventStacked, strPathConfStacked, dicFP)
+    else:
+        print('\n\tIngesting event and confidence bands ...')
+        t = time.time()
+        arr3D_Conf = rastIO.RasterToNumPyArray(strPathInConf)
+        arr3D_Evt = rastIO.RasterToNumPyArray(strPathInYear)
+        print('\t\t', g.elapsed_time(t))
+
+        print('\n\tFlattening years...')
+        t = time.time()
+        dicOut = flatten_arrays(arr3D_Conf, arr3D_Evt, lstYears_, iOpt, lstConfidenceFlags)
+        del arr3D_Conf, arr3D_Evt
+        print('\t\t', g.elapsed_time(t))
+
+        print('\tWriting...')
+        dicFP = dicManifest['outputs']
+        for strKey, i, strPathOut, val2NoData in lstOut:
+            arrOut = dicOut[strKey] if i is None else dicOut[strKey][i]
+            dicFP[os.path.basename(strPathOut)] = flatU.ArrayFingerprint(arrOut, dicManifest['options'])
+            if i is not None and not iOpt.bolYearlyOutputs:
+                continue
+            if not flatten_stale(strPathOut, dicFP, dicFPOld, iOpt):
+                continue
+            rastIO.ArrayToRaster(arrOut, strPathOut, iDesc, val2NoData=val2NoData, bolVerbose=False,
+                                 **iOpt.writeOptions())
+
+        if iOpt.bolStackOutputs:
+            # write yearly arrays straight to multiband stacks, bands named as yearly rasters
+            flatten_stack_fingerprints(dicFP, lstEventFOut, lstConfFOut, strPathEventStacked,
+                                       strPathConfStacked)
+            print('\tStacking:')
+            print('\t\tEvents..')
+            if flatten_stale(strPathEventStacked, dicFP, dicFPOld, iOpt):
+                lstBandNames = [os.path.splitext(os.path.basename(r))[0] for r in lstEventFOut]
+                rastIO.StackArrays(list(dicOut['Event']), strPathEventStacked, iDesc, lstBandNames,
+                                   val2NoData=-1, **iOpt.writeOptions())
+            print('\t\tConfidence..')
+            if flatten_stale(strPathConfStacked, dicFP, dicFPOld, iOpt):
+                lstBandNames = [os.path.splitext(os.path.basename(r))[0] for r in lstConfFOut]
+                rastIO.StackArrays(list(dicOut['Confidence']), strPathConfStacked, iDesc, lstBandNames,
+                                   **iOpt.writeOptions())
+        del dicOut
+
+    flatU.WriteManifest(strWorkingPath, dicManifest)
+    return flatten_return(lstEventFOut, lstConfFOut, strFileSuffix, iOpt)
+
+def flatten_stale(strPathOut, dicFP, dicFPOld, iOpt):
+    """ Return True if strPathOut is to be written.
+        Incremental: existing output with changed fingerprint is deleted first,
+            unchanged output is kept.
+        Otherwise existing outputs are kept (ArrayToRaster skips them).
+    """
+    if not iOpt.bolIncremental or not os.path.exists(strPathOut):
+        return True
+    strName = os.path.basename(strPathOut)
+    if dicFPOld.get(strName) == dicFP[strName]:
+        print('\t\tUp to date: ' + strName)
+        return False
+    rastIO.DeleteRaster(strPathOut)
+    return True
+
+def flatten_stack_fingerprints(dicFP, lstEventFOut, lstConfFOut, strPathEventStacked, strPathConfStacked):
+    """ Add fingerprints of event and confidence stacks to dicFP: lists of their yearly
+            outputs' fingerprints.
+    """
+    for lstFOut, strPathStacked in ((lstEventFOut, strPathEventStacked), (lstConfFOut, strPathConfStacked)):
+        dicFP[os.path.basename(strPathStacked)] = [dicFP[os.path.basename(r)] for r in lstFOut]
+
+def flatten_return(lstEventFOut, lstConfFOut, strFileSuffix, iOpt):
+    """ Return flatten_conf results, yearly lists empty if yearly rasters not written. """
+    if not iOpt.bolYearlyOutputs:
+        # yearly rasters were not written
+        lstEventFOut, lstConfFOut = [], []
+    return lstEventFOut, lstConfFOut, strFileSuffix
+
+def flatten_conf_tiled(strPathInYear, strPathInConf, iDesc, lstYears_, iOpt, lstOut,
+                       strPathEventStacked, strPathConfStacked, dicFP=None, bolWrite=True):
+    """ Block-wise flatten_conf for scenes larger than memory.
+        Event and confidence stacks are read in iOpt.intBlockSize blocks, each block
+            is flattened (masking, year test, reduction, flags) and written as a block of
+            every output in lstOut (see flatten_outputs).
+        GDAL available: outputs and stacks are created once and every block is written straight
+            into them (flatten_tiled_writers).
+        arcpy only: blocks are written to the scratch folder and mosaicked to the outputs at
+            the end, yearly rasters not kept (iOpt.bolYearlyOutputs) are mosaicked to
+            scratch and only stacked.
+        Peak memory is bounded by block size.
+        Optional dicFP: add fingerprint of every output in lstOut and of the stacks
+            (flatU.FingerprintHash of its blocks), as flatten_conf.
+        bolWrite False: fingerprints only, nothing is written.
+    """
+    bolDirect = rastIO.hasGDAL()
+    dicHash = {}
+    if bolWrite and not bolDirect:
+        strPathScratch = rastIO.ScratchFolder('flatten_')
+        dicBlocks = {strPathOut: [] for strKey, i, strPathOut, val2NoData in lstOut}
+        dicTypes = {}
+    lstWriters = None
+
+    print('\n\tFlattening blocks...')
+    t = time.time()
+    for b, (intRow, intCol, intRows, intCols) in enumerate(rastArcU.IterBlocks(iDesc, iOpt.intBlockSize)):
+        iDescB = rastArcU.BlockDesc(iDesc, intRow, intCol, intRows, intCols)
+        arr3D_Conf = rastIO.RasterToNumPyBlock(strPathInConf, iDescB)
+        arr3D_Evt = rastIO.RasterToNumPyBlock(strPathInYear, iDescB)
+        dicOut = flatten_arrays(arr3D_Conf, arr3D_Evt, lstYears_, iOpt, lstConfidenceFlags)
+        del arr3D_Conf, arr3D_Evt
+
+        if dicFP is not None:
+            for strKey, i, strPathOut, val2NoData in lstOut:
+                arrOut = dicOut[strKey] if i is None else dicOut[strKey][i]
+                if strPathOut not in dicHash:
+                    dicHash[strPathOut] = flatU.FingerprintHash(arrOut.dtype, (iDesc.height, iDesc.width),
+                                                                iOpt.fingerprint(), iOpt.intBlockSize)
+                dicHash[strPathOut].update(np.ascontiguousarray(arrOut).tobytes())
+        if bolWrite and bolDirect:
+            if lstWriters is None:
+                # output dtypes known from first block
+                lstWriters = flatten_tiled_writers(dicOut, iDesc, iOpt, lstOut,
+                                                   strPathEventStacked, strPathConfStacked)
+            for strKey, i, iWriter in lstWriters:
+                iWriter.write(dicOut[strKey] if i is None else dicOut[strKey][i], intRow, intCol)
+        elif bolWrite:
+            for j, (strKey, i, strPathOut, val2NoData) in enumerate(lstOut):
+                arrOut = dicOut[strKey] if i is None else dicOut[strKey][i]
+                strBlockOut = strPathScratch + os.sep + f'out{j}_block{b}.tif'
+                rastIO.ArrayToRaster(arrOut, strBlockOut, iDescB, val2NoData, bolVerbose=False,
+                                     **rastIO.ScratchOptions())
+                dicBlocks[strPathOut].append(strBlockOut)
+                dicTypes[strPathOut] = arrOut.dtype
+        del dicOut
+        print(f'\t\tBlock {b}: rows {intRow}-{intRow + intRows}, cols {intCol}-{intCol + intCols}')
+    print('\t\t', g.elapsed_time(t))
+
+    if dicFP is not None:
+        dicFP.update({os.path.basename(p): h.hexdigest() for p, h in dicHash.items()})
+        if iOpt.bolStackOutputs:
+            flatten_stack_fingerprints(dicFP, [o[2] for o in lstOut if o[0] == 'Event'],
+                                       [o[2] for o in lstOut if o[0] == 'Confidence'],
+                                       strPathEventStacked, strPathConfStacked)
+    if not bolWrite:
+        return
+
+    if bolDirect:
+        print('\tClosing outputs...')
+        t = time.time()
+        for strKey, i, iWriter in lstWriters:
+            iWriter.close()
+        print('\t\t', g.elapsed_time(t))
+        return
+
+    print('\tMosaic blocks...')
+    t = time.time()
+    dicMosaic = {}
+    for strKey, i, strPathOut, val2NoData in lstOut:
+        strPathM = strPathOut
+        if i is not None and not iOpt.bolYearlyOutputs:
+            # stack only, keep band name of yearly raster
+            strPathM = strPathScratch + os.sep + os.path.basename(strPathOut)
+        if os.path.exists(strPathM):
+            print('Already saved: ' + strPathM)
+        else:
+            rastIO.MosaicBlocks(dicBlocks[strPathOut], strPathM, iDesc, dicTypes[strPathOut], val2NoData)
+        dicMosaic[strPathOut] = strPathM
+    print('\t\t', g.elapsed_time(t))
+
+    if iOpt.bolStackOutputs:
+        print('\tStacking:')
+        for strKey, strPathStacked in (('Event', strPathEventStacked), ('Confidence', strPathConfStacked)):
+            print(f'\t\t{strKey}..')
+            if os.path.exists(strPathStacked):
+                print('Already saved: ' + strPathStacked)
+                continue
+            rastIO.StackRaster([dicMosaic[o[2]] for o in lstOut if o[0] == strKey], strPathStacked)
+
+    shutil.rmtree(strPathScratch)
+
+def flatten_tiled_writers(dicOut, iDesc, iOpt, lstOut, strPathEventStacked, strPathConfStacked):
+    """ Create outputs of flatten_conf_tiled at full extent (rasterIO.BlockRaster), dtypes from
+            dicOut of the first block.
+        Return list of (key, year index or None, writer), None: whole dicOut[key], i.e.
+            all years for the Event and Confidence stacks.
+        Existing outputs are kept and not written.
+    """
+    lstWriters = []
+    for strKey, i, strPathOut, val2NoData in lstOut:
+        if i is not None and not iOpt.bolYearlyOutputs:
+            continue
+        if os.path.exists(strPathOut):
+            print('Already saved: ' + strPathOut)
+            continue
+        arrOut = dicOut[strKey] if i is None else dicOut[strKey][i]
+        lstWriters.append((strKey, i, rastIO.BlockRaster(strPathOut, iDesc, 1, arrOut.dtype, val2NoData,
+                                                         **iOpt.writeOptions())))
+
+    if iOpt.bolStackOutputs:
+        for strKey, strPathStacked, val2NoData in (('Event', strPathEventStacked, -1),
+                                                   ('Confidence', strPathConfStacked, None)):
+            if os.path.exists(strPathStacked):
+                print('Already saved: ' + strPathStacked)
+                continue
+            # bands named as yearly rasters
+            lstBandNames = [os.path.splitext(os.path.basename(o[2]))[0] for o in lstOut
+                            if o[0] == strKey and o[1] is not None]
+            lstWriters.append((strKey, None, rastIO.BlockRaster(strPathStacked, iDesc, len(lstBandNames),
+                                                                dicOut[strKey].dtype, val2NoData,
+                                                                lstBandNames, **iOpt.writeOptions())))
+    return lstWriters
+
+# ---------------------------------------------------------------------------
+# batch
+def FlattenMemory(intPixels, intBands, intYears):
+    """ Return rough peak bytes of flatten_conf for intPixels pixels (scene or block):
+            ~13 bytes per band (stacks, masked copies, year buckets) and ~16 per year (outputs).
+    """
+    return intPixels * (13 * intBands + 16 * intYears)
+
+def BlockSizeForMemory(fltBytes, intBands, intYears, intMultiple=256):
+    """ Return largest block size (multiple of intMultiple) with FlattenMemory within fltBytes. """
+    intSize = int(math.sqrt(fltBytes / FlattenMemory(1, intBands, intYears)))
+    return max(intMultiple, intSize // intMultiple * intMultiple)
+
+def flatten_scene(strOrigPath, RASTEXT_, lstYears_, iOpt, bolRedo_=False, strScratchWS=None):
+    """ Prep workspace and flatten one scene, for pool.
+        strOrigPath: scene folder or its TDIS folder (edU.expand2TDISpath).
+        iOpt: flattenOptions template, path is set to the scene workspace.
+        Return dictionary of scene status (done, skipped or failed), timing and message.
+        Workspace of a failed scene is removed, so it is not skipped on the next run
+            (kept if iOpt.bolIncremental, next run redoes outputs not in the manifest).
+    """
+    t = time.time()
+    print('\n' + strOrigPath)
+    dicStatus = {'scene': strOrigPath, 'status': 'done', 'seconds': 0, 'blocksize': iOpt.intBlockSize,
+                 'workspace': '', 'message': ''}
+    if arcpy and strScratchWS and os.path.exists(strScratchWS):
+        arcpy.env.scratchWorkspace = strScratchWS
+
+    strSuf = '_CalenderYear'
+    if iOpt.bolDoAsMoistureYear:
+        strSuf = '_WaterYear'
+    try:
+        strOrigPath = edU.expand2TDISpath(strOrigPath)
+        strWorkPath = edU.prep_workspace(strOrigPath, 'flattenConf' + strSuf, bolRedo_=bolRedo_,
+                                         bolReuse_=iOpt.bolIncremental)
+    except Exception as e:
+        # bad scene path: logged as failed, batch goes on
+        print(f'\t\tFailed: {strOrigPath}\n\t\t{e!r}')
+        dicStatus['status'] = 'failed'
+        dicStatus['message'] = repr(e)
+        dicStatus['seconds'] = round(time.time() - t, 1)
+        return dicStatus
+    if not strWorkPath:
+        print('\t\tAlready done. Skipping.')
+        dicStatus['status'] = 'skipped'
+        return dicStatus
+
+    dicStatus['workspace'] = strWorkPath
+    iOpt = copy.copy(iOpt)
+    iOpt.path = strWorkPath
+    try:
+        iOpt.record()
+        flatten_conf(strOrigPath, strWorkPath, RASTEXT_, lstYears_, iOpt)
+    except Exception as e:
+        print(f'\t\tFailed: {strOrigPath}\n\t\t{e!r}')
+        dicStatus['status'] = 'failed'
+        dicStatus['message'] = repr(e)
+        if not iOpt.bolIncremental:
+            shutil.rmtree(strWorkPath, ignore_errors=True)
+
+    dicStatus['seconds'] = round(time.time() - t, 1)
+    return dicStatus
+
+def _flatten_scene(tupArgs):
+    """ flatten_scene for pool.imap_unordered. """
+    return flatten_scene(*tupArgs)
+
+def flatten_batch(lstOrigPath, RASTEXT_, lstYears_, iOpt, intWorkers=None, fltMemGB=None,
+                  bolRedo_=False, strScratchWS=None, strPathLog='flatten_batch_log.csv'):
+    """ Flatten scenes of lstOrigPath in a pool of intWorkers processes (default cpu count),
+            1: in this process.
+        Optional fltMemGB: memory budget for all workers. Scenes estimated (FlattenMemory)
+            to need more than fltMemGB / intWorkers are run tiled, blocks sized to fit.
+        Scenes with an existing workspace are skipped (edU.prep_workspace) unless bolRedo_,
+            or rerun incrementally if iOpt.bolIncremental (see flatten_conf).
+        Status and timing of each scene is appended to csv strPathLog as it finishes.
+        Return list of scene status dictionaries (see flatten_scene).
+    """
+    if not lstOrigPath:
+        print('\nFlatten batch: no scenes.')
+        return []
+    intWorkers = max(1, min(intWorkers or multiprocessing.cpu_count(), len(lstOrigPath)))
+    fltWorkerBytes = fltMemGB * 2**30 / intWorkers if fltMemGB else None
+
+    lstArgs = []
+    for strOrigPath in lstOrigPath:
+        iOptS = iOpt
+        if fltWorkerBytes and not iOpt.intBlockSize:
+            try:
+                strPathInYear = edU.get_EVTY(edU.expand2TDISpath(strOrigPath))
+                lstYBNames = rastIO.ListBands(strPathInYear)
+                iDesc = rastIO.getSimpleDesc(strPathInYear + os.sep + lstYBNames[0])
+            except Exception as e:
+                # scene will fail and be logged in flatten_scene
+                print(f'\tNo memory estimate: {strOrigPath}\n\t\t{e!r}')
+            else:
+                if FlattenMemory(iDesc.width * iDesc.height, len(lstYBNames), len(lstYears_)) > fltWorkerBytes:
+                    iOptS = copy.copy(iOpt)
+                    iOptS.intBlockSize = BlockSizeForMemory(fltWorkerBytes, len(lstYBNames), len(lstYears_))
+                    print(f'\t{strOrigPath}: tiled, block size {iOptS.intBlockSize}')
+        lstArgs.append((strOrigPath, RASTEXT_, lstYears_, iOptS, bolRedo_, strScratchWS))
+
+    print(f'\nFlatten batch: {len(lstArgs)} scenes, {intWorkers} worker(s)')
+    lstStatus = []
+    bolHeader = not os.path.exists(strPathLog)
+    with open(strPathLog, 'a', newline='') as txt:
+        writer = csv.DictWriter(txt, ['finished', 'scene', 'status', 'seconds', 'blocksize',
+                                      'workspace', 'message'])
+        if bolHeader:
+            writer.writeheader()
+
+        if intWorkers == 1:
+            iterStatus = map(_flatten_scene, lstArgs)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(intWorkers)
+            iterStatus = pool.imap_unordered(_flatten_scene, lstArgs)
+        try:
+            for dicStatus in iterStatus:
+                print(f"\t{dicStatus['status']}: {dicStatus['scene']} ({dicStatus['seconds']}s)")
+                writer.writerow(dict(dicStatus, finished=time.strftime('%Y-%m-%d %H:%M:%S')))
+                txt.flush()
+                lstStatus.append(dicStatus)
+        except BaseException:
+            # error or KeyboardInterrupt: stop workers now, don't wait for queued scenes
+            if pool:
+                pool.terminate()
+                pool.join()
+            raise
+        if pool:
+            pool.close()
+            pool.join()
+
+    return lstStatus
+
+# -------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # ------------------------------
+    # User Variables
+    lstOrigPath = [r'N:\project\EDART_vol\edartOps\data\sc_ca\sc305ns_v4',
+                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc306ns_v3',
+                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc307ns_v3',
+                   r'N:\project\EDART_vol\edartOps\data\sc_ca\sc309ns_v5']
+
+    # Output raster file extention
+    RASTEXT = '.tif'
+    # Start and end years (inclusive)
+    intYearStart = 2008
+    intYearEnd = 2018
+    # Options
+    bolRedoExisting = False
+    bolDoAsMoistureYear = False
+    bolDoSumConf = True
+    bolDoMaxConf = True
+    bolDoLastEV = False
+    bolStackOutputs = True
+    # write single band raster per year (False: stacks only)
+    bolYearlyOutputs = True
+    # tiled processing block size for large scenes (None: whole scene in memory)
+    intBlockSize = None
+    # rerun existing workspaces, rewriting only changed or missing outputs
+    bolIncremental = False
+    strScratchWS = r'E:\swap2'
+    # batch: worker processes (1: sequential, None: cpu count) and memory budget (GB, None: no limit)
+    intWorkers = 1
+    fltMemGB = None
+    strPathLog = 'flatten_batch_log.csv'
+
+    # ------------------------------
+    lstYears = range(intYearStart, intYearEnd + 1)
+    if arcpy and os.path.exists(strScratchWS):
+        arcpy.env.scratchWorkspace = strScratchWS
+
+    # path set per scene in flatten_scene
+    iOptions = flatU.flattenOptions(None, bolRedoExisting, bolDoAsMoistureYear,
+                                    bolDoSumConf, bolDoMaxConf, bolDoLastEV,
+                                    boolStackOutputs=bolStackOutputs,
+                                    boolYearlyOutputs=bolYearlyOutputs,
+                                    intBlockSize=intBlockSize,
+                                    boolIncremental=bolIncremental)
+    lstStatus = flatten_batch(lstOrigPath, RASTEXT, lstYears, iOptions, intWorkers, fltMemGB,
+                              bolRedoExisting, strScratchWS, strPathLog)
+
+    print('Done.')
@@ -1,122 +1,465 @@
-"""
----------------------------------------------------------------------------
- flatten_utility.py
- 09/2018
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- supporting functions and classes for 'flattening' of EDART timing and confidence products
-
- Known limitations: python 3
----------------------------------------------------------------------------
-"""
-import os
-import numpy as np
-import edart_utility as edU
-
-def fLastEV(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
-    """ Return last Event and its corresponding confidence, given
-            arr3_EvtM_bol already masked to year of interest.
-    """
-    print('\t\tStats (last EV)...', end='')
-    arr3_EvtM_bolY = arr3_EvtM_bol * arr3_Evt
-    arrOutYearMax = arr3_EvtM_bolY.max(axis=0)
-    print('\tGet matching confidence...', end='')
-    arrOutConf = np.zeros(arrOutYearMax.shape)
-    for b in range(arr3_EvtM_bolY.shape[0]):
-        arrOutConf = np.where(arrOutYearMax == arr3_Evt[b, :, :],
-                              arr3_Conf[b, :, :], arrOutConf)
-
-    return arrOutYearMax, arrOutConf
-
-def fMaxConfEV(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
-    """ Return highest confidence and its corresponding timing, given
-            arr3_EvtM_bol already masked to year of interest.
-            Something in this fuction or calling it is broken.
-    """
-    print('\t\tStats (max conf)...', end='')
-    arr3_ConfM_bolY = arr3_EvtM_bol * arr3_Conf
-    arrOutConfMax = arr3_ConfM_bolY.max(axis=0)
-    print('\tGet matching event...', end='')
-    arrOutEvent = np.zeros(arrOutConfMax.shape)
-    for b in range(arr3_ConfM_bolY.shape[0]):
-        arrOutEvent = np.where(arrOutConfMax == arr3_ConfM_bolY[b, :, :],
-                               arr3_Evt[b, :, :], arrOutEvent)
-
-    return arrOutEvent, arrOutConfMax
-
-def fMinPPEV(arr3_EvtM_bol, arr3_Evt, arr3_PP):
-    """ Return minimum Pre-Post difference and its corresponding timing, given
-            arr3_EvtM_bol already masked to year of interest.
-            Something in this fuction or calling it is broken.
-    """
-    print('\t\tStats (min PrePostDif)...', end='')
-    arr3_PPM_bolY = np.where(arr3_EvtM_bol, arr3_PP, 10003)
-    arrOutPPMin = arr3_PPM_bolY.min(axis=0)
-    print('\tGet matching event...', end='')
-    arrOutEvent = np.ones(arrOutPPMin.shape) * 10004
-    for b in range(arr3_PPM_bolY.shape[0]):
-        arrOutEvent = np.where(arrOutPPMin == arr3_PPM_bolY[b, :, :],
-                               arr3_Evt[b, :, :], arrOutEvent)
-
-    return arrOutEvent, arrOutPPMin
-
-class flattenOptions:
-    """ Container for ProcessScene options. """
-    def __init__(self, strPath, boolRedoExisting, boolDoAsMoistureYear,
-                 boolDoSumConf, boolDoMaxConf, boolDoLastEV):
-        """ init """
-        self.path = strPath
-        self.bolRedoExisting = boolRedoExisting
-        self.bolDoAsMoistureYear = boolDoAsMoistureYear
-        self.bolDoSumConf = boolDoSumConf
-        self.bolDoMaxConf = boolDoMaxConf
-        self.bolDoLastEV = boolDoLastEV
-
-        if self.bolDoAsMoistureYear:
-            self.bolDoAsMaxConf = False
-            self.bolDoAsMinPP = False
-        else:
-            self.bolDoAsMaxConf = False
-            self.bolDoAsMinPP = False
-
-    def record(self, strPathTxt=None):
-        """ save settings to strPathTxt. """
-        if strPathTxt is None:
-            strPathTxt = self.path + os.sep + 'a_RunPARAMETERS.txt'
-        with open(strPathTxt, 'w') as txt:
-            try:
-                txt.write(__file__ + '\n')
-            except NameError:
-                pass
-            txt.write('Run parameters:\n')
-            for k in self.__dict__:
-                txt.write(f'{k}: {self.__dict__[k]}\n')
-
-    def __str__(self):
-        """ str method """
-        for k in self.__dict__:
-            print(f'{k}: {self.__dict__[k]}\n')
-
-def StatConfTotal(arr3D_Evt, arr3D_Conf, intYearS, intYearE, fStat, arrConfFlags=None):
-    """ Return 0 axis statistic (fStat, typically np.sum or np.max) of
-            confidence array for of all events from intYearS to intYearE (inclusive).
-        Should also work like old MaxConf or SumConf, if given flattened events and confidences.
-    """
-    if arr3D_Evt.shape != arr3D_Conf.shape:
-        raise Exception('SumConfTotal, arr3D_EvtM and arr3D_ConfM shape must match.')
-    if arrConfFlags and len(arrConfFlags.shape) != 2:
-        raise Exception('SumConfTotal, arrConfFlags must be 2D.')
-
-    arrYtest = edU.testYear(arr3D_Evt, intYearS, intYearE)
-    arrStat = fStat((arrYtest * arr3D_Conf), axis=0)
-
-    if arrConfFlags:
-        # Add back flags
-        arrStat = np.where(arrConfFlags, arrConfFlags, arrStat)
-
-    del arrYtest
-    return arrStat
+"""
+---------------------------------------------------------------------------
+ flatten_utility.py
+ 09/2018
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ supporting functions and classes for 'flattening' of EDART timing and confidence products
+
+ Known limitations: python 3
+---------------------------------------------------------------------------
+"""
+import os
+import json
+import time
+import hashlib
+import numpy as np
+import edart_utility as edU
+import raster.rasterIO as rastIO
+import raster.rasterARCUtility as rastArcU
+
+def MaskedBands(arr3_EvtM_bol, arr3_Val):
+    """ Yield arr3_EvtM_bol * arr3_Val one 2D band at a time, in arr3_Val dtype,
+            so no masked (band, row, col) cube is allocated.
+    """
+    for b in range(arr3_Val.shape[0]):
+        yield np.multiply(arr3_EvtM_bol[b], arr3_Val[b], dtype=arr3_Val.dtype, casting='unsafe')
+
+def BandReduce(ufunc, iterBands):
+    """ Return ufunc (np.maximum, np.minimum) reduction of 2D bands of iterBands
+            (3D array or iterable of 2D arrays), accumulated in place.
+    """
+    iterBands = iter(iterBands)
+    arrOut = np.array(next(iterBands))
+    for arr in iterBands:
+        ufunc(arrOut, arr, out=arrOut)
+    return arrOut
+
+def LastMatch(iterStat, arrStat, arr3_Other, valNone=0):
+    """ Return arr3_Other at the last (highest index) band where iterStat equals arrStat,
+            valNone where no band matches.
+        iterStat: (band, row, col) array or iterable of 2D bands (e.g. MaskedBands).
+        One in place np.copyto per band (later bands overwrite), no (band, row, col)
+            match cube. Output dtype is arr3_Other's.
+        A single reversed argmax + np.take_along_axis gather was measured ~2x slower
+            (60 x 1000 x 1000, BenchmarkFlatten), and differs where the statistic is 0
+            (masked bands tie with unmasked zeros), so is not used.
+    """
+    arrOut = np.full(arrStat.shape, valNone, dtype=arr3_Other.dtype)
+    for b, arrB in enumerate(iterStat):
+        np.copyto(arrOut, arr3_Other[b], where=arrB == arrStat)
+    return arrOut
+
+def fLastEV(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
+    """ Return last Event and its corresponding confidence, given
+            arr3_EvtM_bol already masked to year of interest.
+        Confidence is from the last band whose event equals the last event (0 if none).
+        Outputs keep arr3_Evt and arr3_Conf dtypes.
+    """
+    print('\t\tStats (last EV)...', end='')
+    arrOutYearMax = BandReduce(np.maximum, MaskedBands(arr3_EvtM_bol, arr3_Evt))
+    print('\tGet matching confidence...', end='')
+    arrOutConf = LastMatch(arr3_Evt, arrOutYearMax, arr3_Conf)
+
+    return arrOutYearMax, arrOutConf
+
+def fMaxConfEV(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
+    """ Return highest confidence and its corresponding timing, given
+            arr3_EvtM_bol already masked to year of interest.
+        Timing is from the last band whose masked confidence equals the highest.
+        Outputs keep arr3_Evt and arr3_Conf dtypes.
+    """
+    print('\t\tStats (max conf)...', end='')
+    arrOutConfMax = BandReduce(np.maximum, MaskedBands(arr3_EvtM_bol, arr3_Conf))
+    print('\tGet matching event...', end='')
+    arrOutEvent = LastMatch(MaskedBands(arr3_EvtM_bol, arr3_Conf), arrOutConfMax, arr3_Evt)
+
+    return arrOutEvent, arrOutConfMax
+
+def fMinPPEV(arr3_EvtM_bol, arr3_Evt, arr3_PP):
+    """ Return minimum Pre-Post difference and its corresponding timing, given
+            arr3_EvtM_bol already masked to year of interest.
+        Timing is from the last band whose masked difference equals the minimum.
+        Outputs keep arr3_Evt and arr3_PP dtypes.
+    """
+    print('\t\tStats (min PrePostDif)...', end='')
+    arr3_PPM_bolY = np.where(arr3_EvtM_bol, arr3_PP, 10003)
+    arrOutPPMin = arr3_PPM_bolY.min(axis=0)
+    print('\tGet matching event...', end='')
+    arrOutEvent = LastMatch(arr3_PPM_bolY, arrOutPPMin, arr3_Evt, 10004)
+
+    return arrOutEvent, arrOutPPMin
+
+# ---------------------------------------------------------------------------
+# band loop versions, reference for BenchmarkFlatten and tests/test_flatten_utility.py
+def _fLastEVLoop(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
+    """ Return last Event and its corresponding confidence, given
+            arr3_EvtM_bol already masked to year of interest.
+    """
+    print('\t\tStats (last EV)...', end='')
+    arr3_EvtM_bolY = arr3_EvtM_bol * arr3_Evt
+    arrOutYearMax = arr3_EvtM_bolY.max(axis=0)
+    print('\tGet matching confidence...', end='')
+    arrOutConf = np.zeros(arrOutYearMax.shape)
+    for b in range(arr3_EvtM_bolY.shape[0]):
+        arrOutConf = np.where(arrOutYearMax == arr3_Evt[b, :, :],
+                              arr3_Conf[b, :, :], arrOutConf)
+
+    return arrOutYearMax, arrOutConf
+
+def _fMaxConfEVLoop(arr3_EvtM_bol, arr3_Evt, arr3_Conf):
+    """ Return highest confidence and its corresponding timing, given
+            arr3_EvtM_bol already masked to year of interest.
+            Something in this fuction or calling it is broken.
+    """
+    print('\t\tStats (max conf)...', end='')
+    arr3_ConfM_bolY = arr3_EvtM_bol * arr3_Conf
+    arrOutConfMax = arr3_ConfM_bolY.max(axis=0)
+    print('\tGet matching event...', end='')
+    arrOutEvent = np.zeros(arrOutConfMax.shape)
+    for b in range(arr3_ConfM_bolY.shape[0]):
+        arrOutEvent = np.where(arrOutConfMax == arr3_ConfM_bolY[b, :, :],
+                               arr3_Evt[b, :, :], arrOutEvent)
+
+    return arrOutEvent, arrOutConfMax
+
+def _fMinPPEVLoop(arr3_EvtM_bol, arr3_Evt, arr3_PP):
+    """ Return minimum Pre-Post difference and its corresponding timing, given
+            arr3_EvtM_bol already masked to year of interest.
+            Something in this fuction or calling it is broken.
+    """
+    print('\t\tStats (min PrePostDif)...', end='')
+    arr3_PPM_bolY = np.where(arr3_EvtM_bol, arr3_PP, 10003)
+    arrOutPPMin = arr3_PPM_bolY.min(axis=0)
+    print('\tGet matching event...', end='')
+    arrOutEvent = np.ones(arrOutPPMin.shape) * 10004
+    for b in range(arr3_PPM_bolY.shape[0]):
+        arrOutEvent = np.where(arrOutPPMin == arr3_PPM_bolY[b, :, :],
+                               arr3_Evt[b, :, :], arrOutEvent)
+
+    return arrOutEvent, arrOutPPMin
+
+def BenchmarkFlatten(tupShape=(60, 1000, 1000), intYear=2010, intSeed=0):
+    """ Time band loop against LastMatch versions of fLastEV, fMaxConfEV and fMinPPEV
+            on a random masked event/confidence cube with many tied values.
+        Check both give the same values.
+        Default shape peaks at ~1.4 GB, memory scales with the number of cells of tupShape.
+    """
+    rng = np.random.default_rng(intSeed)
+    # monthly event times, so bands often share (tie on) an event value
+    arr3_Evt = (intYear - 2 + rng.integers(0, 48, tupShape, dtype=np.int16) / 12).astype(np.float32)
+    arr3_Conf = rng.integers(0, 100, tupShape, dtype=np.int16)
+    arr3_Evt = np.where(arr3_Conf >= 20, arr3_Evt, 0)
+    arr3_Conf = np.where(arr3_Conf >= 20, arr3_Conf, 0).astype(np.int16)
+    arr3_Bol = edU.testYear(arr3_Evt, intYear)
+    print(f'BenchmarkFlatten: shape {tupShape}')
+
+    dicTimes = {}
+    for strName, fLoop, fVec in (('fLastEV', _fLastEVLoop, fLastEV),
+                                 ('fMaxConfEV', _fMaxConfEVLoop, fMaxConfEV),
+                                 ('fMinPPEV', _fMinPPEVLoop, fMinPPEV)):
+        t0 = time.time()
+        tupLoop = fLoop(arr3_Bol, arr3_Evt, arr3_Conf)
+        fltLoop = time.time() - t0
+        t1 = time.time()
+        tupVec = fVec(arr3_Bol, arr3_Evt, arr3_Conf)
+        fltVec = time.time() - t1
+        bolMatch = all(np.array_equal(a, b) for a, b in zip(tupLoop, tupVec))
+        print(f'\n\t{strName}: loop {fltLoop:.2f}s, vectorized {fltVec:.2f}s '
+              f'({fltLoop / fltVec:.1f}x), match: {bolMatch}')
+        dicTimes[strName] = (fltLoop, fltVec, bolMatch)
+
+    return dicTimes
+
+def fFlattenYears(arr3_Evt, arr3_Conf, lstYears, bolMoistureYear=False, bolMaxConf=False,
+                  arr3_Bucket=None):
+    """ Return (year, row, col) event and confidence arrays for all years of lstYears,
+            identical to fLastEV (or fMaxConfEV if bolMaxConf) run per year with testYear
+            (or testMoistureYear if bolMoistureYear).
+        One pass over the bands: each band is bucketed to its year (edU.YearBucket) and
+            running maxima and source band are kept per year.
+        Assumes masked inputs as in flatten.flatten_conf: in year events > 0, confidences >= 0.
+        Optional arr3_Bucket: year bucket cube of arr3_Evt (edU.YearBucket), if already made.
+    """
+    intBands = arr3_Evt.shape[0]
+    tupShp = (len(lstYears),) + arr3_Evt.shape[1:]
+    if bolMaxConf:
+        arr3_Stat, arr3_Match = arr3_Conf, arr3_Evt
+    else:
+        arr3_Stat, arr3_Match = arr3_Evt, arr3_Conf
+
+    arrOutStat = np.zeros(tupShp, dtype=arr3_Stat.dtype)
+    arrOutBand = np.zeros(tupShp, dtype=np.int16)
+    arrZero = np.zeros(tupShp[1:], dtype=arr3_Conf.dtype)
+    tupEdges = edU.YearEdges(lstYears, bolMoistureYear, arr3_Evt.dtype)
+    for b in range(intBands):
+        if arr3_Bucket is None:
+            arrK = edU.YearBucket(arr3_Evt[b, :, :], lstYears, tupEdges=tupEdges)
+        else:
+            arrK = arr3_Bucket[b, :, :]
+        arrR, arrC = np.nonzero(arrK >= 0)
+        arrK = arrK[arrR, arrC]
+        arrV = arr3_Stat[b, arrR, arrC]
+        # >=: last band wins ties, as the band loops of fLastEV, fMaxConfEV
+        bolUpd = arrV >= arrOutStat[arrK, arrR, arrC]
+        arrK, arrR, arrC = arrK[bolUpd], arrR[bolUpd], arrC[bolUpd]
+        arrOutStat[arrK, arrR, arrC] = arrV[bolUpd]
+        arrOutBand[arrK, arrR, arrC] = b
+        if not bolMaxConf:
+            # no event in year: fLastEV matches last band with event 0
+            arrZero = np.where(arr3_Evt[b, :, :] == 0, arr3_Conf[b, :, :], arrZero)
+
+    arrOutMatch = np.take_along_axis(arr3_Match, arrOutBand, axis=0)
+    if bolMaxConf:
+        # no confidence in year: fMaxConfEV matches last band
+        arrOutMatch = np.where(arrOutStat > 0, arrOutMatch, arr3_Evt[-1, :, :])
+        return arrOutMatch, arrOutStat
+
+    arrOutMatch = np.where(arrOutStat > 0, arrOutMatch, arrZero)
+    return arrOutStat, arrOutMatch
+
+class flattenOptions:
+    """ Container for ProcessScene options. """
+    def __init__(self, strPath, boolRedoExisting, boolDoAsMoistureYear,
+                 boolDoSumConf, boolDoMaxConf, boolDoLastEV,
+                 strCompress=None, boolOverviews=False, boolCOG=False,
+                 boolStackOutputs=False, boolYearlyOutputs=True, intBlockSize=None,
+                 boolIncremental=False, boolHashInputs=False):
+        """ init """
+        self.path = strPath
+        self.bolRedoExisting = boolRedoExisting
+        self.bolDoAsMoistureYear = boolDoAsMoistureYear
+        self.bolDoSumConf = boolDoSumConf
+        self.bolDoMaxConf = boolDoMaxConf
+        self.bolDoLastEV = boolDoLastEV
+        # output raster writing, see rasterIO.ArrayToRaster (None: DEFLATE, or arcpy.env without GDAL)
+        self.strCompress = strCompress
+        self.bolOverviews = boolOverviews
+        self.bolCOG = boolCOG
+        # write per year arrays to multiband stacks, and/or single band per year rasters
+        self.bolStackOutputs = boolStackOutputs
+        self.bolYearlyOutputs = boolYearlyOutputs or not boolStackOutputs
+        # process in intBlockSize x intBlockSize blocks (bounded memory), None: whole scene
+        self.intBlockSize = intBlockSize
+        # rerun only outputs that are missing or changed, see flatten.flatten_conf
+        self.bolIncremental = boolIncremental
+        # also sha1 input files for the up to date check (else size and mtime)
+        self.bolHashInputs = boolHashInputs
+
+        if self.bolDoAsMoistureYear:
+            self.bolDoAsMaxConf = False
+            self.bolDoAsMinPP = False
+        else:
+            self.bolDoAsMaxConf = False
+            self.bolDoAsMinPP = False
+
+    def writeOptions(self):
+        """ Return dictionary of output writing keyword arguments for rasterIO.ArrayToRaster. """
+        return {'strCompress': self.strCompress, 'bolOverviews': self.bolOverviews,
+                'bolCOG': self.bolCOG}
+
+    def fingerprint(self):
+        """ Return dictionary of options output rasters depend on (see MANIFEST): flattening
+                method (OUTPUTOPTIONS) and writeOptions. Options choosing which outputs are
+                made (bolDoSumConf, bolStackOutputs...) or how (intBlockSize...) are left out,
+                so adding an output doesn't make the others stale.
+        """
+        dicFP = {k: self.__dict__[k] for k in OUTPUTOPTIONS}
+        dicFP.update(self.writeOptions())
+        return dicFP
+
+    def record(self, strPathTxt=None):
+        """ save settings to strPathTxt. """
+        if strPathTxt is None:
+            strPathTxt = self.path + os.sep + 'a_RunPARAMETERS.txt'
+        with open(strPathTxt, 'w') as txt:
+            try:
+                txt.write(__file__ + '\n')
+            except NameError:
+                pass
+            txt.write('Run parameters:\n')
+            for k in self.__dict__:
+                txt.write(f'{k}: {self.__dict__[k]}\n')
+
+    def __str__(self):
+        """ str method """
+        for k in self.__dict__:
+            print(f'{k}: {self.__dict__[k]}\n')
+
+# ---------------------------------------------------------------------------
+# incremental flatten
+# manifest of input and output fingerprints in working folder
+MANIFEST = 'a_flattenMANIFEST.json'
+# flattenOptions every output's values depend on (flattenOptions.fingerprint)
+OUTPUTOPTIONS = ('bolDoAsMoistureYear', 'bolDoAsMaxConf', 'bolDoAsMinPP')
+
+def FileFingerprint(strPath, bolHash=False):
+    """ Return dictionary of size and mtime (and sha1 if bolHash) of file strPath,
+            or of all files in strPath if it is a folder (e.g. grid or multiband stack).
+    """
+    if os.path.isdir(strPath):
+        lstFiles = sorted(os.path.join(d, f) for d, lstD, lstF in os.walk(strPath) for f in lstF)
+    else:
+        lstFiles = [strPath]
+
+    dicFP = {'size': sum(os.path.getsize(f) for f in lstFiles),
+             'mtime': max(os.path.getmtime(f) for f in lstFiles)}
+    if bolHash:
+        hashF = hashlib.sha1()
+        for f in lstFiles:
+            with open(f, 'rb') as fIn:
+                for b in iter(lambda: fIn.read(2**24), b''):
+                    hashF.update(b)
+        dicFP['sha1'] = hashF.hexdigest()
+    return dicFP
+
+def FingerprintHash(npType, tupShape, dicOptions, intBlockSize=None):
+    """ Return sha1 hash of output dtype, shape, options dicOptions and block size,
+            to be updated with output values, whole array or intBlockSize blocks in
+            rasterARCUtility.IterBlocks order (flatten.flatten_conf_tiled).
+    """
+    lstHead = [str(np.dtype(npType)), list(tupShape), dicOptions]
+    if intBlockSize:
+        lstHead.append(intBlockSize)
+    return hashlib.sha1(json.dumps(lstHead, sort_keys=True).encode())
+
+def ArrayFingerprint(arr, dicOptions):
+    """ Return sha1 of output array arr (values, dtype and shape) and options dicOptions. """
+    hashA = FingerprintHash(arr.dtype, arr.shape, dicOptions)
+    hashA.update(np.ascontiguousarray(arr).tobytes())
+    return hashA.hexdigest()
+
+def ReadManifest(strWorkingPath):
+    """ Return manifest dictionary of strWorkingPath, empty if none. """
+    strPathJSON = strWorkingPath + os.sep + MANIFEST
+    if not os.path.exists(strPathJSON):
+        return {}
+    with open(strPathJSON) as txt:
+        return json.load(txt)
+
+def WriteManifest(strWorkingPath, dicManifest):
+    """ Save manifest dictionary to strWorkingPath. """
+    with open(strWorkingPath + os.sep + MANIFEST, 'w') as txt:
+        json.dump(dicManifest, txt, indent=1)
+
+def StatConfTotal(arr3D_Evt, arr3D_Conf, intYearS, intYearE, fStat, arrConfFlags=None):
+    """ Return 0 axis statistic (fStat, typically np.sum or np.max) of
+            confidence array for of all events from intYearS to intYearE
+            (intYearS <= event < intYearE, as testYear).
+        Should also work like old MaxConf or SumConf, if given flattened events and confidences.
+        For many windows or statistics use StatConfGrouped.
+    """
+    if arr3D_Evt.shape != arr3D_Conf.shape:
+        raise Exception('SumConfTotal, arr3D_EvtM and arr3D_ConfM shape must match.')
+    if arrConfFlags is not None and len(arrConfFlags.shape) != 2:
+        raise Exception('SumConfTotal, arrConfFlags must be 2D.')
+
+    arrYtest = edU.testYear(arr3D_Evt, intYearS, intYearE)
+    arrStat = fStat((arrYtest * arr3D_Conf), axis=0)
+
+    if arrConfFlags is not None:
+        # Add back flags
+        arrStat = np.where(arrConfFlags, arrConfFlags, arrStat)
+
+    del arrYtest
+    return arrStat
+
+# ---------------------------------------------------------------------------
+# grouped confidence statistics
+STATS = ('sum', 'max', 'count', 'mean')
+
+def ConfFlags(arr3D_Conf, lstConfFlags):
+    """ Return 2D int8 confidence flags of first band of arr3D_Conf: 1 where value is in
+            lstConfFlags (e.g. [-1, 1, 2]), else 0.
+        As written over flatten outputs (flatten.flatten_arrays) and grouped statistics.
+    """
+    return np.isin(arr3D_Conf[0, :, :], lstConfFlags).astype(np.int8)
+
+def StatConfGrouped(arr3D_Evt, arr3D_Conf, lstWindows, lstStats=('sum', 'max'), arrConfFlags=None):
+    """ Return dictionary {(intYearS, intYearE, strStat): 2D array} of confidence statistics
+            for each year window (intYearS, intYearE) of lstWindows and reducer of lstStats (STATS).
+            Windows as StatConfTotal: intYearS <= event < intYearE, may overlap.
+        Events are bucketed once to the intervals between all window bounds (edU.BoundEdges,
+            edU.YearBucket), sum, max and count are kept per interval (edU.YearReduce) and
+            combined per window.
+        'sum' and 'max' equal StatConfTotal with np.sum and np.max for confidences >= 0,
+            'count' is number of events, 'mean' sum / count (0 where no events).
+        Optional arrConfFlags: 2D flags (see ConfFlags), written over results where not 0.
+    """
+    if arr3D_Evt.shape != arr3D_Conf.shape:
+        raise Exception('StatConfGrouped, arr3D_Evt and arr3D_Conf shape must match.')
+    if arrConfFlags is not None and len(arrConfFlags.shape) != 2:
+        raise Exception('StatConfGrouped, arrConfFlags must be 2D.')
+    if set(lstStats) - set(STATS):
+        raise Exception(f'StatConfGrouped, lstStats must be in {STATS}.')
+
+    # interval edges, compared in event dtype as testYear
+    arrBounds = np.array(lstWindows, dtype=np.float64)
+    if arr3D_Evt.dtype.kind == 'f':
+        arrBounds = arrBounds.astype(arr3D_Evt.dtype)
+    arrEdges = np.unique(arrBounds)
+    lstIntervals = list(zip(arrEdges[:-1], arrEdges[1:]))
+    tupEdges = edU.BoundEdges(lstIntervals, arr3D_Evt.dtype)
+    arr3_Bucket = edU.YearBucket(arr3D_Evt, lstIntervals, tupEdges=tupEdges)
+    dicI = {}
+    for strStat in ('sum', 'count', 'max'):
+        if strStat in lstStats or (strStat != 'max' and 'mean' in lstStats):
+            dicI[strStat] = edU.YearReduce(arr3_Bucket, arr3D_Conf, len(lstIntervals), strStat)
+    del arr3_Bucket
+
+    dicOut = {}
+    for (intYearS, intYearE), (s, e) in zip(lstWindows, arrBounds):
+        j0, j1 = np.searchsorted(arrEdges, s), np.searchsorted(arrEdges, e)
+        dicW = {}
+        if 'sum' in dicI:
+            dicW['sum'] = dicI['sum'][j0:j1].sum(axis=0, dtype=dicI['sum'].dtype)
+        if 'count' in dicI:
+            dicW['count'] = dicI['count'][j0:j1].sum(axis=0, dtype=np.int32)
+        if 'max' in dicI:
+            dicW['max'] = dicI['max'][j0:j1].max(axis=0, initial=0)
+        if 'mean' in lstStats:
+            dicW['mean'] = np.divide(dicW['sum'], dicW['count'], out=np.zeros(arr3D_Evt.shape[1:]),
+                                     where=dicW['count'] > 0)
+        for strStat in lstStats:
+            arrStat = dicW[strStat]
+            if arrConfFlags is not None:
+                # Add back flags
+                arrStat = np.where(arrConfFlags != 0, arrConfFlags, arrStat)
+            dicOut[(intYearS, intYearE, strStat)] = arrStat
+
+    return dicOut
+
+def StatConfGroupedTiled(strPathEvt, strPathConf, lstWindows, lstStats=('sum', 'max'), lstConfFlags=None,
+                         intConfMin=None, intBlockSize=4096):
+    """ Block-wise StatConfGrouped of event and confidence stacks strPathEvt, strPathConf,
+            read intBlockSize x intBlockSize at a time.
+        Optional intConfMin: events and confidences where confidence < intConfMin are
+            set to 0 first (as flatten, 20).
+        Optional lstConfFlags: confidence flags of unmasked first band put back (ConfFlags).
+        Return dictionary as StatConfGrouped of whole raster 2D arrays.
+    """
+    iDesc = rastIO.getSimpleDesc(strPathConf)
+    dicOut = {}
+    for intRow, intCol, intRows, intCols in rastArcU.IterBlocks(iDesc, intBlockSize):
+        iDescB = rastArcU.BlockDesc(iDesc, intRow, intCol, intRows, intCols)
+        arr3D_Conf = rastIO.RasterToNumPyBlock(strPathConf, iDescB)
+        arr3D_Evt = rastIO.RasterToNumPyBlock(strPathEvt, iDescB)
+        arrConfFlags = None
+        if lstConfFlags:
+            arrConfFlags = ConfFlags(arr3D_Conf, lstConfFlags)
+        if intConfMin is not None:
+            arr3D_Evt = np.where(arr3D_Conf >= intConfMin, arr3D_Evt, 0)
+            arr3D_Conf = np.where(arr3D_Conf >= intConfMin, arr3D_Conf, 0)
+
+        dicBlock = StatConfGrouped(arr3D_Evt, arr3D_Conf, lstWindows, lstStats, arrConfFlags)
+        for k, arrStat in dicBlock.items():
+            if k not in dicOut:
+                dicOut[k] = np.zeros(iDesc.shape, dtype=arrStat.dtype)
+            dicOut[k][intRow:intRow + intRows, intCol:intCol + intCols] = arrStat
+        del arr3D_Conf, arr3D_Evt, dicBlock
+
+    return dicOut
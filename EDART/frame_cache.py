@@ -0,0 +1,156 @@
+"""
+---------------------------------------------------------------------------
+ frame_cache.py
+ 10/2026
+
+ Script to: persistent on disk cache of EDART frame cubes (IngestFramesMulti).
+    Index and mask (time, row, col) cubes are stored in strips of PIXELSTRIP rows,
+    one compressed .npz file per cube and strip holding both layouts:
+        T time major (time, row, col): whole scene or window reads.
+        P pixel major (row, col, time): per pixel time series for point reads.
+    Both layouts are written strip by strip as the cache is built, reads decompress
+    only the strips and layout they need.
+    dicLU and dicLUdate are stored with the cache metadata.
+    Cache folder is keyed by scene, band name, frame names, sizes and modification
+    times, any other source files (lstKeyFiles, e.g. the DM masks of a mask cache),
+    shape, mask storage (IngestFramesPartial sMask_) and FORMAT, so reprocessed frames
+    or masks are not read from a stale cache.
+    edart_utility.FrameCaches keeps an index only cache per band and one mask only
+    cache (band edart_utility.MASKCACHE) shared by all bands. With sMask_='sentinel'
+    there is no mask cube.
+
+ Known limitations: python 3
+---------------------------------------------------------------------------
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+CUBES = ('Index', 'Mask')
+# rows per stored strip
+PIXELSTRIP = 256
+# storage format, part of the cache key
+FORMAT = 2
+
+def FileStats(lstFiles):
+    """ Return list of [size, mtime_ns] (None if missing) of lstFiles. """
+    return [[os.stat(f).st_size, os.stat(f).st_mtime_ns] if os.path.exists(f) else None
+            for f in lstFiles]
+
+class FrameCache():
+    """ Compressed on disk cache of index and/or mask cubes for one scene, band and frame list. """
+    def __init__(self, strPathCache, strPathScene, BANDNAME_, lstFrames, tupShp, sMask_=None,
+                 lstKeyFiles=None):
+        """ init """
+        lstNames = [os.path.basename(f) for f in lstFrames]
+        lstKey = [os.path.normpath(strPathScene), BANDNAME_, lstNames, FileStats(lstFrames),
+                  list(tupShp), FORMAT]
+        if lstKeyFiles:
+            lstKey.append(FileStats(lstKeyFiles))
+        if sMask_ is not None:
+            lstKey.append(sMask_)
+        strKey = json.dumps(lstKey)
+        strHash = hashlib.sha1(strKey.encode()).hexdigest()[:16]
+        strScene = os.path.basename(os.path.normpath(strPathScene))
+        self.path = strPathCache + os.sep + f'{strScene}_{BANDNAME_}_{strHash}'
+        self.shape = (len(lstFrames),) + tuple(tupShp)
+        self.frames = lstNames
+        self.band = BANDNAME_
+
+    def exists(self):
+        """ Return True if cache has been completely written. """
+        return os.path.exists(self.path + os.sep + 'meta.json')
+
+    def _stripPath(self, strCube, intStrip):
+        """ Return .npz path of strip intStrip (rows intStrip * PIXELSTRIP...) of strCube. """
+        return self.path + os.sep + f'{strCube}_{intStrip:05d}.npz'
+
+    def write(self, arr3D_Index_, arr3D_Mask_, dicLU, dicLUdate):
+        """ Write index and mask cubes and lookups to cache, strip by strip in both layouts.
+            Either cube may be None (e.g. sentinel masked index, or a mask only cache).
+        """
+        dicCubes = {'Index': arr3D_Index_, 'Mask': arr3D_Mask_}
+        dicCubes = {k: v for k, v in dicCubes.items() if v is not None}
+        if not dicCubes:
+            raise Exception('FrameCache.write, no cube to write.')
+        if any(v.shape != self.shape for v in dicCubes.values()):
+            raise Exception(f'FrameCache.write, cube shape must be {self.shape}.')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        for strCube, arr in dicCubes.items():
+            for intRow in range(0, self.shape[1], PIXELSTRIP):
+                arrT = arr[:, intRow:intRow + PIXELSTRIP]
+                np.savez_compressed(self._stripPath(strCube, intRow // PIXELSTRIP), T=arrT,
+                                    P=np.transpose(arrT, (1, 2, 0)))
+
+        # meta last: marks cache complete
+        dicMeta = {'band': self.band, 'frames': self.frames, 'shape': self.shape,
+                   'strip': PIXELSTRIP, 'dtypes': {k: str(v.dtype) for k, v in dicCubes.items()},
+                   'dicLU': {str(k): v for k, v in dicLU.items()},
+                   'dicLUdate': {str(k): v for k, v in dicLUdate.items()}}
+        with open(self.path + os.sep + 'meta.json', 'w') as txt:
+            json.dump(dicMeta, txt)
+
+    def meta(self):
+        """ Return cache metadata dictionary. """
+        with open(self.path + os.sep + 'meta.json') as txt:
+            return json.load(txt)
+
+    def lookups(self):
+        """ Return dicLU (frame number: index) and dicLUdate (index: date). """
+        dicMeta = self.meta()
+        dicLU = {int(k): v for k, v in dicMeta['dicLU'].items()}
+        dicLUdate = {int(k): v for k, v in dicMeta['dicLUdate'].items()}
+        return dicLU, dicLUdate
+
+    def _readStrip(self, strCube, intStrip, strLayout):
+        """ Return layout strLayout ('T' or 'P') of strip intStrip of strCube. """
+        with np.load(self._stripPath(strCube, intStrip)) as npz:
+            return npz[strLayout]
+
+    def read(self, tupFrames=None, tupWindow=None):
+        """ Return index and mask cubes from time major strips (None if not cached).
+            Optional tupFrames: (first, stop) frames, tupWindow: (row, col, nrows, ncols),
+                only strips overlapping the window are read.
+        """
+        dicMeta = self.meta()
+        intStrip = dicMeta['strip']
+        t0, t1 = tupFrames or (0, self.shape[0])
+        intRow, intCol, intRows, intCols = tupWindow or (0, 0) + self.shape[1:]
+        lstOut = []
+        for strCube in CUBES:
+            if strCube not in dicMeta['dtypes']:
+                lstOut.append(None)
+                continue
+            arrOut = np.empty((t1 - t0, intRows, intCols), dtype=dicMeta['dtypes'][strCube])
+            for s in range(intRow // intStrip, (intRow + intRows - 1) // intStrip + 1):
+                r0 = max(intRow, s * intStrip)
+                r1 = min(intRow + intRows, (s + 1) * intStrip)
+                arrT = self._readStrip(strCube, s, 'T')
+                arrOut[:, r0 - intRow:r1 - intRow] = arrT[t0:t1, r0 - s * intStrip:r1 - s * intStrip,
+                                                          intCol:intCol + intCols]
+            lstOut.append(arrOut)
+        return tuple(lstOut)
+
+    def read_pixels(self, aRows, aCols):
+        """ Return (time, point) index and mask arrays for pixels aRows, aCols from
+                pixel major strips, only strips holding points are read (mask None if not cached).
+        """
+        dicMeta = self.meta()
+        intStrip = dicMeta['strip']
+        aRows, aCols = np.asarray(aRows), np.asarray(aCols)
+        aStrip = aRows // intStrip
+        lstOut = []
+        for strCube in CUBES:
+            if strCube not in dicMeta['dtypes']:
+                lstOut.append(None)
+                continue
+            arrOut = np.empty((self.shape[0], len(aRows)), dtype=dicMeta['dtypes'][strCube])
+            for s in np.unique(aStrip):
+                bolS = aStrip == s
+                arrP = self._readStrip(strCube, s, 'P')
+                arrOut[:, bolS] = arrP[aRows[bolS] - s * intStrip, aCols[bolS], :].T
+            lstOut.append(arrOut)
+        return tuple(lstOut)
@@ -1,209 +1,285 @@
-"""
----------------------------------------------------------------------------
- prepost_event_SingleCell2.py
- 02/2019
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- script to:
-
- Known limitations: python 3.6
----------------------------------------------------------------------------
-"""
-import os
-import datetime as dt
-import numpy as np
-import pandas as pd
-import arcpy
-import edart_utility as edU
-import prepost_utility as ppU
-import prepost_readwrite as ppRW
-
-def prep_alt(strOriginalPath, strWorkingPath, BANDNAME_, sPathFC, tCornerOffset_, lRawDates_=None):
-    """ Prep data. Get array stack for given BANDNAME_ and extract
-            samples given in sPathFC to text files.
-            sPathFC is a point feature class containing projected X and Y fields.
-    """
-    iCELLSIZE = 30
-    Xp0, Yp0 = tCornerOffset_
-    # load rasters
-    strPathScene = edU.getSceneDir(strOriginalPath)
-    strPath_nFrEV = edU.get_nFrEV(strOriginalPath)
-    arcpy.env.workspace = strWorkingPath
-    print('\n\tIngesting Frame EVT raster...')
-    arr3D_FrEV = arcpy.RasterToNumPyArray(strPath_nFrEV)
-    print('\t\tFrEV shape: ', arr3D_FrEV.shape)
-    a3D_Index, a3D_Mask, dEvLU_, dDateLU_ = edU.IngestFramesPartial(strPathScene, BANDNAME_,
-                                                                    arr3D_FrEV.shape[1:],
-                                                                    lRawDates=lRawDates_,
-                                                                    bReturnDateLU=True)
-
-    print('Reading samples...\n')
-    dSamplesText_ = {}
-    with arcpy.da.SearchCursor(sPathFC, ('ROIID', 'x', 'y')) as rows_:
-        for row_ in rows_:
-            sROIID = row_[0]
-
-            print(sROIID)
-            if sROIID is None:
-                print('\tNo ROIID, Skipping.')
-                continue
-
-            strPathTXT = ppRW.ROIID_txt_name(sROIID, BANDNAME_, 'extract_files')
-            if os.path.exists(strPathTXT):
-                print('\tROIID already done.')
-                continue
-
-            if not os.path.exists(os.path.dirname(strPathTXT)):
-                os.makedirs(os.path.dirname(strPathTXT))
-
-            print('\t', strPathTXT)
-            Xp, Yp = row_[1:]
-            X = int((Xp - Xp0) / iCELLSIZE)
-            Y = int(-(Yp - Yp0) / iCELLSIZE)
-            aIndex_ = a3D_Index[:, Y, X]
-            aMask_ = a3D_Mask[:, Y, X]
-
-            dfSample = pd.DataFrame({'Index':aIndex_, 'Mask':aMask_})
-            dfSample.to_csv(strPathTXT, index=False)
-            dSamplesText_[sROIID] = strPathTXT
-
-    del arr3D_FrEV, a3D_Index, a3D_Mask
-    return dSamplesText_, dEvLU_, dDateLU_
-
-# -------------------------------------------------------------------------------------------
-if __name__ == '__main__':
-    # ------------------------------
-    # User Variables
-    sOrigPath = r'D:\p_data\edartOps\data\sc_dev\sc5rse_v03\envi_aux\TDIS\TDISm__r180821_1945_93fr_180822-0554'
-    sPathWork = r'N:\project\EDART_vol\projects\MMI'
-    sXL = 'test_evt_sc5_20190315.xlsx'
-    sSheetName = 'TotalSample'
-    sPathSHP = r'shapes\sc5_validation_plots_20190315.shp'
-    tCornerOffset = (246480, 4134660)
-    sPathDates = 'lstdates.txt'
-    sResultsTxt = f'results_20190315.csv'
-    sResultsTxtT = f'results_20190315_T.csv'
-
-    # number of samples needed
-    iSampleMin = 5
-    # list of bandnames
-    lBANDNAME_z2 = ['z2_NBR', 'z2_NDVI', 'z2_NDII', 'z2_TCA', 'z2_RGA']
-    lBANDNAME_r2 = ['r2_NBR', 'r2_NDVI', 'r2_NDII', 'r2_TCA', 'r2_RGA']
-    lBANDNAME_raw = ['NDVI', 'NDII', 'NBR', 'TCA', 'RGA']
-    lBANDNAME = lBANDNAME_z2 + lBANDNAME_r2
-    tDropZerosSlice = (0, 5)
-
-    # Options
-    strSCRATCH = r'D:\swap2'
-    arcpy.env.workspace = strSCRATCH
-    sPrePrefix = 'MedianPre'
-    sPostPrefix = 'MedianPost'
-    lPref = [sPrePrefix, sPostPrefix]
-    lHeaderSub = [f'{sPref}_{sBN}' for sBN in lBANDNAME for sPref in lPref]
-    lHeader = ['ROIID'] + lHeaderSub + ['comment', 'details1', 'details2']
-
-    # ------------------------------
-    if os.path.exists(strSCRATCH):
-        arcpy.env.scratchWorkspace = strSCRATCH
-
-    sOrigPath = edU.expand2TDISpath(sOrigPath)
-    print('\n' + sOrigPath)
-
-    os.chdir(sPathWork)
-
-    xl = pd.ExcelFile(sXL)
-    dfXL = xl.parse(sSheetName)
-
-    aDatesRaw = ppRW.read_datetext(sPathDates)
-    lDatesRaw = [d.isoformat().replace('-', '.') for d in list(aDatesRaw)]
-
-    # Residuals extract
-    for sBN in (lBANDNAME_z2 + lBANDNAME_r2)[:1]:
-        dSamplesText, dicEvLU, dicEvLUdate = prep_alt(sOrigPath, sPathWork, sBN,
-                                                      sPathSHP, tCornerOffset)
-
-    dfOut = pd.DataFrame(columns=lHeader)
-    for i in range(dfXL.shape[0]):
-        srXL = dfXL.iloc[i]
-        print(i, srXL.ROIID)
-        srOut = pd.Series(index=lHeader)
-        srOut.ROIID = srXL.ROIID
-        sComment = ''
-        lDetail1 = ['', '']
-        lDetail2 = ['', '']
-
-        lPathTxt = [ppRW.ROIID_txt_name(srXL.ROIID, sBN, 'extract_files') for sBN in lBANDNAME]
-
-        if False in [os.path.exists(f) for f in lPathTxt]:
-            print('\tNot extracted')
-            dfOut = ppRW.appendSeries(srOut, dfOut, 'Not extracted')
-            continue
-
-        if pd.isna(srXL.t_pre) or pd.isna(srXL.t_post):
-            print('\tMissing t_pre or t_post')
-            dfOut = ppRW.appendSeries(srOut, dfOut, 'Missing t_pre or t_post')
-            continue
-
-        aInd, aMask = ppRW.read_ROIID_texts(lPathTxt)
-
-        # Drop masked values
-        aInd, aDates_m = ppU.drop_masked(aInd, aMask, aDatesRaw)
-        # Drop all zero z2 dates
-        aInd, aDates_m = ppU.drop_zeros(aInd, aDates_m, tDropZerosSlice)
-        # get dates and split pre and post
-        d0 = ppU.timestamp_to_date(srXL.t_pre)
-        d1 = ppU.timestamp_to_date(srXL.t_post)
-        aInd_pre, aD_pre = ppU.split_pre(aInd, aDates_m, d0)
-        aInd_post, aD_post = ppU.split_post(aInd, aDates_m, d1)
-
-        if aInd_pre.shape[0] == 0 or aInd_post.shape[0] == 0:
-            dfOut = ppRW.appendSeries(srOut, dfOut, 't_pre or t_post leaves zero length time frame')
-            continue
-
-        aMedians = np.zeros((2, len(lBANDNAME)))
-
-        lEnum = [[aInd_pre, aD_pre, sPrePrefix], [aInd_post, aD_post, sPostPrefix]]
-        for j, (aInd_m, aD_m, sPrefix) in enumerate(lEnum):
-            lDates = aD_m[ppU.isMonthV(aD_m)].tolist()[:iSampleMin]
-            lStat = aInd_m[ppU.isMonthV(aD_m)].tolist()[:iSampleMin]
-
-            # record length of prefered August September slice
-            lDetail1[j] = (len(lStat))
-
-            if len(lStat) < iSampleMin:
-                #print('\tTake non-summer')
-                lIndNotSummer = aInd_m[~ppU.isMonthV(aD_m)].tolist()
-                lDatesNotSummer = aD_m[~ppU.isMonthV(aD_m)].tolist()
-                lDates += lDatesNotSummer[:iSampleMin - len(lStat)]
-                lStat += lIndNotSummer[:iSampleMin - len(lStat)]
-
-            # record medians
-            srOut[[f'{sPrefix}_{sBN}' for sBN in lBANDNAME]] = np.median(np.array(lStat), axis=0)
-
-            # record width of window used for median
-            dtdRange = max(lDates) - min(lDates)
-            lDetail2[j] = int(dtdRange / dt.timedelta(days=1))
-
-            # comment if median was drawn from less than 5 samples
-            if len(lStat) < iSampleMin:
-                sComment = f'Short pre or post time frame: {len(lStat)}'
-
-        # append results to dataframe
-        srOut.details1 = f'{lDetail1[0]};{lDetail1[1]}'
-        srOut.details2 = f'{lDetail2[0]};{lDetail2[1]}'
-        dfOut = ppRW.appendSeries(srOut, dfOut, sComment)
-
-    dfOut.to_csv(sResultsTxt, index=False)
-    
-    df4RGA = pd.read_csv(sResultsTxt)
-    sBand = 'r2_RGA'
-    lColumn = [f'MedianPre_{sBand}', f'MedianPost_{sBand}']
-    lColumnT = [f'MedianPre_{sBand}_T', f'MedianPost_{sBand}_T']
-    df4RGA = ppU.add_transformed_rga(df4RGA, lColumn, lColumnT)
-    df4RGA.to_csv(sResultsTxtT)
-
-    print('\nDone.')
+"""
+---------------------------------------------------------------------------
+ prepost_event_SingleCell2.py
+ 02/2019
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ script to:
+
+ Known limitations: python 3.6
+---------------------------------------------------------------------------
+"""
+import os
+import numpy as np
+import pandas as pd
+import arcpy
+import edart_utility as edU
+import raster.rasterIO as rastIO
+import prepost_utility as ppU
+import prepost_readwrite as ppRW
+
+def nFrEV_shape(strPath_nFrEV):
+    """ Return (rows, cols) of multiband nFrEV raster, described through its first band
+            (as flatten, arcpy Describe of a multiband dataset has no cell size).
+    """
+    lstBands = rastIO.ListBands(strPath_nFrEV)
+    return rastIO.getSimpleDesc(strPath_nFrEV + os.sep + lstBands[0]).shape
+
+def read_samples(sPathFC, tCornerOffset_, lBANDNAME_, iStore=None):
+    """ Return list of (ROIID, extract text paths for lBANDNAME_, row, col) of samples
+            in sPathFC not yet extracted for every band in lBANDNAME_.
+        sPathFC is a point feature class containing projected X and Y fields.
+        Optional iStore: ppRW.ExtractStore, samples in it are done.
+    """
+    iCELLSIZE = 30
+    Xp0, Yp0 = tCornerOffset_
+
+    print('Reading samples...\n')
+    lSamples = []
+    with arcpy.da.SearchCursor(sPathFC, ('ROIID', 'x', 'y')) as rows_:
+        for row_ in rows_:
+            sROIID = row_[0]
+
+            print(sROIID)
+            if sROIID is None:
+                print('\tNo ROIID, Skipping.')
+                continue
+
+            lPathTXT = [ppRW.ROIID_txt_name(sROIID, sBN, 'extract_files') for sBN in lBANDNAME_]
+            if (sROIID in iStore) if iStore is not None else all(os.path.exists(f) for f in lPathTXT):
+                print('\tROIID already done.')
+                continue
+
+            Xp, Yp = row_[1:]
+            X = int((Xp - Xp0) / iCELLSIZE)
+            Y = int(-(Yp - Yp0) / iCELLSIZE)
+            lSamples.append((sROIID, lPathTXT, Y, X))
+
+    return lSamples
+
+def write_samples(lSamples, a2D_Index, a2D_Mask, iBand=0):
+    """ Write (frame, sample) index and mask to extract text iBand of each sample.
+        Return dictionary of ROIID: text path.
+    """
+    dSamplesText_ = {}
+    for j, (sROIID, lPathTXT, Y, X) in enumerate(lSamples):
+        strPathTXT = lPathTXT[iBand]
+        if not os.path.exists(os.path.dirname(strPathTXT)):
+            os.makedirs(os.path.dirname(strPathTXT))
+
+        print('\t', strPathTXT)
+        dfSample = pd.DataFrame({'Index':a2D_Index[:, j], 'Mask':a2D_Mask[:, j]})
+        dfSample.to_csv(strPathTXT, index=False)
+        dSamplesText_[sROIID] = strPathTXT
+
+    return dSamplesText_
+
+def prep_alt(strOriginalPath, strWorkingPath, BANDNAME_, sPathFC, tCornerOffset_, lRawDates_=None,
+             bPoints=False, bMemmap=True, iThreads=1, strPathCache=None):
+    """ Prep data. Get array stack for given BANDNAME_ and extract
+            samples given in sPathFC to text files.
+            sPathFC is a point feature class containing projected X and Y fields.
+        Optional bPoints: read only the sample pixels from each frame and mask
+            (edU.ExtractFramesPoints, bMemmap, iThreads) instead of ingesting full frames.
+        Optional strPathCache: frame cube cache folder (see frame_cache), reused across runs.
+    """
+    # load rasters
+    strPathScene = edU.getSceneDir(strOriginalPath)
+    strPath_nFrEV = edU.get_nFrEV(strOriginalPath)
+    arcpy.env.workspace = strWorkingPath
+
+    lSamples = read_samples(sPathFC, tCornerOffset_, [BANDNAME_])
+
+    aRows = np.array([t[2] for t in lSamples], dtype=np.intp)
+    aCols = np.array([t[3] for t in lSamples], dtype=np.intp)
+    if bPoints:
+        tupShp = nFrEV_shape(strPath_nFrEV)
+        print('\t\tFrEV shape: ', tupShp)
+        a2D_Index, a2D_Mask, dEvLU_, dDateLU_ = edU.ExtractFramesPoints(strPathScene, BANDNAME_, tupShp,
+                                                                        aRows, aCols,
+                                                                        lRawDates=lRawDates_,
+                                                                        bMemmap=bMemmap,
+                                                                        iThreads=iThreads,
+                                                                        strPathCache=strPathCache)
+    else:
+        print('\n\tIngesting Frame EVT raster...')
+        arr3D_FrEV = rastIO.RasterToNumPyArray(strPath_nFrEV)
+        print('\t\tFrEV shape: ', arr3D_FrEV.shape)
+        a3D_Index, a3D_Mask, dEvLU_, dDateLU_ = edU.IngestFramesPartial(strPathScene, BANDNAME_,
+                                                                        arr3D_FrEV.shape[1:],
+                                                                        lRawDates=lRawDates_,
+                                                                        bReturnDateLU=True,
+                                                                        strPathCache=strPathCache)
+        a2D_Index = a3D_Index[:, aRows, aCols]
+        a2D_Mask = a3D_Mask[:, aRows, aCols]
+        del arr3D_FrEV, a3D_Index, a3D_Mask
+
+    dSamplesText_ = write_samples(lSamples, a2D_Index, a2D_Mask)
+
+    return dSamplesText_, dEvLU_, dDateLU_
+
+def prep_multi(strOriginalPath, strWorkingPath, lBANDNAME_, sPathFC, tCornerOffset_, lRawDates_=None,
+               bPoints=True, bMemmap=True, iThreads=1, strPathCache=None, strPathStore=None):
+    """ Multi band prep_alt. Read frames once for all bands in lBANDNAME_ (one shared
+            DM mask) and extract samples given in sPathFC to per band text files.
+        Return dictionary of band name: {ROIID: text path}, dEvLU_, dDateLU_.
+        Optional bPoints: read only the sample pixels of each band and mask
+            (edU.ExtractFramesPointsMulti, bMemmap, iThreads), default. False: ingest
+            full frames of every band (edU.IngestFramesMulti), memory of the whole
+            (band, frame, row, col) cube.
+        Optional strPathStore: write samples to a ppRW.ExtractStore folder
+            (a part appended on resumed runs) instead of text files, return its path
+            in place of the text dictionary.
+    """
+    # load rasters
+    strPathScene = edU.getSceneDir(strOriginalPath)
+    strPath_nFrEV = edU.get_nFrEV(strOriginalPath)
+    arcpy.env.workspace = strWorkingPath
+
+    iStore = ppRW.ExtractStore(strPathStore, lBANDNAME_) if strPathStore else None
+    lSamples = read_samples(sPathFC, tCornerOffset_, lBANDNAME_, iStore)
+    if iStore is not None and not lSamples:
+        print('\tAll samples in store.')
+        return strPathStore, None, None
+
+    aRows = np.array([t[2] for t in lSamples], dtype=np.intp)
+    aCols = np.array([t[3] for t in lSamples], dtype=np.intp)
+    tupShp = nFrEV_shape(strPath_nFrEV)
+    print('\t\tFrEV shape: ', tupShp)
+    if bPoints:
+        a3D_Index, a2D_Mask, dEvLU_, dDateLU_ = edU.ExtractFramesPointsMulti(strPathScene, lBANDNAME_,
+                                                                             tupShp, aRows, aCols,
+                                                                             lRawDates=lRawDates_,
+                                                                             bMemmap=bMemmap,
+                                                                             iThreads=iThreads,
+                                                                             strPathCache=strPathCache)
+    else:
+        a4D_Index, a3D_Mask, dEvLU_, dDateLU_ = edU.IngestFramesMulti(strPathScene, lBANDNAME_, tupShp,
+                                                                      lRawDates=lRawDates_,
+                                                                      bReturnDateLU=True,
+                                                                      bMemmap=bMemmap,
+                                                                      iThreads=iThreads,
+                                                                      strPathCache=strPathCache)
+        a3D_Index = a4D_Index[:, :, aRows, aCols]
+        a2D_Mask = a3D_Mask[:, aRows, aCols]
+        del a4D_Index, a3D_Mask
+
+    if iStore is not None:
+        print('\tTo store: ' + strPathStore)
+        aDates = ppU.parse_dates64([dDateLU_[i] for i in range(len(dDateLU_))])
+        iStore.append([t[0] for t in lSamples], a3D_Index.transpose(2, 1, 0), a2D_Mask.T, aDates)
+        return strPathStore, dEvLU_, dDateLU_
+
+    dSamplesText_ = {}
+    for j, sBN in enumerate(lBANDNAME_):
+        dSamplesText_[sBN] = write_samples(lSamples, a3D_Index[j], a2D_Mask, j)
+
+    return dSamplesText_, dEvLU_, dDateLU_
+
+# -------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+    # ------------------------------
+    # User Variables
+    sOrigPath = r'D:\p_data\edartOps\data\sc_dev\sc5rse_v03\envi_aux\TDIS\TDISm__r180821_1945_93fr_180822-0554'
+    sPathWork = r'N:\project\EDART_vol\projects\MMI'
+    sXL = 'test_evt_sc5_20190315.xlsx'
+    sSheetName = 'TotalSample'
+    sPathSHP = r'shapes\sc5_validation_plots_20190315.shp'
+    tCornerOffset = (246480, 4134660)
+    sPathDates = 'lstdates.txt'
+    sResultsTxt = f'results_20190315.csv'
+    sResultsTxtT = f'results_20190315_T.csv'
+
+    # number of samples needed
+    iSampleMin = 5
+    # list of bandnames
+    lBANDNAME_z2 = ['z2_NBR', 'z2_NDVI', 'z2_NDII', 'z2_TCA', 'z2_RGA']
+    lBANDNAME_r2 = ['r2_NBR', 'r2_NDVI', 'r2_NDII', 'r2_TCA', 'r2_RGA']
+    lBANDNAME_raw = ['NDVI', 'NDII', 'NBR', 'TCA', 'RGA']
+    lBANDNAME = lBANDNAME_z2 + lBANDNAME_r2
+    tDropZerosSlice = (0, 5)
+    # results rows buffered before writing to csv
+    iFlush = 10000
+    # extract store folder (see ppRW.ExtractStore.from_texts for older text extracts)
+    sPathStore = 'extract_files/extract_store'
+
+    # Options
+    strSCRATCH = r'D:\swap2'
+    arcpy.env.workspace = strSCRATCH
+    sPrePrefix = 'MedianPre'
+    sPostPrefix = 'MedianPost'
+    lPref = [sPrePrefix, sPostPrefix]
+    lHeaderSub = [f'{sPref}_{sBN}' for sBN in lBANDNAME for sPref in lPref]
+    lHeader = ['ROIID'] + lHeaderSub + ['comment', 'details1', 'details2']
+
+    # ------------------------------
+    if os.path.exists(strSCRATCH):
+        arcpy.env.scratchWorkspace = strSCRATCH
+
+    sOrigPath = edU.expand2TDISpath(sOrigPath)
+    print('\n' + sOrigPath)
+
+    os.chdir(sPathWork)
+
+    xl = pd.ExcelFile(sXL)
+    dfXL = xl.parse(sSheetName)
+
+    aDatesRaw = ppRW.read_datetext64(sPathDates)
+    lDatesRaw = [d.replace('-', '.') for d in np.datetime_as_string(aDatesRaw)]
+    iDateIndex = ppU.DateIndex(aDatesRaw)
+
+    # Residuals extract
+    prep_multi(sOrigPath, sPathWork, lBANDNAME, sPathSHP, tCornerOffset, strPathStore=sPathStore)
+
+    # all ROIs as (roi, time, band) cube, pre/post medians in one pass
+    lROIID = dfXL.ROIID.tolist()
+    a3_Ind, a2_Mask, aExtracted = ppRW.ExtractStore(sPathStore, lBANDNAME).read_cube(lROIID)
+    aMissing = (dfXL.t_pre.isna() | dfXL.t_post.isna()).to_numpy()
+    aD0 = ppU.dates64(dfXL.t_pre.to_numpy(dtype='datetime64[ns]'))
+    aD1 = ppU.dates64(dfXL.t_post.to_numpy(dtype='datetime64[ns]'))
+    dicMed = ppU.median_prepost_batch(a3_Ind, a2_Mask, iDateIndex, aD0, aD1, iSampleMin,
+                                      tDropZerosSlice)
+
+    iResults = ppRW.Results(lHeader, sResultsTxt, iFlush=iFlush)
+    for i, sROIID in enumerate(lROIID):
+        print(i, sROIID)
+        dicOut = {'ROIID': sROIID}
+
+        if not aExtracted[i]:
+            print('\tNot extracted')
+            iResults.append(dicOut, 'Not extracted')
+            continue
+
+        if aMissing[i]:
+            print('\tMissing t_pre or t_post')
+            iResults.append(dicOut, 'Missing t_pre or t_post')
+            continue
+
+        if dicMed['Empty'][i]:
+            iResults.append(dicOut, 't_pre or t_post leaves zero length time frame')
+            continue
+
+        # record medians
+        for j, sPrefix in enumerate(lPref):
+            dicOut.update(zip([f'{sPrefix}_{sBN}' for sBN in lBANDNAME], dicMed['Median'][i, j]))
+
+        # append results
+        aDetail1, aDetail2 = dicMed['Detail1'][i], dicMed['Detail2'][i]
+        dicOut['details1'] = f'{aDetail1[0]};{aDetail1[1]}'
+        dicOut['details2'] = f'{aDetail2[0]};{aDetail2[1]}'
+        iResults.append(dicOut, ppU.batch_comment(dicMed['Count'][i], iSampleMin))
+
+    iResults.close()
+
+    df4RGA = pd.read_csv(sResultsTxt)
+    sBand = 'r2_RGA'
+    lColumn = [f'MedianPre_{sBand}', f'MedianPost_{sBand}']
+    lColumnT = [f'MedianPre_{sBand}_T', f'MedianPost_{sBand}_T']
+    df4RGA = ppU.add_transformed_rga(df4RGA, lColumn, lColumnT)
+    df4RGA.to_csv(sResultsTxtT)
+
+    print('\nDone.')
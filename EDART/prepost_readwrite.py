@@ -1,68 +1,322 @@
-# -*- coding: utf-8 -*-
-"""
----------------------------------------------------------------------------
- prepost_readwrite.py
- 02/2019
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- script to:
-
- Known limitations: python 3.6
----------------------------------------------------------------------------
-"""
-import datetime
-import numpy as np
-import pandas as pd
-
-# ---------------------------------------------------------------------------
-# recording functions
-def blank_line(sROIID_, sComment_, iIndexCount_):
-    """ Return correctly sized filler line for when extract is not possible. """
-    iCommaCount = 2 * iIndexCount_ + 1
-    return f'"{sROIID_}"{"," * iCommaCount}{sComment_}'
-
-def write_blank(sROIID_, sComment_, txt_, iIndexCount=4):
-    """ Write blank record to txt. """
-    print(f'\t{sComment_}, skipping')
-    sBlank = blank_line(sROIID_, sComment_, iIndexCount)
-    txt_.write(f'{sBlank}\n')
-
-def write_record(sROIID_, aM, txt_, sComment_='', sComment2_='', sComment3_=''):
-    """ Write record to txt. """
-    sM = ','.join(f'{aM[0,i]},{aM[1,i]}' for i in range(aM.shape[1]))
-    sRec = f'"{sROIID_}",{sM},{sComment_},{sComment2_},{sComment3_}'
-    txt_.write(f'{sRec}\n')
-
-# ---------------------------------------------------------------------------
-# pandas recording functions
-def appendSeries(sr_, df_, sComment='', sCommentCol='comment'):
-    """ Return dataframe df_ with series sr_ appended
-        sr_.sCommentCol = sComment prior to append.
-    """
-    sr_[sCommentCol] = sComment
-    return df_.append(sr_, ignore_index=True)
-
-# ---------------------------------------------------------------------------
-# read text functions
-def read_datetext(sPathTxt_):
-    """ Return date array from text file sPathTxt. """
-    lstD = [datetime.date(*[int(s) for s in l.strip().split('.')]) for l in open(sPathTxt_, 'r').readlines()]
-    return np.array(lstD)
-
-def read_ROIID_texts(lPathTxt_, tF=('Index', 'Mask')):
-    """ Return index and mask arrays from text file sPathTxt. """
-    lDF = [pd.read_csv(t) for t in lPathTxt_]
-    aIndex_ = np.stack([np.array(df[tF[0]]) for df in lDF]).transpose()
-    aMask_ = np.array(lDF[0][tF[1]])
-
-    return aIndex_, aMask_
-
-def ROIID_txt_name(sROIID, BANDNAME_, sSubDir=None):
-    """ Return ROIID text name. """
-    if sSubDir:
-        return f'{sSubDir}/{BANDNAME_}/{BANDNAME_}__{sROIID}.txt'
-    return f'{BANDNAME_}/{BANDNAME_}__{sROIID}.txt'
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------
+ prepost_readwrite.py
+ 02/2019
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ script to:
+
+ Known limitations: python 3.6
+---------------------------------------------------------------------------
+"""
+import os
+import glob
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import prepost_utility as ppU
+
+# ---------------------------------------------------------------------------
+# recording functions
+def blank_line(sROIID_, sComment_, iIndexCount_):
+    """ Return correctly sized filler line for when extract is not possible. """
+    iCommaCount = 2 * iIndexCount_ + 1
+    return f'"{sROIID_}"{"," * iCommaCount}{sComment_}'
+
+def write_blank(sROIID_, sComment_, txt_, iIndexCount=4):
+    """ Write blank record to txt. """
+    print(f'\t{sComment_}, skipping')
+    sBlank = blank_line(sROIID_, sComment_, iIndexCount)
+    txt_.write(f'{sBlank}\n')
+
+def write_record(sROIID_, aM, txt_, sComment_='', sComment2_='', sComment3_=''):
+    """ Write record to txt. """
+    sM = ','.join(f'{aM[0,i]},{aM[1,i]}' for i in range(aM.shape[1]))
+    sRec = f'"{sROIID_}",{sM},{sComment_},{sComment2_},{sComment3_}'
+    txt_.write(f'{sRec}\n')
+
+# ---------------------------------------------------------------------------
+# pandas recording functions
+def appendSeries(sr_, df_, sComment='', sCommentCol='comment'):
+    """ Return dataframe df_ with series sr_ appended
+        sr_.sCommentCol = sComment prior to append.
+        Copies df_ on every call, use Results to accumulate many records.
+    """
+    sr_[sCommentCol] = sComment
+    return pd.concat([df_, sr_.to_frame().T], ignore_index=True)
+
+class Results():
+    """ Results record accumulator (replaces repeated appendSeries).
+        Records are buffered as columnar lists and materialized into a DataFrame once.
+        Optional sPathCSV and iFlush: stream buffer to sPathCSV every iFlush records
+            (and on close), so memory stays flat for large sample sets.
+    """
+    def __init__(self, lHeader_, sPathCSV=None, iFlush=None, sCommentCol='comment'):
+        """ init """
+        self.header = list(lHeader_)
+        self.path = sPathCSV
+        self.flushEvery = iFlush
+        self.commentCol = sCommentCol
+        self.count = 0
+        self.written = 0
+        self._buffer = {c: [] for c in self.header}
+        if iFlush and not sPathCSV:
+            raise Exception('Results, iFlush requires sPathCSV.')
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, dicRec_, sComment=''):
+        """ Append record dicRec_ (dictionary or series, missing columns are blank)
+                with dicRec_.sCommentCol = sComment, as appendSeries.
+        """
+        for c in self.header:
+            self._buffer[c].append(dicRec_.get(c))
+        self._buffer[self.commentCol][-1] = sComment
+        self.count += 1
+        if self.flushEvery and self.count - self.written >= self.flushEvery:
+            self.flush()
+
+    def _frame(self):
+        """ Return DataFrame of buffered records. """
+        return pd.DataFrame(self._buffer, columns=self.header)
+
+    def flush(self):
+        """ Write buffered records to sPathCSV (header with first write) and clear buffer. """
+        if not self.path or (self.written and self.count == self.written):
+            return
+        self._frame().to_csv(self.path, mode='a' if self.written else 'w', header=not self.written,
+                             index=False)
+        self.written = self.count
+        self._buffer = {c: [] for c in self.header}
+
+    def close(self):
+        """ Flush remaining records to sPathCSV. """
+        self.flush()
+
+    def to_frame(self):
+        """ Return DataFrame of all records (read back from sPathCSV when streaming). """
+        if self.path:
+            self.flush()
+            return pd.read_csv(self.path)
+        return self._frame()
+
+# ---------------------------------------------------------------------------
+# read text functions
+def read_datetext(sPathTxt_):
+    """ Return date array from text file sPathTxt. """
+    lstD = [datetime.date(*[int(s) for s in l.strip().split('.')]) for l in open(sPathTxt_, 'r').readlines()]
+    return np.array(lstD)
+
+def read_datetext64(sPathTxt_):
+    """ Return datetime64[D] date array from text file sPathTxt (see ppU.parse_dates64). """
+    with open(sPathTxt_, 'r') as txt:
+        return ppU.parse_dates64([l for l in txt if l.strip()])
+
+def read_ROIID_texts(lPathTxt_, tF=('Index', 'Mask')):
+    """ Return index and mask arrays from text file sPathTxt. """
+    lDF = [pd.read_csv(t) for t in lPathTxt_]
+    aIndex_ = np.stack([np.array(df[tF[0]]) for df in lDF]).transpose()
+    aMask_ = np.array(lDF[0][tF[1]])
+
+    return aIndex_, aMask_
+
+def read_ROIID_cube(lROIID_, lBANDNAME_, sSubDir=None):
+    """ Return (roi, time, band) index and (roi, time) mask arrays for ROIs in lROIID_
+            from their extract texts (read_ROIID_texts), and (roi,) boolean array,
+            True where all band texts exist. Missing ROIs are left 0.
+    """
+    lIndex, lMask = [], []
+    aExists_ = np.zeros(len(lROIID_), dtype=bool)
+    for i, sROIID in enumerate(lROIID_):
+        lPathTxt = [ROIID_txt_name(sROIID, sBN, sSubDir) for sBN in lBANDNAME_]
+        if False in [os.path.exists(f) for f in lPathTxt]:
+            lIndex.append(None)
+            lMask.append(None)
+            continue
+        aIndex, aMask = read_ROIID_texts(lPathTxt)
+        lIndex.append(aIndex)
+        lMask.append(aMask)
+        aExists_[i] = True
+
+    if not aExists_.any():
+        raise Exception('read_ROIID_cube, no ROIs extracted.')
+    iT = len(next(a for a in lMask if a is not None))
+    a3_Index_ = np.zeros((len(lROIID_), iT, len(lBANDNAME_)), dtype=np.int16)
+    a2_Mask_ = np.zeros((len(lROIID_), iT), dtype=np.int16)
+    for i in np.flatnonzero(aExists_):
+        a3_Index_[i] = lIndex[i]
+        a2_Mask_[i] = lMask[i]
+
+    return a3_Index_, a2_Mask_, aExists_
+
+def ROIID_txt_name(sROIID, BANDNAME_, sSubDir=None):
+    """ Return ROIID text name. """
+    if sSubDir:
+        return f'{sSubDir}/{BANDNAME_}/{BANDNAME_}__{sROIID}.txt'
+    return f'{BANDNAME_}/{BANDNAME_}__{sROIID}.txt'
+
+# ---------------------------------------------------------------------------
+# extract store
+class ExtractStore():
+    """ Store of sample extracts for all ROIs, replacing the per ROI, per band extract texts.
+        Folder sPath of part files (.npz), one written per append, so an append costs the
+            ROIs added only and resumed runs add parts to the same store. Part arrays:
+            ROIID (roi,), Index (roi, frame, band) int16, Mask (roi, frame) int16 raw DM
+            or boolean keep mask and optional Dates (frame,) datetime64[D].
+        Bands, frame count and mask dtype are kept in meta.json. ROIIDs are stored as
+            strings, a ROI appended again is read from its latest part.
+    """
+    def __init__(self, sPath, lBANDNAME_=None):
+        """ init
+            lBANDNAME_: band order of a new store, checked against an existing one.
+        """
+        self.path = sPath
+        self.bands = list(lBANDNAME_) if lBANDNAME_ else None
+        self._data = None
+        self._lookup = {}
+        if self.exists():
+            lBands = self.meta()['bands']
+            if self.bands and self.bands != lBands:
+                raise Exception(f'ExtractStore, bands {self.bands} do not match store {lBands}.')
+            self.bands = lBands
+
+    def exists(self):
+        """ Return True if store has been written (meta.json exists). """
+        return os.path.exists(self.path + os.sep + 'meta.json')
+
+    def meta(self):
+        """ Return store metadata dictionary (bands, frames, mask dtype). """
+        with open(self.path + os.sep + 'meta.json') as txt:
+            return json.load(txt)
+
+    def _parts(self):
+        """ Return sorted list of part file paths. """
+        return sorted(glob.glob(self.path + os.sep + 'part_*.npz'))
+
+    def load(self):
+        """ Return dictionary of store arrays, parts concatenated in append order, read once. """
+        if self._data is None:
+            dicMeta = self.meta()
+            lParts = []
+            for sPart in self._parts():
+                with np.load(sPart) as npz:
+                    lParts.append({k: npz[k] for k in npz.files})
+            dicData = {'ROIID': np.array([], dtype=str),
+                       'Index': np.zeros((0, dicMeta['frames'], len(self.bands)), dtype=np.int16),
+                       'Mask': np.zeros((0, dicMeta['frames']), dtype=dicMeta['mask'])}
+            if lParts:
+                dicData = {k: np.concatenate([d[k] for d in lParts]) for k in dicData}
+            lDates = [d['Dates'] for d in lParts if 'Dates' in d]
+            if lDates:
+                dicData['Dates'] = lDates[-1]
+            dicData['Bands'] = np.array(self.bands)
+            self._data = dicData
+            # later parts replace earlier ROIs
+            self._lookup = {s: i for i, s in enumerate(dicData['ROIID'].tolist())}
+        return self._data
+
+    def roiids(self):
+        """ Return list of ROIIDs in store. """
+        if not self.exists():
+            return []
+        self.load()
+        return list(self._lookup)
+
+    def __contains__(self, sROIID):
+        if not self.exists():
+            return False
+        self.load()
+        return str(sROIID) in self._lookup
+
+    def __len__(self):
+        return len(self.roiids())
+
+    def append(self, lROIID_, a3_Index_, a2_Mask_, aDates_=None):
+        """ Add (roi, frame, band) index and (roi, frame) mask of ROIs lROIID_ to store,
+                as a new part file. ROIs already in the store are replaced.
+        """
+        if self.bands is None:
+            raise Exception('ExtractStore.append, new store needs lBANDNAME_.')
+        aROIID = np.array([str(s) for s in lROIID_])
+        a3_Index_ = np.asarray(a3_Index_, dtype=np.int16)
+        # raw DM masks stored int16, boolean keep masks (ppU.keep_mask) as is
+        a2_Mask_ = np.asarray(a2_Mask_)
+        if a2_Mask_.dtype != bool:
+            a2_Mask_ = a2_Mask_.astype(np.int16)
+        if a2_Mask_.ndim != 2 or a2_Mask_.shape[0] != len(aROIID) or \
+                a3_Index_.shape != (len(aROIID), a2_Mask_.shape[1], len(self.bands)):
+            raise Exception(f'ExtractStore.append, shapes {a3_Index_.shape} and {a2_Mask_.shape} '
+                            f'do not match {len(aROIID)} ROIs, {len(self.bands)} bands.')
+
+        if self.exists():
+            dicMeta = self.meta()
+            if dicMeta['frames'] != a2_Mask_.shape[1]:
+                raise Exception('ExtractStore.append, frame count does not match store.')
+            if dicMeta['mask'] != str(a2_Mask_.dtype):
+                raise Exception(f'ExtractStore.append, mask dtype {a2_Mask_.dtype} does not match '
+                                f'store {dicMeta["mask"]}.')
+        else:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            dicMeta = {'bands': self.bands, 'frames': a2_Mask_.shape[1], 'mask': str(a2_Mask_.dtype)}
+            with open(self.path + os.sep + 'meta.json', 'w') as txt:
+                json.dump(dicMeta, txt)
+
+        if len(aROIID):
+            dicData = {'ROIID': aROIID, 'Index': a3_Index_, 'Mask': a2_Mask_}
+            if aDates_ is not None:
+                dicData['Dates'] = np.asarray(aDates_, dtype='datetime64[D]')
+            sPart = self.path + os.sep + f'part_{len(self._parts()):05d}.npz'
+            sTmp = sPart[:-4] + '_tmp.npz'
+            np.savez(sTmp, **dicData)
+            os.replace(sTmp, sPart)
+        self._data = None
+
+    def read(self, sROIID):
+        """ Return (frame, band) index and (frame,) mask arrays of one ROI, as read_ROIID_texts. """
+        if sROIID not in self:
+            raise Exception(f'ExtractStore.read, {sROIID} not in store.')
+        dicData = self.load()
+        i = self._lookup[str(sROIID)]
+        return dicData['Index'][i], dicData['Mask'][i]
+
+    def read_cube(self, lROIID_=None, lBANDNAME_=None):
+        """ Return (roi, frame, band) index and (roi, frame) mask arrays for ROIs in lROIID_
+                (default all) and bands lBANDNAME_ (default all), and (roi,) boolean array,
+                True where ROI is in store, as read_ROIID_cube. Missing ROIs are left 0.
+        """
+        if not self.exists():
+            raise Exception(f'ExtractStore.read_cube, no store at {self.path}.')
+        dicData = self.load()
+        if lROIID_ is None:
+            lROIID_ = list(self._lookup)
+        aBand = slice(None) if lBANDNAME_ is None else [self.bands.index(b) for b in lBANDNAME_]
+        aPos = np.array([self._lookup.get(str(s), -1) for s in lROIID_], dtype=np.intp)
+        aExists_ = aPos >= 0
+        a3_Index_ = np.zeros((len(aPos),) + dicData['Index'].shape[1:], dtype=dicData['Index'].dtype)
+        a2_Mask_ = np.zeros((len(aPos),) + dicData['Mask'].shape[1:], dtype=dicData['Mask'].dtype)
+        a3_Index_[aExists_] = dicData['Index'][aPos[aExists_]]
+        a2_Mask_[aExists_] = dicData['Mask'][aPos[aExists_]]
+        return a3_Index_[:, :, aBand], a2_Mask_, aExists_
+
+    def from_texts(self, lROIID_, sSubDir=None):
+        """ Add extract texts (ROIID_txt_name) of ROIs in lROIID_ to store.
+            Return number of ROIs added.
+        """
+        a3_Index, a2_Mask, aExists = read_ROIID_cube(lROIID_, self.bands, sSubDir)
+        lROIID = [s for s, b in zip(lROIID_, aExists) if b]
+        self.append(lROIID, a3_Index[aExists], a2_Mask[aExists])
+        return len(lROIID)
@@ -1,97 +1,372 @@
-# -*- coding: utf-8 -*-
-"""
----------------------------------------------------------------------------
- prepost_utility.py
- 02/2019
-
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- script to:
-
- Known limitations: python 3.6
----------------------------------------------------------------------------
-"""
-import datetime
-import math
-import numpy as np
-
-# ---------------------------------------------------------------------------
-# rga transform
-def transform_rga(fRGA):
-    """ Return inverse transform of dRGA values.
-        RGA assummed to be in degrees, not radians!
-        Note RGA rasters are writen scaled, see scale RGA.
-    """
-    return math.tan(math.pi* fRGA / 180)
-
-def descale_rga(fRGA, fScale=100):
-    """ de-scale dRGA values.
-        RGA rasters are writen scaled, i.e. RGAscaled = RGA * fScale
-    """
-    return fRGA / fScale
-
-def descale_transform_rga(fRGA):
-    """ Combine transform_rga and  descale_rga. """
-    return transform_rga(descale_rga(fRGA))
-
-def add_transformed_rga(dfIn, lColumn_, lColumnT_):
-    """ Add tranform of fields in lColumn as fields in lColumnT. """
-    for sColumn, sColumnT in zip(lColumn_, lColumnT_):
-        dfIn[sColumnT] = dfIn[sColumn].apply(descale_transform_rga)
-    return dfIn
-
-# ---------------------------------------------------------------------------
-# time filtering
-def split_pre(aI_, aD_, d_, iDays=548):
-    """ Return aI_, aM_, aD_  masked to within 1.5 years (or iDays).
-        Pre arrays are returned reversed (starting with date closest to d0)
-    """
-    aTest = np.logical_and(aD_ < d_, aD_ > d_ - datetime.timedelta(iDays))
-    aIpre = aI_[aTest]
-    aDpre = aD_[aTest]
-
-    return np.flip(aIpre, axis=0), np.flip(aDpre, axis=0)
-
-def split_post(aI_, aD_, d_, iDays=548):
-    """ Return aI_, aM_, aD_  masked to within 1.5 years (or iDays). """
-    aTest = np.logical_and(aD_ > d_, aD_ < d_ + datetime.timedelta(iDays))
-    aIpost = aI_[aTest]
-    aDpost = aD_[aTest]
-
-    return aIpost, aDpost
-
-def timestamp_to_date(ts):
-    """ Return datetime date from pandas timestamp. """
-    return datetime.date(ts.year, ts.month, ts.day)
-
-def isMonth(d_):
-    """ Return true if date is August thru September. """
-    tMonths_ = (8, 9)
-    return d_.month in tMonths_
-
-isMonthV = np.vectorize(isMonth)
-
-# ---------------------------------------------------------------------------
-# other filtering
-
-def drop_masked(aI_, aM_, aD_):
-    """ Return aI_, aD_ with masked DM values removed. """
-    aKeep = np.logical_or(aM_ == 0, aM_ >= 200)
-    return aI_[aKeep], aD_[aKeep]
-
-def drop_zeros(aI_, aD_, tDropZerosSlice_=None):
-    """ Return aI_, aD_ with all 0 ([0,0,0,0]) frames (axis=1 in aI_) removed.
-        Optional iWidth: do zeros check only over first iWidth columns.
-            (meant to separate z2 columns from raw columns)
-    """
-    if tDropZerosSlice_ is None:
-        iStart, iEnd = 0, aI_.shape[1]
-    else:
-        iStart, iEnd = tDropZerosSlice_
-
-    aKeep = ~np.logical_and(np.ptp(aI_[:, iStart:iEnd], axis=1) == 0,
-                            np.sum(aI_[:, iStart:iEnd], axis=1) == 0)
-    return aI_[aKeep], aD_[aKeep]
+# -*- coding: utf-8 -*-
+"""
+---------------------------------------------------------------------------
+ prepost_utility.py
+ 02/2019
+
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ script to:
+
+ Known limitations: python 3.6
+---------------------------------------------------------------------------
+"""
+import datetime
+import math
+import numpy as np
+import edart_utility as edU
+
+# ---------------------------------------------------------------------------
+# rga transform
+def transform_rga(fRGA):
+    """ Return inverse transform of dRGA values.
+        RGA assummed to be in degrees, not radians!
+        Note RGA rasters are writen scaled, see scale RGA.
+    """
+    return math.tan(math.pi* fRGA / 180)
+
+def descale_rga(fRGA, fScale=100):
+    """ de-scale dRGA values.
+        RGA rasters are writen scaled, i.e. RGAscaled = RGA * fScale
+    """
+    return fRGA / fScale
+
+def descale_transform_rga(fRGA):
+    """ Combine transform_rga and  descale_rga. """
+    return transform_rga(descale_rga(fRGA))
+
+def add_transformed_rga(dfIn, lColumn_, lColumnT_):
+    """ Add tranform of fields in lColumn as fields in lColumnT. """
+    for sColumn, sColumnT in zip(lColumn_, lColumnT_):
+        dfIn[sColumnT] = dfIn[sColumn].apply(descale_transform_rga)
+    return dfIn
+
+# ---------------------------------------------------------------------------
+# time filtering
+def split_pre(aI_, aD_, d_, iDays=548):
+    """ Return aI_, aM_, aD_  masked to within 1.5 years (or iDays).
+        Pre arrays are returned reversed (starting with date closest to d0)
+    """
+    aTest = np.logical_and(aD_ < d_, aD_ > d_ - datetime.timedelta(iDays))
+    aIpre = aI_[aTest]
+    aDpre = aD_[aTest]
+
+    return np.flip(aIpre, axis=0), np.flip(aDpre, axis=0)
+
+def split_post(aI_, aD_, d_, iDays=548):
+    """ Return aI_, aM_, aD_  masked to within 1.5 years (or iDays). """
+    aTest = np.logical_and(aD_ > d_, aD_ < d_ + datetime.timedelta(iDays))
+    aIpost = aI_[aTest]
+    aDpost = aD_[aTest]
+
+    return aIpost, aDpost
+
+def timestamp_to_date(ts):
+    """ Return datetime date from pandas timestamp. """
+    return datetime.date(ts.year, ts.month, ts.day)
+
+def isMonth(d_):
+    """ Return true if date is August thru September. """
+    tMonths_ = (8, 9)
+    return d_.month in tMonths_
+
+isMonthV = np.vectorize(isMonth)
+
+# ---------------------------------------------------------------------------
+# datetime64 time filtering
+def dates64(lD_):
+    """ Return datetime64[D] array of dates lD_ (datetime.date, pandas timestamps,
+            ISO strings or datetime64, None: NaT).
+    """
+    return np.asarray(lD_, dtype='datetime64[D]')
+
+def parse_dates64(lStr_, sSep='.'):
+    """ Return datetime64[D] array from 'YYYY.MM.DD' strings (sSep separated, padding optional). """
+    aYMD = np.array([s.strip().split(sSep) for s in lStr_], dtype=np.int64).reshape(-1, 3)
+    aM = (aYMD[:, 0] - 1970) * 12 + aYMD[:, 1] - 1
+    return aM.astype('datetime64[M]').astype('datetime64[D]') + (aYMD[:, 2] - 1)
+
+def month64(aD_):
+    """ Return month (1-12) of datetime64 array aD_. """
+    return (dates64(aD_).astype('M8[M]').astype(np.int64) % 12 + 1).astype(np.int8)
+
+def isMonth64(aD_, tMonths_=(8, 9)):
+    """ datetime64 isMonthV: return True where month of aD_ in tMonths_ (August thru September). """
+    return np.isin(month64(aD_), tMonths_)
+
+def split_pre64(aI_, aD_, d_, iDays=548):
+    """ datetime64 split_pre: return aI_, aD_ within iDays before d_, reversed
+            (starting with date closest to d_).
+    """
+    aD_ = dates64(aD_)
+    d_ = np.datetime64(d_, 'D')
+    aTest = (aD_ < d_) & (aD_ > d_ - np.timedelta64(iDays, 'D'))
+    return np.flip(aI_[aTest], axis=0), np.flip(aD_[aTest], axis=0)
+
+def split_post64(aI_, aD_, d_, iDays=548):
+    """ datetime64 split_post: return aI_, aD_ within iDays after d_. """
+    aD_ = dates64(aD_)
+    d_ = np.datetime64(d_, 'D')
+    aTest = (aD_ > d_) & (aD_ < d_ + np.timedelta64(iDays, 'D'))
+    return aI_[aTest], aD_[aTest]
+
+class DateIndex():
+    """ Precomputed integer index of a scene's frame dates, so date filters are
+            integer comparisons.
+        Attributes (all (time,) arrays):
+            dates: datetime64[D], days: days since 1970-01-01, year, month (1-12),
+            doy: day of year (1-366), wyear: water year (Oct 1 start, labeled by start
+            year as edart_utility.testMoistureYear).
+    """
+    def __init__(self, aD_):
+        """ init """
+        self.dates = dates64(aD_)
+        self.days = self.dates.astype(np.int64)
+        self.year = self.dates.astype('M8[Y]').astype(np.int64) + 1970
+        self.month = month64(self.dates)
+        self.doy = (self.dates - self.dates.astype('M8[Y]')).astype(np.int64) + 1
+        self.wyear = self.year - (self.month < 10)
+
+    def __len__(self):
+        return len(self.days)
+
+    def isMonth(self, tMonths_=(8, 9)):
+        """ Return True where month in tMonths_. """
+        return np.isin(self.month, tMonths_)
+
+    def window_pre(self, d_, iDays=548):
+        """ Return (roi, time) True where date within iDays before d_ ((roi,) dates, NaT: none). """
+        aD = dates64(d_).astype(np.int64)[..., None]
+        return (self.days < aD) & (self.days > aD - iDays) & ~np.isnat(dates64(d_))[..., None]
+
+    def window_post(self, d_, iDays=548):
+        """ Return (roi, time) True where date within iDays after d_ ((roi,) dates, NaT: none). """
+        aD = dates64(d_).astype(np.int64)[..., None]
+        return (self.days > aD) & (self.days < aD + iDays) & ~np.isnat(dates64(d_))[..., None]
+
+# ---------------------------------------------------------------------------
+# other filtering
+
+def keep_mask(aM_, aI_=None):
+    """ Return boolean keep array (True: not masked) from DM mask aM_ in the
+            edU.IngestFramesPartial sMask_ forms:
+            raw DM values (any integer dtype, e.g. int16, or uint8/uint16 from ENVI data
+                types 1/12): edU.MaskKeep
+            boolean keep mask (sMask_='bool'): as is
+            None (sMask_='sentinel'): frames of index aI_ (bands on last axis)
+                without edU.MASKSENTINEL values
+        Bit packed masks (sMask_='bits', uint8) must be unpacked first (edU.UnpackMask),
+            passed as is they would be read as raw DM values.
+    """
+    if aM_ is None:
+        if aI_ is None:
+            raise Exception('keep_mask, sentinel masking needs index array aI_.')
+        return ~np.any(aI_ == edU.MASKSENTINEL, axis=-1)
+    aM_ = np.asarray(aM_)
+    if aM_.dtype == bool:
+        return aM_
+    if np.issubdtype(aM_.dtype, np.integer):
+        return edU.MaskKeep(aM_)
+    raise Exception(f'keep_mask, unsupported mask dtype {aM_.dtype} '
+                    '(raw DM, boolean keep mask or None for sentinel).')
+
+def drop_masked(aI_, aM_, aD_):
+    """ Return aI_, aD_ with masked DM values removed.
+        aM_ raw DM, boolean keep mask or None (sentinel), see keep_mask.
+    """
+    aKeep = keep_mask(aM_, aI_)
+    return aI_[aKeep], aD_[aKeep]
+
+def drop_zeros(aI_, aD_, tDropZerosSlice_=None):
+    """ Return aI_, aD_ with all 0 ([0,0,0,0]) frames (axis=1 in aI_) removed.
+        Optional iWidth: do zeros check only over first iWidth columns.
+            (meant to separate z2 columns from raw columns)
+    """
+    if tDropZerosSlice_ is None:
+        iStart, iEnd = 0, aI_.shape[1]
+    else:
+        iStart, iEnd = tDropZerosSlice_
+
+    aKeep = ~np.logical_and(np.ptp(aI_[:, iStart:iEnd], axis=1) == 0,
+                            np.sum(aI_[:, iStart:iEnd], axis=1) == 0)
+    return aI_[aKeep], aD_[aKeep]
+
+# ---------------------------------------------------------------------------
+# pre/post medians
+def median_prepost_roi(aI_, aM_, aD_, d0_, d1_, iSampleMin=5, tDropZerosSlice_=None, iDays=548):
+    """ Return pre/post medians for one ROI: (2, band) medians, details1 (length of
+            August thru September slice), details2 (width of window used in days) and comment.
+        aI_: (time, band) index, aM_: (time,) DM mask (see keep_mask), aD_: (time,) dates.
+        d0_, d1_: t_pre and t_post dates.
+        Up to iSampleMin samples closest to d0_ (before) and d1_ (after) are used,
+            August thru September first.
+        Return None if pre or post time frame is empty.
+    """
+    aI_, aD_ = drop_masked(aI_, aM_, aD_)
+    aI_, aD_ = drop_zeros(aI_, aD_, tDropZerosSlice_)
+    aInd_pre, aD_pre = split_pre(aI_, aD_, d0_, iDays)
+    aInd_post, aD_post = split_post(aI_, aD_, d1_, iDays)
+
+    if aInd_pre.shape[0] == 0 or aInd_post.shape[0] == 0:
+        return None
+
+    aMedians = np.zeros((2, aI_.shape[1]))
+    lDetail1 = [0, 0]
+    lDetail2 = [0, 0]
+    sComment = ''
+    for j, (aInd_m, aD_m) in enumerate([[aInd_pre, aD_pre], [aInd_post, aD_post]]):
+        aSummer = isMonthV(aD_m)
+        lDates = aD_m[aSummer].tolist()[:iSampleMin]
+        lStat = aInd_m[aSummer].tolist()[:iSampleMin]
+        lDetail1[j] = len(lStat)
+
+        if len(lStat) < iSampleMin:
+            lIndNotSummer = aInd_m[~aSummer].tolist()
+            lDatesNotSummer = aD_m[~aSummer].tolist()
+            lDates += lDatesNotSummer[:iSampleMin - len(lStat)]
+            lStat += lIndNotSummer[:iSampleMin - len(lStat)]
+
+        aMedians[j] = np.median(np.array(lStat), axis=0)
+        lDetail2[j] = (max(lDates) - min(lDates)).days
+        if len(lStat) < iSampleMin:
+            sComment = f'Short pre or post time frame: {len(lStat)}'
+
+    return aMedians, lDetail1, lDetail2, sComment
+
+def take_first(aSel_, iN):
+    """ Return aSel_ (roi, time) limited to the first iN True values along time
+            (iN scalar or per roi), and the count kept.
+    """
+    aN = np.broadcast_to(np.asarray(iN), aSel_.shape[:1])
+    aCum = np.cumsum(aSel_, axis=1)
+    aSel_ = aSel_ & (aCum <= aN[:, None])
+    return aSel_, np.minimum(aCum[:, -1], aN)
+
+def median_prepost_batch(a3_I, a2_M, aD_, aD0_, aD1_, iSampleMin=5, tDropZerosSlice_=None,
+                         iDays=548, tMonths_=(8, 9)):
+    """ Vectorized median_prepost_roi over all ROIs.
+        a3_I: (roi, time, band) index, a2_M: (roi, time) DM mask (raw, boolean keep mask
+            or None for sentinel, see keep_mask), aD_: (time,) dates
+            shared by all ROIs (or its DateIndex), aD0_, aD1_: (roi,) t_pre and t_post
+            dates (NaT: empty). Dates are compared as DateIndex integer days.
+        Return dictionary of
+            'Median': (roi, 2, band) pre and post medians (NaN where empty)
+            'Detail1': (roi, 2) length of August thru September slice
+            'Detail2': (roi, 2) width of window used in days
+            'Count': (roi, 2) number of samples used
+            'Empty': (roi,) True where pre or post time frame is empty
+    """
+    iR, iT, iB = a3_I.shape
+    iDate = aD_ if isinstance(aD_, DateIndex) else DateIndex(aD_)
+
+    # drop masked and all zero frames
+    iStart, iEnd = tDropZerosSlice_ or (0, iB)
+    aKeep = keep_mask(a2_M, a3_I) & np.any(a3_I[:, :, iStart:iEnd] != 0, axis=2)
+
+    # pre is ordered closest to t_pre first (reversed time)
+    aPre = (aKeep & iDate.window_pre(aD0_, iDays))[:, ::-1]
+    aPost = aKeep & iDate.window_post(aD1_, iDays)
+    aSummer = iDate.isMonth(tMonths_)
+    aDays = iDate.days
+
+    dicOut = {'Median': np.full((iR, 2, iB), np.nan), 'Detail1': np.zeros((iR, 2), dtype=int),
+              'Detail2': np.zeros((iR, 2), dtype=int), 'Count': np.zeros((iR, 2), dtype=int)}
+    for j, (aWin, tsT) in enumerate([(aPre, slice(None, None, -1)), (aPost, slice(None))]):
+        aSel, aNS = take_first(aWin & aSummer[tsT], iSampleMin)
+        aSelN, aNN = take_first(aWin & ~aSummer[tsT], iSampleMin - aNS)
+        aSel = (aSel | aSelN)[:, tsT]
+        aCount = aNS + aNN
+
+        # gather selected samples (at most iSampleMin) into (roi, sample, band), NaN padded
+        aOrder = np.argsort(~aSel, axis=1, kind='stable')[:, :iSampleMin]
+        a3_S = np.take_along_axis(a3_I, aOrder[:, :, None], axis=1).astype(np.float64)
+        a3_S[np.arange(aOrder.shape[1]) >= aCount[:, None]] = np.nan
+        aHas = aCount > 0
+        dicOut['Median'][aHas, j] = np.nanmedian(a3_S[aHas], axis=1)
+
+        aMax = np.where(aSel, aDays, aDays.min()).max(axis=1)
+        aMin = np.where(aSel, aDays, aDays.max()).min(axis=1)
+        dicOut['Detail1'][:, j] = aNS
+        dicOut['Detail2'][:, j] = np.where(aHas, aMax - aMin, 0)
+        dicOut['Count'][:, j] = aCount
+
+    dicOut['Empty'] = (dicOut['Count'] == 0).any(axis=1)
+    return dicOut
+
+def batch_comment(aCount_, iSampleMin=5):
+    """ Return median_prepost_roi comment from (2,) pre and post sample counts. """
+    for iCount in aCount_[::-1]:
+        if iCount < iSampleMin:
+            return f'Short pre or post time frame: {iCount}'
+    return ''
+
+def BenchmarkPrepost(iROI=2000, iTime=600, iBand=10, iSampleMin=5, iSeed=0):
+    """ Time median_prepost_batch against a median_prepost_roi loop on random data
+            and check results match.
+    """
+    import time
+    rng = np.random.default_rng(iSeed)
+    aD = np.datetime64('2000-01-01') + np.sort(rng.choice(iTime * 16, iTime, replace=False))
+    a3_I = rng.integers(-3, 3, (iROI, iTime, iBand)).astype(np.int16)
+    a2_M = rng.choice(np.array([0, 0, 0, 5, 200], dtype=np.int16), (iROI, iTime))
+    aD0 = aD[0] + rng.integers(0, iTime * 16, iROI)
+    aD1 = aD0 + rng.integers(0, 400, iROI)
+    lDates = aD.astype(object)
+
+    t0 = time.perf_counter()
+    dicB = median_prepost_batch(a3_I, a2_M, aD, aD0, aD1, iSampleMin, (0, iBand // 2))
+    t1 = time.perf_counter()
+    lRes = [median_prepost_roi(a3_I[i], a2_M[i], lDates, aD0[i].astype(object), aD1[i].astype(object),
+                               iSampleMin, (0, iBand // 2)) for i in range(iROI)]
+    t2 = time.perf_counter()
+    print(f'batch: {t1 - t0:.3f}s, per roi: {t2 - t1:.3f}s')
+
+    for i, tRes in enumerate(lRes):
+        if tRes is None:
+            assert dicB['Empty'][i], i
+            continue
+        aMedians, lDetail1, lDetail2, sComment = tRes
+        assert not dicB['Empty'][i], i
+        assert np.array_equal(dicB['Median'][i], aMedians), i
+        assert dicB['Detail1'][i].tolist() == lDetail1, i
+        assert dicB['Detail2'][i].tolist() == lDetail2, i
+        assert batch_comment(dicB['Count'][i], iSampleMin) == sComment, i
+    print('\tresults match')
+
+def BenchmarkDates(iTime=2000, iRep=200, iSeed=0):
+    """ Time datetime64 date filters against the datetime.date versions and check
+            results match.
+    """
+    import time
+    rng = np.random.default_rng(iSeed)
+    aD64 = np.datetime64('1984-01-01') + np.sort(rng.choice(iTime * 8, iTime, replace=False))
+    aD = aD64.astype(object)
+    aI = rng.integers(0, 100, (iTime, 3))
+    iDate = DateIndex(aD64)
+    lD0 = aD64[rng.integers(0, iTime, iRep)]
+
+    t0 = time.perf_counter()
+    for d64 in lD0:
+        d = d64.astype(object)
+        lRes = split_pre(aI, aD, d) + split_post(aI, aD, d) + (isMonthV(aD),)
+    t1 = time.perf_counter()
+    for d64 in lD0:
+        lRes64 = split_pre64(aI, aD64, d64) + split_post64(aI, aD64, d64) + (iDate.isMonth(),)
+    t2 = time.perf_counter()
+    aPre, aPost = iDate.window_pre(lD0), iDate.window_post(lD0)
+    t3 = time.perf_counter()
+    print(f'date: {t1 - t0:.3f}s, datetime64: {t2 - t1:.3f}s, DateIndex batch: {t3 - t2:.4f}s')
+
+    for a, a64 in zip(lRes, lRes64):
+        assert np.array_equal(np.asarray(a, dtype=a64.dtype), a64)
+    for i, d64 in enumerate(lD0):
+        d = d64.astype(object)
+        assert np.array_equal(aPre[i], (aD < d) & (aD > d - datetime.timedelta(548)))
+        assert np.array_equal(aPost[i], (aD > d) & (aD < d + datetime.timedelta(548)))
+    assert np.array_equal(iDate.doy, [d.timetuple().tm_yday for d in aD])
+    assert np.array_equal(iDate.wyear, [d.year - (d.month < 10) for d in aD])
+    assert np.array_equal(parse_dates64([d.isoformat().replace('-', '.') for d in aD]), aD64)
+    print('\tresults match')
@@ -1,108 +1,410 @@
-"""
----------------------------------------------------------------------------
-combine.py
- Kirk D Evans 07/2018 kdevans@fs.fed.us
-    TetraTech EC for:
-    USDA Forest Service
-    Region 5 Remote Sensing Lab
-    
- script to: function NumpyCombine implementing Spatial Analyst Combine.
-
- known limitations: python 3.x (sort of)
----------------------------------------------------------------------------
-"""
-import traceback
-import time
-import sys
-import os
-import numpy as np
-import arcpy
-import py3_general.generalARC as gArc
-import raster.rasterARCUtility as rastArcU
-
-def uniqueDict(*a):
-    ''' '''
-    setABC = set(zip(*a))
-    dLU = {t:i+1 for i, t in enumerate(setABC)}
-    del setABC
-    return dLU
-
-def RemoveNoDataKeys(d, NoDataVal):
-    ''' Return d with all keys containing NoDataVal removed. '''
-    return {k:v for k, v in d.items() if NoDataVal not in k}
-
-def AlterNoDataKeys(d, NoDataVal):
-    ''' Return d with all keys containing NoDataVal altered to the NoData value.
-        This version (compared to RemoveNoDataKeys) doesn't require the use
-        of dict.get method (in WriteLU2)
-    '''
-    return {k:d.get(k, NoDataVal) for k in d.keys()}
-    
-def WriteLU(dLU, *a):
-    ''' '''
-    return np.array([dLU[T] for T in zip(*a)])
-
-def WriteLU2(dLU, NoData, *a):
-    ''' '''
-    return np.array([dLU.get(T, NoData) for T in zip(*a)])
-
-def NumpyCombine(lstRastersIn, strPathOut, NoDataVal = None):
-    ''' Numpy based implementation of Spatial Analyst Combine.
-        Limitations: all inputs must match in projection, extent and cell size.
-        Function is 2-3 time slower when run in python 2.x
-    '''
-    # Get description for later writing
-    iDesc = gArc.getSimpleDesc(lstRastersIn[0])
-    intLength = iDesc.width * iDesc.height
-    npType = np.uint16
-
-    print('KirkCombine message: Ingest to 1D...')
-    t0 = time.time()
-    lstArr = [arcpy.RasterToNumPyArray(strR, nodata_to_value = 0).reshape((1,intLength))[0,:] for strR in lstRastersIn]
-    print('\t' + str(time.time() - t0))
-
-    print('KirkCombine message: UniqueVals 2 dictionary...')
-    t1 = time.time()
-    dicLU = uniqueDict(*lstArr)
-    dicLUc = RemoveNoDataKeys(dicLU, NoDataVal)
-    print('\t' + str(time.time() - t1))
-
-    # set bit depth based on number of values in dictionary
-    #print(len(dicLUc))
-    if len(dicLUc) < 255:
-        npType = np.uint8
-    elif len(dicLUc) < 65534:
-        npType = np.uint16
-    else:
-        npType = np.int32
-
-    print(npType)
-    
-    print('KirkCombine message: Lookup2...')
-    t2 = time.time()
-    arrC2c = WriteLU2(dicLUc, NoDataVal, *lstArr)
-    print('\t' + str(time.time() - t2))
-    
-    arrC_2D = arrC2c.reshape(iDesc.shape).astype(npType)
-
-    print('KirkCombine message: ArrayToRaster...')
-    #print('Save...')
-    t3 = time.time()
-    rastArcU.ArrayToRaster(arrC_2D, strPathOut, iDesc, NoDataVal)
-
-    del arrC_2D, arrC2c, lstArr
-    #return strPathOut
-    
-
-if __name__ == '__main__':
-    # testing
-    arcpy.env.workspace = r'B:\LiDAR\temp\combine\py2'
-    strPathOut = 'combine_4band_int32_dat.tif'
-    #strPathOut = r'N:\project\fastemap\DrastTile\Intermediate\testus.tif'
-
-    strInPath = r'B:\LiDAR\temp\combine\KirkComInput'
-    
-    lstIn = [strInPath + os.sep + 'Combin' + str (i)+ '.tif' for i in range(4)]
-    t = time.time()
-    #NumpyCombine(lstIn, strPathOut, 0)
-    print('Done.\n\t' + str(time.time() - t))
+"""
+---------------------------------------------------------------------------
+combine.py
+ Kirk D Evans 07/2018 kdevans@fs.fed.us
+    TetraTech EC for:
+    USDA Forest Service
+    Region 5 Remote Sensing Lab
+    
+ script to: function NumpyCombine implementing Spatial Analyst Combine.
+
+ known limitations: python 3.x (sort of)
+---------------------------------------------------------------------------
+"""
+import traceback
+import time
+import sys
+import os
+import shutil
+import multiprocessing
+import numpy as np
+try:
+    import arcpy
+except ImportError:
+    # gdal backend, see raster.rasterIO
+    arcpy = None
+import raster.rasterARCUtility as rastArcU
+import raster.rasterIO as rastIO
+
+def uniqueDict(*a):
+    ''' '''
+    setABC = set(zip(*a))
+    dLU = {t:i+1 for i, t in enumerate(setABC)}
+    del setABC
+    return dLU
+
+def RemoveNoDataKeys(d, NoDataVal):
+    ''' Return d with all keys containing NoDataVal removed. '''
+    return {k:v for k, v in d.items() if NoDataVal not in k}
+
+def AlterNoDataKeys(d, NoDataVal):
+    ''' Return d with all keys containing NoDataVal altered to the NoData value.
+        This version (compared to RemoveNoDataKeys) doesn't require the use
+        of dict.get method (in WriteLU2)
+    '''
+    return {k:d.get(k, NoDataVal) for k in d.keys()}
+    
+def WriteLU(dLU, *a):
+    ''' '''
+    return np.array([dLU[T] for T in zip(*a)])
+
+def WriteLU2(dLU, NoData, *a):
+    ''' '''
+    return np.array([dLU.get(T, NoData) for T in zip(*a)])
+
+def CombineDtype(intCount):
+    """ Return numpy dtype for intCount combine IDs (bit depth based on number of combinations). """
+    if intCount < 255:
+        return np.uint8
+    elif intCount < 65534:
+        return np.uint16
+    return np.int32
+
+def PackKeys(*a):
+    """ Return 1D int64 array of one key per element, packing the values of all arrays in a.
+        Each array is reduced to codes 0..n-1 (np.unique inverse) and codes are combined
+            mixed radix, so key order follows value tuple order.
+        When the packed key would overflow int64, the partial key is itself reduced
+            to codes first.
+    """
+    arrKey = None
+    intCard = 1
+    for arr in a:
+        arrVals, arrCodes = np.unique(arr, return_inverse=True)
+        arrCodes = arrCodes.reshape(-1).astype(np.int64)
+        if arrKey is None:
+            arrKey, intCard = arrCodes, len(arrVals)
+            continue
+        if intCard * len(arrVals) >= 2**62:
+            arrKeyVals, arrKey = np.unique(arrKey, return_inverse=True)
+            arrKey = arrKey.reshape(-1).astype(np.int64)
+            intCard = len(arrKeyVals)
+        arrKey = arrKey * len(arrVals) + arrCodes
+        intCard *= len(arrVals)
+    return arrKey
+
+def NoDataMask(NoDataVal, *a):
+    """ Return 1D boolean array, True where no array in a equals NoDataVal. """
+    arrValid = np.ones(a[0].size, dtype=bool)
+    if NoDataVal is None:
+        return arrValid
+    for arr in a:
+        arrValid &= (arr.reshape(-1) != NoDataVal)
+    return arrValid
+
+def VectorCombine(NoDataVal, *a):
+    """ Vectorized alternative to uniqueDict/RemoveNoDataKeys/WriteLU2.
+        Return 1D combine ID array, 2D (combination, input) array of value combinations
+            and 1D array of pixel counts per combination.
+        IDs run 1..n in value tuple order; pixels with any input equal to NoDataVal
+            are excluded from the combinations and set to NoDataVal.
+    """
+    arrValid = NoDataMask(NoDataVal, *a)
+    lstValid = [arr.reshape(-1)[arrValid] for arr in a]
+
+    arrKey = PackKeys(*lstValid)
+    arrKeyU, arrFirst, arrInv = np.unique(arrKey, return_index=True, return_inverse=True)
+    del arrKey
+    arrCombos = np.stack([arr[arrFirst] for arr in lstValid], axis=1)
+
+    arrOut = np.full(arrValid.shape, 0 if NoDataVal is None else NoDataVal, dtype=np.int64)
+    arrInv = arrInv.reshape(-1)
+    arrCounts = np.bincount(arrInv, minlength=len(arrFirst))
+    arrOut[arrValid] = arrInv + 1
+    del lstValid, arrInv
+    return arrOut, arrCombos, arrCounts
+
+class CombineTable():
+    """ Combine attribute table: value combination (row i is ID i + 1) and pixel count. """
+    def __init__(self, intInputs, npType=np.int64, arrCombos=None, arrCounts=None):
+        """ init """
+        self.combos = np.empty((0, intInputs), dtype=npType)
+        self.counts = np.empty(0, dtype=np.int64)
+        if arrCombos is not None:
+            self.combos = arrCombos
+            self.counts = np.zeros(len(arrCombos), dtype=np.int64)
+        if arrCounts is not None:
+            self.counts = arrCounts.astype(np.int64)
+
+    def __len__(self):
+        """ Number of combinations in table. """
+        return self.combos.shape[0]
+
+    def records(self, lstNames):
+        """ Return table as numpy structured array with fields VALUE, COUNT and lstNames. """
+        lstDtype = ([('VALUE', np.int32), ('COUNT', np.int64)] +
+                    [(strN, self.combos.dtype) for strN in lstNames])
+        arrRec = np.zeros(len(self), dtype=lstDtype)
+        arrRec['VALUE'] = np.arange(1, len(self) + 1)
+        arrRec['COUNT'] = self.counts
+        for i, strN in enumerate(lstNames):
+            arrRec[strN] = self.combos[:, i]
+        return arrRec
+
+    def save(self, strPathTable, lstNames):
+        """ Save table to strPathTable, format by extension:
+                .csv, .parquet (requires pandas) or .dbf (e.g. sidecar out.tif.vat.dbf, via arcpy).
+            lstNames: field names of inputs.
+        """
+        arrRec = self.records(lstNames)
+        strExt = os.path.splitext(strPathTable)[1].lower()
+        if strExt == '.csv':
+            np.savetxt(strPathTable, arrRec, fmt='%d', delimiter=',',
+                       header=','.join(arrRec.dtype.names), comments='')
+        elif strExt == '.parquet':
+            import pandas as pd
+            pd.DataFrame(arrRec).to_parquet(strPathTable, index=False)
+        elif strExt == '.dbf':
+            if arcpy is None:
+                raise Exception('CombineTable.save, .dbf tables require arcpy, use .csv or .parquet.')
+            arcpy.da.NumPyArrayToTable(arrRec, strPathTable)
+        else:
+            raise Exception('CombineTable.save, unsupported table format: ' + strExt)
+        return strPathTable
+
+def CombineFieldNames(lstRastersIn):
+    """ Return combine table field names (upper case raster names) for lstRastersIn. """
+    return [os.path.splitext(os.path.basename(strR))[0].upper() for strR in lstRastersIn]
+
+def NumpyCombineTiled(lstRastersIn, strPathOut, NoDataVal = None, intBlockSize = 4096,
+                      strPathTable = None):
+    """ Block-wise NumpyCombine for rasters larger than memory.
+        Sequential NumpyCombineParallel: pass 1 combines each intBlockSize x intBlockSize
+            block (local IDs saved to scratch), local combinations are merged once
+            (MergeCombos, value tuple order) and pass 2 remaps blocks to global IDs,
+            so IDs match NumpyCombine and do not depend on intBlockSize.
+        Blocks are mosaicked to strPathOut once the final number of combinations
+            (and so bit depth) is known.
+        Peak memory is bounded by block size and number of unique combinations.
+        Return CombineTable, optionally saved to strPathTable (see CombineTable.save).
+    """
+    iDesc = rastIO.getSimpleDesc(lstRastersIn[0])
+    strPathScratch = rastIO.ScratchFolder('combine_')
+    lstBlocks = list(rastArcU.IterBlocks(iDesc, intBlockSize))
+    lstNpy = [strPathScratch + os.sep + f'block_{i}.npy' for i in range(len(lstBlocks))]
+
+    print(f'KirkCombine message: Tiled combine, {len(lstBlocks)} blocks...')
+    t0 = time.time()
+    lstCombos, lstCounts = [], []
+    for i, (tupB, strNpy) in enumerate(zip(lstBlocks, lstNpy)):
+        arrCombos, arrCounts = _CombineBlockLocal((lstRastersIn, tupB, NoDataVal, strNpy))
+        lstCombos.append(arrCombos)
+        lstCounts.append(arrCounts)
+        print(f'\tBlock {i}: {len(arrCombos)} local combinations')
+    print('\t' + str(time.time() - t0))
+
+    print('KirkCombine message: Merge combinations...')
+    t1 = time.time()
+    iTable, lstIDs = MergeCombos(lstCombos, lstCounts)
+    del lstCombos, lstCounts
+    npType = CombineDtype(len(iTable))
+    print(f'\t{len(iTable)} combinations, {npType}')
+    print('\t' + str(time.time() - t1))
+
+    print('KirkCombine message: Remap blocks...')
+    t2 = time.time()
+    lstBlocksOut = [_CombineBlockRemap((lstRastersIn[0], tupB, strNpy, arrIDs, NoDataVal, npType,
+                                        strNpy[:-4] + '.tif'))
+                    for tupB, strNpy, arrIDs in zip(lstBlocks, lstNpy, lstIDs)]
+    print('\t' + str(time.time() - t2))
+
+    print('KirkCombine message: Mosaic blocks...')
+    t3 = time.time()
+    rastIO.MosaicBlocks(lstBlocksOut, strPathOut, iDesc, npType, NoDataVal)
+    shutil.rmtree(strPathScratch)
+    print('\t' + str(time.time() - t3))
+
+    if strPathTable:
+        iTable.save(strPathTable, CombineFieldNames(lstRastersIn))
+    return iTable
+
+# ---------------------------------------------------------------------------
+# parallel combine, functions for pool
+def MergeCombos(lstCombos, lstCounts):
+    """ Return global CombineTable (value tuple order) and, for each array of
+            local combinations in lstCombos, the array of matching global IDs.
+        lstCounts: local pixel counts, summed into table counts.
+        Result is independent of how pixels were split among lstCombos.
+    """
+    arrAll = np.concatenate(lstCombos)
+    arrKey = PackKeys(*arrAll.T)
+    arrKeyU, arrFirst, arrInv = np.unique(arrKey, return_index=True, return_inverse=True)
+    arrInv = arrInv.reshape(-1)
+    arrCounts = np.bincount(arrInv, weights=np.concatenate(lstCounts), minlength=len(arrFirst))
+    lstIDs = np.split(arrInv + 1, np.cumsum([len(c) for c in lstCombos])[:-1])
+    iTable = CombineTable(arrAll.shape[1], arrCombos=arrAll[arrFirst], arrCounts=arrCounts)
+    return iTable, lstIDs
+
+def CombineLocal(NoDataVal, *a):
+    """ Return local IDs (VectorCombine, 0 for NoData pixels), combinations and counts
+            of one block of inputs a, for MergeCombos and RemapIDs.
+    """
+    arrC, arrCombos, arrCounts = VectorCombine(NoDataVal, *a)
+    arrC[~NoDataMask(NoDataVal, *a)] = 0
+    return arrC, arrCombos, arrCounts
+
+def RemapIDs(arrLocal, arrIDs, NoDataVal=None):
+    """ Return global IDs of local IDs arrLocal (CombineLocal), given arrIDs, the global
+            ID of each local combination (MergeCombos). NoData pixels are set to NoDataVal.
+    """
+    intND = 0 if NoDataVal is None else NoDataVal
+    return np.concatenate(([intND], arrIDs))[arrLocal]
+
+def _CombineBlockLocal(tupArgs):
+    """ Pool worker, pass 1: combine one block, save local IDs (0 for NoData) to strPathNpy
+            and return local combinations and counts.
+    """
+    lstRastersIn, tupBlock, NoDataVal, strPathNpy = tupArgs
+    iDescB = rastArcU.BlockDesc(rastIO.getSimpleDesc(lstRastersIn[0]), *tupBlock)
+    lstArr = [rastIO.RasterToNumPyBlock(strR, iDescB, nodata_to_value = 0).reshape(-1)
+              for strR in lstRastersIn]
+    arrC, arrCombos, arrCounts = CombineLocal(NoDataVal, *lstArr)
+    np.save(strPathNpy, arrC.reshape(iDescB.shape).astype(np.int32))
+    return arrCombos, arrCounts
+
+def _CombineBlockRemap(tupArgs):
+    """ Pool worker, pass 2: remap local IDs saved in strPathNpy to global IDs
+            (RemapIDs) and save block raster.
+    """
+    strPathRast0, tupBlock, strPathNpy, arrIDs, NoDataVal, npType, strBlockOut = tupArgs
+    iDescB = rastArcU.BlockDesc(rastIO.getSimpleDesc(strPathRast0), *tupBlock)
+    arrC = RemapIDs(np.load(strPathNpy), arrIDs, NoDataVal).astype(npType)
+    rastIO.ArrayToRaster(arrC, strBlockOut, iDescB, NoDataVal, bolVerbose = False, **rastIO.ScratchOptions())
+    os.remove(strPathNpy)
+    return strBlockOut
+
+def NumpyCombineParallel(lstRastersIn, strPathOut, NoDataVal = None, intBlockSize = 4096,
+                         intWorkers = None, strPathTable = None):
+    """ Multi-process NumpyCombine.
+        Pass 1: blocks are combined in a pool of intWorkers (default cpu count), each
+            returning its local combinations.
+        Merge: local combinations are merged to one table in value tuple order, so
+            IDs match NumpyCombine and do not depend on intWorkers or intBlockSize.
+        Pass 2: blocks are remapped to global IDs in the pool and mosaicked to strPathOut.
+        Return CombineTable, optionally saved to strPathTable (see CombineTable.save).
+    """
+    iDesc = rastIO.getSimpleDesc(lstRastersIn[0])
+    strPathScratch = rastIO.ScratchFolder('combine_')
+    lstBlocks = list(rastArcU.IterBlocks(iDesc, intBlockSize))
+    lstNpy = [strPathScratch + os.sep + f'block_{i}.npy' for i in range(len(lstBlocks))]
+
+    with multiprocessing.Pool(intWorkers) as pool:
+        print(f'KirkCombine message: Parallel combine, {len(lstBlocks)} blocks...')
+        t0 = time.time()
+        lstArgs = [(lstRastersIn, tupB, NoDataVal, strNpy) for tupB, strNpy in zip(lstBlocks, lstNpy)]
+        lstCombos, lstCounts = zip(*pool.map(_CombineBlockLocal, lstArgs))
+        print('\t' + str(time.time() - t0))
+
+        print('KirkCombine message: Merge combinations...')
+        t1 = time.time()
+        iTable, lstIDs = MergeCombos(lstCombos, lstCounts)
+        npType = CombineDtype(len(iTable))
+        print(f'\t{len(iTable)} combinations, {npType}')
+        print('\t' + str(time.time() - t1))
+
+        print('KirkCombine message: Remap blocks...')
+        t2 = time.time()
+        lstArgs = [(lstRastersIn[0], tupB, strNpy, arrIDs, NoDataVal, npType, strNpy[:-4] + '.tif')
+                   for tupB, strNpy, arrIDs in zip(lstBlocks, lstNpy, lstIDs)]
+        lstBlocksOut = pool.map(_CombineBlockRemap, lstArgs)
+        print('\t' + str(time.time() - t2))
+
+    print('KirkCombine message: Mosaic blocks...')
+    t3 = time.time()
+    rastIO.MosaicBlocks(lstBlocksOut, strPathOut, iDesc, npType, NoDataVal)
+    shutil.rmtree(strPathScratch)
+    print('\t' + str(time.time() - t3))
+
+    if strPathTable:
+        iTable.save(strPathTable, CombineFieldNames(lstRastersIn))
+    return iTable
+
+def NumpyCombine(lstRastersIn, strPathOut, NoDataVal = None, intBlockSize = None, intWorkers = None,
+                 strPathTable = None):
+    ''' Numpy based implementation of Spatial Analyst Combine.
+        Limitations: all inputs must match in projection, extent and cell size.
+        Function is 2-3 time slower when run in python 2.x
+        Optional intBlockSize: run block-wise, see NumpyCombineTiled.
+        Optional intWorkers: run block-wise in a process pool, see NumpyCombineParallel.
+        Return CombineTable (combinations and pixel counts), optionally saved
+            to strPathTable (see CombineTable.save).
+    '''
+    if intWorkers:
+        return NumpyCombineParallel(lstRastersIn, strPathOut, NoDataVal, intBlockSize or 4096,
+                                    intWorkers, strPathTable)
+
+    if intBlockSize:
+        return NumpyCombineTiled(lstRastersIn, strPathOut, NoDataVal, intBlockSize, strPathTable)
+
+    # Get description for later writing
+    iDesc = rastIO.getSimpleDesc(lstRastersIn[0])
+    intLength = iDesc.width * iDesc.height
+
+    print('KirkCombine message: Ingest to 1D...')
+    t0 = time.time()
+    lstArr = [rastIO.RasterToNumPyArray(strR, nodata_to_value = 0).reshape((1,intLength))[0,:] for strR in lstRastersIn]
+    print('\t' + str(time.time() - t0))
+
+    print('KirkCombine message: Vector combine...')
+    t1 = time.time()
+    arrC, arrCombos, arrCounts = VectorCombine(NoDataVal, *lstArr)
+    iTable = CombineTable(len(lstArr), arrCombos=arrCombos, arrCounts=arrCounts)
+    print('\t' + str(time.time() - t1))
+
+    # set bit depth based on number of combinations
+    npType = CombineDtype(len(iTable))
+    print(npType)
+
+    arrC_2D = arrC.reshape(iDesc.shape).astype(npType)
+
+    print('KirkCombine message: ArrayToRaster...')
+    #print('Save...')
+    t3 = time.time()
+    rastIO.ArrayToRaster(arrC_2D, strPathOut, iDesc, NoDataVal)
+
+    del arrC_2D, arrC, lstArr
+
+    if strPathTable:
+        iTable.save(strPathTable, CombineFieldNames(lstRastersIn))
+    return iTable
+
+def BenchmarkCombine(tupShape=(2000, 2000), intInputs=4, intValues=20, NoDataVal=0, intSeed=0):
+    """ Time dictionary (uniqueDict/WriteLU2) combine against VectorCombine on random arrays.
+        Check both give the same zones and NoData pixels (IDs themselves may differ).
+    """
+    rng = np.random.default_rng(intSeed)
+    lstArr = [rng.integers(0, intValues, tupShape).reshape(-1) for i in range(intInputs)]
+    print(f'BenchmarkCombine: {intInputs} inputs, shape {tupShape}, {intValues} values')
+
+    t0 = time.time()
+    dicLUc = RemoveNoDataKeys(uniqueDict(*lstArr), NoDataVal)
+    arrDict = WriteLU2(dicLUc, NoDataVal, *lstArr)
+    fltDict = time.time() - t0
+    print(f'\tuniqueDict + WriteLU2: {fltDict:.2f}s')
+
+    t1 = time.time()
+    arrVec, arrCombos, arrCounts = VectorCombine(NoDataVal, *lstArr)
+    fltVec = time.time() - t1
+    print(f'\tVectorCombine:         {fltVec:.2f}s ({fltDict / fltVec:.1f}x)')
+
+    arrValid = arrVec != NoDataVal
+    bolMatch = (np.array_equal(arrValid, arrDict != NoDataVal) and
+                len(dicLUc) == arrCombos.shape[0] and
+                np.unique(np.stack((arrDict[arrValid], arrVec[arrValid])), axis=1).shape[1] == len(dicLUc))
+    print(f'\tMatch: {bolMatch}')
+    return fltDict, fltVec
+
+if __name__ == '__main__':
+    # testing
+    arcpy.env.workspace = r'B:\LiDAR\temp\combine\py2'
+    strPathOut = 'combine_4band_int32_dat.tif'
+    #strPathOut = r'N:\project\fastemap\DrastTile\Intermediate\testus.tif'
+
+    strInPath = r'B:\LiDAR\temp\combine\KirkComInput'
+    
+    lstIn = [strInPath + os.sep + 'Combin' + str (i)+ '.tif' for i in range(4)]
+    t = time.time()
+    #NumpyCombine(lstIn, strPathOut, 0)
+    print('Done.\n\t' + str(time.time() - t))
+
+    #BenchmarkCombine((5000, 5000), 4, 20, 0)
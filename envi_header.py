@@ -1,104 +1,162 @@
-""" 
-----------------------------------------------------------------------------------------
- envi_header.py
- 06/2018
- 
- Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
-   3237 Peacekeeper Way, Suite 201
-   McClellan, CA 95652
-   kdevans@fs.fed.us
-
- script to: class HDR to support use of ENVI raster ().bsq header files.
-
- Known limitations: python 3
-----------------------------------------------------------------------------------------
-"""
-import os
-
-class HDR():
-    """ Class to ingest and store all items in ENVI raster header file.
-        Tested ONLY on bsq rasters saved by MATLAB!
-    """
-    def __init__(self, strPathRast):
-        """ Initialize HDR class """
-        self.raster = strPathRast
-        self.header_file = os.path.splitext(strPathRast)[0] + '.hdr'
-
-        self._ingestHDR()
-        self._cleanHDR()
-
-        # set attributes with dictionary
-        self.__dict__.update(self.dicAttr)
-        lstMapInfo = [v.strip() for v in self.map_info.split(',')]
-        self.XMin = float(lstMapInfo[3])
-        self.YMax = float(lstMapInfo[4])
-        
-        self.CellSizeX = float(lstMapInfo[5])
-        self.CellSizeY = float(lstMapInfo[6])
-        if self.CellSizeX == self.CellSizeY:
-            self.CellSize = self.CellSizeX
-
-        if 'lines' in self.__dict__:
-            self.lines = int(self.lines)
-            self.YMin = self.YMax - self.CellSizeY * self.lines
-
-        if 'samples' in self.__dict__:
-            self.samples= int(self.samples)
-            self.XMax = self.XMin + self.CellSizeX * self.samples
-
-    def _ingestHDR(self):
-        """ Ingest header file to dictionary """
-        dicHDR = {}
-        with open(self.header_file) as hdr:
-            bolMulti = False
-            for line in hdr.readlines():
-                line = line.strip()
-                if ' = {' in line:
-                    bolMulti = True
-                    bolMultiStart = True
-
-                if not bolMulti:
-                    try:
-                        item, value = line.split(' = ')
-                    except ValueError:
-                        continue
-                    dicHDR[item] = value
-
-                else:
-                    if bolMultiStart:
-                        item, value = line.split(' = ')
-                        item = item.strip()
-                        value = value.lstrip('{').rstrip('}').rstrip(',').strip()
-
-                        dicHDR[item] = [value]
-                        bolMultiStart = False
-                    else:
-                        value = line.rstrip(',').rstrip('}')
-                        dicHDR[item].append(value)
-
-                if line[-1] == '}':
-                    bolMulti = False
-
-        self.dicAttr = dicHDR
-
-    def _cleanHDR(self):
-        """ In situ clean spaces from attribute names (keys) and reduce single item lists. """
-        for k in self.dicAttr:
-            val = self.dicAttr[k]
-            if type(val) == list and len(val) == 1:
-                self.dicAttr[k] = val[0]
-                
-            if ' ' in k:
-                kNew = k.replace(' ', '_')
-                self.dicAttr[kNew] = self.dicAttr[k]
-                del self.dicAttr[k]
-                
-    def bandName_wild(self, strWild):
-        """ Return band name containing strWild. """
-        lstIndex = [b for b in self.band_names if strWild in b]
-        if len(lstIndex) == 0:
-            raise Exception(strWild + 'not found in band_names.')
-        elif len(lstIndex) > 1:
-            raise Exception(strWild + 'not unique in band_names.')
-        return lstIndex[0]
-    
+""" 
+----------------------------------------------------------------------------------------
+ envi_header.py
+ 06/2018
+ 
+ Kirk Evans, GIS Analyst/Programmer, TetraTech EC @ USDA Forest Service R5/Remote Sensing Lab
+   3237 Peacekeeper Way, Suite 201
+   McClellan, CA 95652
+   kdevans@fs.fed.us
+
+ script to: class HDR to support use of ENVI raster ().bsq header files.
+    HDR.memmap/HDR.band: zero copy numpy access to the raster itself.
+
+ Known limitations: python 3
+----------------------------------------------------------------------------------------
+"""
+import os
+import numpy as np
+
+# ENVI header data type code to numpy dtype
+dicENVIDTYPE = {1: np.uint8, 2: np.int16, 3: np.int32, 4: np.float32, 5: np.float64,
+                6: np.complex64, 9: np.complex128, 12: np.uint16, 13: np.uint32,
+                14: np.int64, 15: np.uint64}
+
+class HDR():
+    """ Class to ingest and store all items in ENVI raster header file.
+        Tested ONLY on bsq rasters saved by MATLAB!
+    """
+    def __init__(self, strPathRast):
+        """ Initialize HDR class """
+        self.raster = strPathRast
+        self.header_file = os.path.splitext(strPathRast)[0] + '.hdr'
+
+        self._ingestHDR()
+        self._cleanHDR()
+
+        # set attributes with dictionary
+        self.__dict__.update(self.dicAttr)
+        lstMapInfo = [v.strip() for v in self.map_info.split(',')]
+        self.XMin = float(lstMapInfo[3])
+        self.YMax = float(lstMapInfo[4])
+        
+        self.CellSizeX = float(lstMapInfo[5])
+        self.CellSizeY = float(lstMapInfo[6])
+        if self.CellSizeX == self.CellSizeY:
+            self.CellSize = self.CellSizeX
+
+        if 'lines' in self.__dict__:
+            self.lines = int(self.lines)
+            self.YMin = self.YMax - self.CellSizeY * self.lines
+
+        if 'samples' in self.__dict__:
+            self.samples= int(self.samples)
+            self.XMax = self.XMin + self.CellSizeX * self.samples
+
+        self._mm = None
+
+    def _ingestHDR(self):
+        """ Ingest header file to dictionary """
+        dicHDR = {}
+        with open(self.header_file) as hdr:
+            bolMulti = False
+            for line in hdr.readlines():
+                line = line.strip()
+                if ' = {' in line:
+                    bolMulti = True
+                    bolMultiStart = True
+
+                if not bolMulti:
+                    try:
+                        item, value = line.split(' = ')
+                    except ValueError:
+                        continue
+                    dicHDR[item] = value
+
+                else:
+                    if bolMultiStart:
+                        item, value = line.split(' = ')
+                        item = item.strip()
+                        value = value.lstrip('{').rstrip('}').rstrip(',').strip()
+
+                        dicHDR[item] = [value]
+                        bolMultiStart = False
+                    else:
+                        value = line.rstrip(',').rstrip('}')
+                        dicHDR[item].append(value)
+
+                if line[-1] == '}':
+                    bolMulti = False
+
+        self.dicAttr = dicHDR
+
+    def _cleanHDR(self):
+        """ In situ clean spaces from attribute names (keys) and reduce single item lists. """
+        for k in list(self.dicAttr):
+            val = self.dicAttr[k]
+            if type(val) == list and len(val) == 1:
+                self.dicAttr[k] = val[0]
+                
+            if ' ' in k:
+                kNew = k.replace(' ', '_')
+                self.dicAttr[kNew] = self.dicAttr[k]
+                del self.dicAttr[k]
+                
+    def bandNames(self):
+        """ Return list of band names (single band headers store a string). """
+        if isinstance(self.band_names, str):
+            return [self.band_names]
+        # drop empty first item of "band names = {" followed by line break
+        return [b.strip() for b in self.band_names if b.strip()]
+
+    def bandName_wild(self, strWild):
+        """ Return band name containing strWild. """
+        lstIndex = [b for b in self.bandNames() if strWild in b]
+        if len(lstIndex) == 0:
+            raise Exception(strWild + 'not found in band_names.')
+        elif len(lstIndex) > 1:
+            raise Exception(strWild + 'not unique in band_names.')
+        return lstIndex[0]
+    
+
+    def dtype(self):
+        """ Return numpy dtype of raster, with byte order. """
+        npType = np.dtype(dicENVIDTYPE[int(self.data_type)])
+        if int(getattr(self, 'byte_order', 0)) == 1:
+            return npType.newbyteorder('>')
+        return npType.newbyteorder('<')
+
+    def memmap(self):
+        """ Return read only np.memmap of raster, shape (bands, lines, samples).
+            No data is read until used. bil and bip interleaves are returned as
+                (bands, lines, samples) views of the file order.
+        """
+        if self._mm is not None:
+            return self._mm
+
+        intBands = int(getattr(self, 'bands', 1))
+        intOffset = int(getattr(self, 'header_offset', 0))
+        strInterleave = getattr(self, 'interleave', 'bsq').lower()
+        dicShape = {'bsq': (intBands, self.lines, self.samples),
+                    'bil': (self.lines, intBands, self.samples),
+                    'bip': (self.lines, self.samples, intBands)}
+        dicAxes = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (2, 0, 1)}
+        if strInterleave not in dicShape:
+            raise Exception(f'HDR.memmap, unknown interleave {strInterleave}.')
+
+        mm = np.memmap(self.raster, dtype=self.dtype(), mode='r', offset=intOffset,
+                       shape=dicShape[strInterleave])
+        self._mm = mm.transpose(dicAxes[strInterleave])
+        return self._mm
+
+    def bandIndex(self, band):
+        """ Return 0 based band index given band name, band index (int) passes through. """
+        if isinstance(band, str):
+            return self.bandNames().index(band)
+        return band
+
+    def band(self, band):
+        """ Return (lines, samples) memmap view of single band, given band name or 0 based index.
+            For bsq only that band's bytes are read from disk when the view is used.
+        """
+        return self.memmap()[self.bandIndex(band), :, :]
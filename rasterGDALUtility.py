@@ -1,56 +1,424 @@
-"""
----------------------------------------------------------------------------
-rasterGDALUtility.py
-Kirk D Evans 07/2018 kdevans@fs.fed.us
-    TetraTech EC for:
-    USDA Forest Service
-    Region 5 Remote Sensing Lab
-
-Raster functions related to GDAL.
-    Mostly alternatives to for bugs in arcpy.NumpyArrayToRaster.
-    Projection definitions mostly still in arcpy.
-
-Known limitations: python 3
----------------------------------------------------------------------------
-"""
-import os
-import gdal
-import arcpy
-
-def ClipRaster(strPathIn, strPathOut, strBND, strComment):
-    """ Clip raster.
-        NOT YET WRITTEN
-    """
-    pass
-
-def ArrayToRasterGDAL(arr, strPathRast, iDesc, strGDALdriver, strGDType):
-    """ Save numpy array arr to raster strPathRast
-        Return strPathRast.
-    """
-    if os.path.exists(strPathRast):
-        raise Exception(f'ArrayToRasterGDAL, {strPathRast} already exists.')
-            
-    tupShape = arr.shape
-    if len(tupShape) == 2:
-        rows, cols = tupShape
-        bands = 1
-        arr = np.stack((arr,))
-    elif len(tupShape) == 3:
-        bands, rows, cols = tupShape
-
-    pixelWidth, pixelHeight, originX, originY = iDesc.GDALdescribe
-
-    driver = gdal.GetDriverByName(strGDALdriver)
-    
-    outRaster = driver.Create(strPathRast, cols, rows, bands, strGDType)
-    # check below logic. Where is GDAL origin?
-    outRaster.SetGeoTransform((originX, pixelWidth, 0, originY, 0, pixelHeight))
-
-    # write bands
-    for b in range(1, bands + 1):
-        outband = outRaster.GetRasterBand(b)
-        outband.WriteArray(arr[b,:,:])
-        outband.FlushCache()
-
-    if iDesc.sr:
-        arcpy.DefineProjection_management(strPathRast, iDesc.sr)
+"""
+---------------------------------------------------------------------------
+rasterGDALUtility.py
+Kirk D Evans 07/2018 kdevans@fs.fed.us
+    TetraTech EC for:
+    USDA Forest Service
+    Region 5 Remote Sensing Lab
+
+Raster functions related to GDAL.
+    Mostly alternatives to for bugs in arcpy.NumpyArrayToRaster.
+    GDAL implementation of raster I/O used by rasterIO (no arcpy required).
+
+Known limitations: python 3
+---------------------------------------------------------------------------
+"""
+import os
+import re
+import collections
+import numpy as np
+from osgeo import gdal, osr
+import raster.rasterARCUtility as rastArcU
+
+gdal.UseExceptions()
+
+# stand in for arcpy.Point in SimpleDesc
+Point = collections.namedtuple('Point', ['X', 'Y'])
+
+# numpy dtype to GDAL data type, exact matches only (see GDALArray)
+dicNP2GDAL = {np.dtype(np.uint8): gdal.GDT_Byte,
+              np.dtype(np.uint16): gdal.GDT_UInt16,
+              np.dtype(np.int16): gdal.GDT_Int16,
+              np.dtype(np.uint32): gdal.GDT_UInt32,
+              np.dtype(np.int32): gdal.GDT_Int32,
+              np.dtype(np.float32): gdal.GDT_Float32,
+              np.dtype(np.float64): gdal.GDT_Float64}
+# newer GDAL (3.5+ 64 bit ints, 3.7+ signed byte)
+for npType, strGDT in [(np.int8, 'GDT_Int8'), (np.int64, 'GDT_Int64'), (np.uint64, 'GDT_UInt64')]:
+    if hasattr(gdal, strGDT):
+        dicNP2GDAL[np.dtype(npType)] = getattr(gdal, strGDT)
+
+# raster file extension to GDAL driver
+dicEXT2DRIVER = {'.tif': 'GTiff', '.tiff': 'GTiff', '.img': 'HFA', '.bsq': 'ENVI', '.dat': 'ENVI'}
+
+# default output compression and internal tile size (GeoTIFF and COG)
+COMPRESS = 'DEFLATE'
+TILESIZE = 256
+# pixel fraction treated as float error when snapping points to pixels
+PIXELTOL = 1e-6
+# overview levels when overviews are requested
+OVERVIEWLEVELS = [2, 4, 8, 16, 32]
+
+def SRtoWKT(sr):
+    """ Return WKT given spatial reference as WKT, EPSG:xxxx style string
+            or arcpy SpatialReference.
+    """
+    if not sr:
+        return ''
+    srs = osr.SpatialReference()
+    if isinstance(sr, str):
+        srs.SetFromUserInput(sr)
+    elif getattr(sr, 'factoryCode', 0):
+        srs.ImportFromEPSG(sr.factoryCode)
+    else:
+        srs.SetFromUserInput(sr.exportToString().split(';')[0])
+    return srs.ExportToWkt()
+
+def OpenBands(strPathRast):
+    """ Return GDAL dataset and list of band numbers given raster path.
+        Like arcpy, single band of multiband raster may be given as raster path + os.sep + band
+            name (band description) or Band_n.
+    """
+    if os.path.exists(strPathRast):
+        ds = gdal.Open(strPathRast)
+        return ds, list(range(1, ds.RasterCount + 1))
+
+    strPathDS, strBand = os.path.split(strPathRast)
+    ds = gdal.Open(strPathDS)
+    for b in range(1, ds.RasterCount + 1):
+        if ds.GetRasterBand(b).GetDescription() == strBand:
+            return ds, [b]
+    match = re.fullmatch(r'Band_(\d+)', strBand)
+    if match:
+        return ds, [int(match.group(1))]
+    raise Exception(f'OpenBands, band {strBand} not found in {strPathDS}.')
+
+def ListBandsGDAL(strPathRast):
+    """ Return list of band names (descriptions, else Band_n) of strPathRast. """
+    ds = gdal.Open(strPathRast)
+    lstBands = []
+    for b in range(1, ds.RasterCount + 1):
+        lstBands.append(ds.GetRasterBand(b).GetDescription() or 'Band_' + str(b))
+    return lstBands
+
+def getSimpleDescGDAL(strPathRast):
+    """ Get raster properties and place into SimpleDesc. """
+    ds, lstBands = OpenBands(strPathRast)
+    originX, pixelWidth, rotX, originY, rotY, pixelHeight = ds.GetGeoTransform()
+    if not pixelWidth == -pixelHeight:
+        raise Exception('Non square cell size.')
+
+    pt = Point(originX, originY + pixelHeight * ds.RasterYSize)
+    return rastArcU.SimpleDesc(ptLL = pt, fltCellSize = pixelWidth, SR = ds.GetProjection(),
+                               intWidth = ds.RasterXSize, intHeight = ds.RasterYSize)
+
+def RasterToNumPyArrayGDAL(strPathRast, ptLL=None, ncols=0, nrows=0, nodata_to_value=None):
+    """ GDAL version of arcpy.RasterToNumPyArray, same arguments and window logic:
+            window extends up and right from lower left corner ptLL (default raster lower left).
+        Return 2D array for single band, else 3D (band, row, col).
+    """
+    ds, lstBands = OpenBands(strPathRast)
+    originX, pixelWidth, rotX, originY, rotY, pixelHeight = ds.GetGeoTransform()
+    xoff, ybottom = 0, ds.RasterYSize
+    if ptLL is not None:
+        # pixel holding ptLL, as arcpy: corners snap up and right, within float error
+        xoff = int(np.floor((ptLL.X - originX) / pixelWidth + PIXELTOL))
+        ybottom = int(np.ceil((ptLL.Y - originY) / pixelHeight - PIXELTOL))
+    ncols = ncols or ds.RasterXSize - xoff
+    nrows = nrows or ybottom
+    yoff = ybottom - nrows
+
+    lstArr = []
+    for b in lstBands:
+        band = ds.GetRasterBand(b)
+        arr = band.ReadAsArray(xoff, yoff, ncols, nrows)
+        NoData = band.GetNoDataValue()
+        if nodata_to_value is not None and NoData is not None:
+            arr[arr == NoData] = nodata_to_value
+        lstArr.append(arr)
+
+    if len(lstArr) == 1:
+        return lstArr[0]
+    return np.stack(lstArr)
+
+def ClipRaster(strPathIn, strPathOut, strBND, strComment):
+    """ Clip raster, GDAL version of rasterARCUtility.ClipRaster.
+        strBND: rectangle as for arcpy.Clip_management, 'X Y X Y' string or sequence
+            (x at positions 0 and 2, y at 1 and 3, either order).
+        Window is snapped outward to the input cell grid and only it is read.
+    """
+    if os.path.exists(strPathOut):
+        return strPathOut
+
+    if isinstance(strBND, str):
+        strBND = strBND.split()
+    fltX0, fltY0, fltX1, fltY1 = [float(v) for v in strBND]
+    iDesc = getSimpleDescGDAL(strPathIn)
+    intCol = max(int(np.floor((min(fltX0, fltX1) - iDesc.Xmin) / iDesc.CellSize)), 0)
+    intRow = max(int(np.floor((iDesc.Ymax - max(fltY0, fltY1)) / iDesc.CellSize)), 0)
+    intColEnd = min(int(np.ceil((max(fltX0, fltX1) - iDesc.Xmin) / iDesc.CellSize)), iDesc.width)
+    intRowEnd = min(int(np.ceil((iDesc.Ymax - min(fltY0, fltY1)) / iDesc.CellSize)), iDesc.height)
+    if intColEnd <= intCol or intRowEnd <= intRow:
+        raise Exception(f'ClipRaster, {strBND} does not overlap {strPathIn}.')
+
+    iDescClip = rastArcU.BlockDesc(iDesc, intRow, intCol, intRowEnd - intRow, intColEnd - intCol)
+    ds, lstBands = OpenBands(strPathIn)
+    arr = np.stack([ds.GetRasterBand(b).ReadAsArray(intCol, intRow, iDescClip.width, iDescClip.height)
+                    for b in lstBands])
+    band = ds.GetRasterBand(lstBands[0])
+    lstNames = [ds.GetRasterBand(b).GetDescription() for b in lstBands]
+    ArrayToRasterGDAL(arr, strPathOut, iDescClip, band.GetNoDataValue(),
+                      lstBandNames=lstNames if any(lstNames) else None)
+
+    return strPathOut
+
+def Predictor(npType):
+    """ Return TIFF predictor for npType: 3 (floating point) for floats else 2 (horizontal). """
+    return 3 if np.issubdtype(npType, np.floating) else 2
+
+def CreationOptions(npType, strCompress=COMPRESS, intTileSize=TILESIZE):
+    """ Return GeoTIFF creation options: tiled, compressed with predictor (DEFLATE, LZW, ZSTD)
+            or other GDAL compression, and BIGTIFF if needed.
+    """
+    lstOptions = ['TILED=YES', f'BLOCKXSIZE={intTileSize}', f'BLOCKYSIZE={intTileSize}',
+                  'BIGTIFF=IF_SAFER']
+    if strCompress and strCompress.upper() != 'NONE':
+        lstOptions.append('COMPRESS=' + strCompress.upper())
+        if strCompress.upper() in ('DEFLATE', 'LZW', 'ZSTD'):
+            lstOptions.append(f'PREDICTOR={Predictor(npType)}')
+    return lstOptions
+
+def COGOptions(npType, strCompress=COMPRESS, intTileSize=TILESIZE, bolOverviews=True):
+    """ Return Cloud Optimized GeoTIFF (COG driver) creation options. """
+    lstOptions = [f'BLOCKSIZE={intTileSize}', 'BIGTIFF=IF_SAFER', 'RESAMPLING=NEAREST',
+                  'OVERVIEWS=' + ('AUTO' if bolOverviews else 'NONE')]
+    if strCompress and strCompress.upper() != 'NONE':
+        lstOptions.append('COMPRESS=' + strCompress.upper())
+        if strCompress.upper() in ('DEFLATE', 'LZW', 'ZSTD'):
+            lstOptions.append('PREDICTOR=' + ('FLOATING_POINT' if Predictor(npType) == 3 else 'STANDARD'))
+    return lstOptions
+
+def GDALArray(arr):
+    """ Return arr, cast if needed to the smallest dtype GDAL can write directly
+            (e.g. bool to uint8, int8 to int16 before GDAL 3.7).
+        64 bit ints before GDAL 3.5 are narrowed to int32 (uint32) if their values fit,
+            else raise (see NarrowInt), never cast to float64.
+    """
+    if arr.dtype in dicNP2GDAL:
+        return arr
+    if arr.dtype == bool:
+        return arr.astype(np.uint8)
+    for npType in (np.int16, np.int32):
+        if np.can_cast(arr.dtype, npType):
+            return arr.astype(npType)
+    if arr.dtype.kind in 'iu':
+        return NarrowInt(arr, np.uint32 if arr.dtype.kind == 'u' else np.int32)
+    if np.can_cast(arr.dtype, np.float64):
+        return arr.astype(np.float64)
+    raise Exception(f'GDALArray, no GDAL data type for {arr.dtype}.')
+
+def NarrowInt(arr, npType):
+    """ Return integer arr cast to integer npType, raise if its values don't fit. """
+    iInfo = np.iinfo(npType)
+    if arr.size and (arr.min() < iInfo.min or arr.max() > iInfo.max):
+        raise Exception(f'NarrowInt, {arr.dtype} values outside {np.dtype(npType)} range, '
+                        f'64 bit ints need GDAL 3.5+ (have {gdal.__version__}).')
+    return arr.astype(npType, copy=False)
+
+def CastGDAL(arr, npType):
+    """ Return arr cast to npType for writing, integer values checked to fit (NarrowInt). """
+    if arr.dtype.kind in 'iu' and np.dtype(npType).kind in 'iu' and not np.can_cast(arr.dtype, npType):
+        return NarrowInt(arr, npType)
+    return arr.astype(npType, copy=False)
+
+def GDALType(npType):
+    """ Return dtype GDALArray writes arrays of npType as. """
+    return GDALArray(np.zeros(0, dtype=npType)).dtype
+
+def CreateRasterGDAL(strPathRast, iDesc, intBands, npType, val2NoData=None, lstOptions=None,
+                     strDriver=None, lstBandNames=None):
+    """ Create and return GDAL dataset for raster described by iDesc.
+        Geotransform and projection from iDesc (no arcpy needed), npType mapped
+            through GDALArray (see GDALType), e.g. int8 is created int16 before GDAL 3.7.
+        Driver strDriver, default by extension of strPathRast (see dicEXT2DRIVER).
+        Optional lstBandNames: band descriptions.
+    """
+    if strDriver is None:
+        strDriver = dicEXT2DRIVER.get(os.path.splitext(strPathRast)[1].lower(), 'GTiff')
+    driver = gdal.GetDriverByName(strDriver)
+    outRaster = driver.Create(strPathRast, iDesc.width, iDesc.height, intBands,
+                              dicNP2GDAL[GDALType(npType)], lstOptions or [])
+    outRaster.SetGeoTransform(iDesc.describeGDAL())
+    strWKT = SRtoWKT(iDesc.sr)
+    if strWKT:
+        outRaster.SetProjection(strWKT)
+    for b in range(1, intBands + 1):
+        if val2NoData is not None:
+            outRaster.GetRasterBand(b).SetNoDataValue(val2NoData)
+        if lstBandNames:
+            outRaster.GetRasterBand(b).SetDescription(lstBandNames[b - 1])
+    return outRaster
+
+def WriteBlockGDAL(outRaster, arr, intRow=0, intCol=0, intBand=1, intBandBlock=None):
+    """ Write 2D or 3D (band, row, col) arr to outRaster at offset intRow, intCol,
+            starting at band intBand.
+        Bands are written intBandBlock (default all) at a time, one Dataset.WriteRaster
+            call per band block.
+    """
+    if arr.ndim == 2:
+        arr = arr[np.newaxis, :, :]
+    arr = GDALArray(arr)
+    intBands, intRows, intCols = arr.shape
+    intBandBlock = intBandBlock or intBands
+    for b in range(0, intBands, intBandBlock):
+        arrB = np.ascontiguousarray(arr[b:b + intBandBlock, :, :])
+        lstBands = list(range(intBand + b, intBand + b + arrB.shape[0]))
+        # contiguous array passed as buffer, no bytes copy
+        outRaster.WriteRaster(intCol, intRow, intCols, intRows, arrB,
+                              buf_type=dicNP2GDAL[arrB.dtype], band_list=lstBands)
+
+def ArrayToRasterGDAL(arr, strPathRast, iDesc, val2NoData=None, lstOptions=None,
+                      strCompress=COMPRESS, bolOverviews=False, bolCOG=False, lstBandNames=None):
+    """ Save numpy array arr (2D or 3D band, row, col) to raster strPathRast in one pass.
+        GeoTIFFs are tiled and compressed (strCompress, with predictor), see CreationOptions,
+            unless lstOptions given.
+        Options:
+            lstBandNames: band descriptions, one per band.
+            bolOverviews: build internal overviews (nearest, OVERVIEWLEVELS).
+            bolCOG: write Cloud Optimized GeoTIFF, array is staged in memory (MEM driver)
+                and copied once to COG driver.
+        Return strPathRast.
+    """
+    if os.path.exists(strPathRast):
+        raise Exception(f'ArrayToRasterGDAL, {strPathRast} already exists.')
+
+    if arr.ndim == 2:
+        arr = arr[np.newaxis, :, :]
+    arr = GDALArray(arr)
+
+    if bolCOG:
+        memRaster = CreateRasterGDAL('', iDesc, arr.shape[0], arr.dtype, val2NoData, strDriver='MEM',
+                                     lstBandNames=lstBandNames)
+        WriteBlockGDAL(memRaster, arr)
+        lstOptions = lstOptions or COGOptions(arr.dtype, strCompress, bolOverviews=bolOverviews)
+        outRaster = gdal.GetDriverByName('COG').CreateCopy(strPathRast, memRaster, options=lstOptions)
+        outRaster = memRaster = None
+        return strPathRast
+
+    if lstOptions is None and dicEXT2DRIVER.get(os.path.splitext(strPathRast)[1].lower(), 'GTiff') == 'GTiff':
+        lstOptions = CreationOptions(arr.dtype, strCompress)
+    outRaster = CreateRasterGDAL(strPathRast, iDesc, arr.shape[0], arr.dtype, val2NoData, lstOptions,
+                                 lstBandNames=lstBandNames)
+    WriteBlockGDAL(outRaster, arr)
+    if bolOverviews:
+        outRaster.BuildOverviews('NEAREST', OVERVIEWLEVELS)
+    outRaster.FlushCache()
+    outRaster = None
+
+    return strPathRast
+
+def StackArraysGDAL(lstArr, strPathOut, iDesc, lstBandNames, val2NoData=None,
+                    strCompress=COMPRESS, bolOverviews=False, bolCOG=False):
+    """ Save list of 2D arrays lstArr as bands of multiband strPathOut in one pass,
+            without stacking them to a 3D array first.
+        Band descriptions lstBandNames. Options as ArrayToRasterGDAL.
+    """
+    if os.path.exists(strPathOut):
+        raise Exception(f'StackArraysGDAL, {strPathOut} already exists.')
+
+    npType = GDALType(lstArr[0].dtype)
+    if bolCOG:
+        outRaster = CreateRasterGDAL('', iDesc, len(lstArr), npType, val2NoData, strDriver='MEM',
+                                     lstBandNames=lstBandNames)
+    else:
+        lstOptions = None
+        if dicEXT2DRIVER.get(os.path.splitext(strPathOut)[1].lower(), 'GTiff') == 'GTiff':
+            lstOptions = CreationOptions(npType, strCompress)
+        outRaster = CreateRasterGDAL(strPathOut, iDesc, len(lstArr), npType, val2NoData, lstOptions,
+                                     lstBandNames=lstBandNames)
+
+    for b, arr in enumerate(lstArr):
+        WriteBlockGDAL(outRaster, CastGDAL(arr, npType), intBand=b + 1)
+
+    if bolCOG:
+        lstOptions = COGOptions(npType, strCompress, bolOverviews=bolOverviews)
+        gdal.GetDriverByName('COG').CreateCopy(strPathOut, outRaster, options=lstOptions)
+    elif bolOverviews:
+        outRaster.BuildOverviews('NEAREST', OVERVIEWLEVELS)
+    outRaster.FlushCache()
+    outRaster = None
+
+    return strPathOut
+
+def StackRasterGDAL(lstRastIn, strPathOut):
+    """ Stack single band rasters lstRastIn to multiband strPathOut.
+        Band descriptions set to input raster names.
+    """
+    iDesc = getSimpleDescGDAL(lstRastIn[0])
+    outRaster = None
+    for b, rast in enumerate(lstRastIn):
+        ds, lstBands = OpenBands(rast)
+        band = ds.GetRasterBand(lstBands[0])
+        arr = band.ReadAsArray()
+        if outRaster is None:
+            outRaster = CreateRasterGDAL(strPathOut, iDesc, len(lstRastIn), arr.dtype,
+                                         band.GetNoDataValue(), CreationOptions(arr.dtype))
+        outBand = outRaster.GetRasterBand(b + 1)
+        outBand.WriteArray(arr)
+        outBand.SetDescription(os.path.splitext(os.path.basename(rast))[0])
+    outRaster.FlushCache()
+    outRaster = None
+
+    return strPathOut
+
+def MosaicBlocksGDAL(lstBlocksIn, strPathOut, iDesc, npType, NoDataVal=None):
+    """ Mosaic block rasters (all within iDesc, same cell alignment) to strPathOut. """
+    outRaster = CreateRasterGDAL(strPathOut, iDesc, 1, npType, NoDataVal, CreationOptions(npType))
+    for strBlock in lstBlocksIn:
+        iDescB = getSimpleDescGDAL(strBlock)
+        intRow = int(round((iDesc.Ymax - iDescB.Ymax) / iDesc.CellSize))
+        intCol = int(round((iDescB.Xmin - iDesc.Xmin) / iDesc.CellSize))
+        WriteBlockGDAL(outRaster, RasterToNumPyArrayGDAL(strBlock).astype(npType), intRow, intCol)
+    outRaster.FlushCache()
+    outRaster = None
+
+    return strPathOut
+
+def DeleteRasterGDAL(strPathRast):
+    """ Delete raster strPathRast with its driver, so sidecar files (.aux.xml, .ovr) go too. """
+    inRaster = gdal.Open(strPathRast)
+    driver = inRaster.GetDriver()
+    inRaster = None
+    driver.Delete(strPathRast)
+
+class BlockRasterGDAL():
+    """ Raster created once at full extent (iDesc) and written block by block (WriteBlockGDAL).
+        GeoTIFFs are tiled and compressed (see CreationOptions), blocks aligned to
+            TILESIZE avoid recompressing tiles.
+        bolCOG: blocks are written to an uncompressed staging GeoTIFF, copied once to
+            the COG driver on close.
+    """
+    def __init__(self, strPathRast, iDesc, intBands, npType, val2NoData=None, lstBandNames=None,
+                 strCompress=COMPRESS, bolOverviews=False, bolCOG=False):
+        """ init """
+        if os.path.exists(strPathRast):
+            raise Exception(f'BlockRasterGDAL, {strPathRast} already exists.')
+        self.path = strPathRast
+        self.dtype = GDALType(npType)
+        self.bolOverviews = bolOverviews
+        self.bolCOG = bolCOG
+        self.strCompress = strCompress
+        self.pathWrite = strPathRast + '.stage.tif' if bolCOG else strPathRast
+        lstOptions = None
+        if dicEXT2DRIVER.get(os.path.splitext(self.pathWrite)[1].lower(), 'GTiff') == 'GTiff':
+            lstOptions = CreationOptions(self.dtype, 'NONE' if bolCOG else strCompress)
+        self.raster = CreateRasterGDAL(self.pathWrite, iDesc, intBands, self.dtype, val2NoData, lstOptions,
+                                       lstBandNames=lstBandNames)
+
+    def write(self, arr, intRow=0, intCol=0, intBand=1):
+        """ Write 2D or 3D (band, row, col) arr at offset intRow, intCol, starting at band intBand. """
+        WriteBlockGDAL(self.raster, CastGDAL(arr, self.dtype), intRow, intCol, intBand)
+
+    def close(self):
+        """ Finish raster (overviews or COG copy) and close. Return path. """
+        if self.bolCOG:
+            lstOptions = COGOptions(self.dtype, self.strCompress, bolOverviews=self.bolOverviews)
+            gdal.GetDriverByName('COG').CreateCopy(self.path, self.raster, options=lstOptions)
+            self.raster = None
+            DeleteRasterGDAL(self.pathWrite)
+            return self.path
+        if self.bolOverviews:
+            self.raster.BuildOverviews('NEAREST', OVERVIEWLEVELS)
+        self.raster.FlushCache()
+        self.raster = None
+        return self.path
@@ -0,0 +1,184 @@
+"""
+---------------------------------------------------------------------------
+ rasterIO.py
+ 10/2026
+
+ Raster I/O backend: dispatch raster read, describe and write calls to
+    arcpy (rasterARCUtility) or GDAL (rasterGDALUtility) implementations.
+    Backend is chosen with setBackend or the RASTER_BACKEND environment variable,
+    default arcpy if available, else gdal.
+
+ Known limitations: python 3
+---------------------------------------------------------------------------
+"""
+import os
+import tempfile
+import importlib.util
+import raster.rasterARCUtility as rastArcU
+
+BACKENDS = ('arcpy', 'gdal')
+
+def getBackend():
+    """ Return name of current backend. """
+    strBackend = os.environ.get('RASTER_BACKEND')
+    if strBackend is None:
+        strBackend = 'arcpy' if rastArcU.arcpy else 'gdal'
+    if strBackend not in BACKENDS:
+        raise Exception(f'Unknown raster backend {strBackend}, must be one of {BACKENDS}.')
+    return strBackend
+
+def setBackend(strBackend):
+    """ Set backend for this process and any child (pool) processes. """
+    if strBackend not in BACKENDS:
+        raise Exception(f'Unknown raster backend {strBackend}, must be one of {BACKENDS}.')
+    os.environ['RASTER_BACKEND'] = strBackend
+
+def isGDAL():
+    """ Return True if current backend is gdal. """
+    return getBackend() == 'gdal'
+
+def hasGDAL():
+    """ Return True if GDAL (osgeo) is importable. Writes use GDAL whenever it is, whatever the
+            read backend, so compression, overviews and COG options apply.
+    """
+    return importlib.util.find_spec('osgeo') is not None
+
+def _gdalU():
+    """ Return rasterGDALUtility, imported on first use so arcpy only installs don't need GDAL. """
+    import raster.rasterGDALUtility as rastGdalU
+    return rastGdalU
+
+# ---------------------------------------------------------------------------
+# read and describe
+def Point(X, Y):
+    """ Return point (lower left corner for RasterToNumPyArray) for current backend. """
+    if isGDAL():
+        return _gdalU().Point(X, Y)
+    return rastArcU.arcpy.Point(X, Y)
+
+def getSimpleDesc(strPathRast):
+    """ Get raster properties and place into SimpleDesc. """
+    if isGDAL():
+        return _gdalU().getSimpleDescGDAL(strPathRast)
+    return rastArcU.getSimpleDesc(strPathRast)
+
+def ListBands(strPathRast):
+    """ Return list of band names in multiband strPathRast. """
+    if isGDAL():
+        return _gdalU().ListBandsGDAL(strPathRast)
+    return rastArcU.ListBands(strPathRast)
+
+def RasterToNumPyArray(strPathRast, ptLL=None, ncols=0, nrows=0, nodata_to_value=None):
+    """ Return numpy array of strPathRast, arguments as arcpy.RasterToNumPyArray. """
+    if isGDAL():
+        return _gdalU().RasterToNumPyArrayGDAL(strPathRast, ptLL, ncols, nrows, nodata_to_value)
+    if ptLL is None:
+        return rastArcU.arcpy.RasterToNumPyArray(strPathRast, ncols=ncols, nrows=nrows,
+                                                 nodata_to_value=nodata_to_value)
+    return rastArcU.arcpy.RasterToNumPyArray(strPathRast, ptLL, ncols, nrows, nodata_to_value)
+
+def RasterToNumPyBlock(strPathRast, iDescBlock, nodata_to_value=None):
+    """ Return numpy array of block of strPathRast described by iDescBlock (see BlockDesc). """
+    return RasterToNumPyArray(strPathRast, iDescBlock.ptLL, iDescBlock.width, iDescBlock.height,
+                              nodata_to_value)
+
+# ---------------------------------------------------------------------------
+# write
+def _arcOptions(strFunc, strCompress, bolOverviews, bolCOG):
+    """ Raise if write options are asked for without GDAL, arcpy writes follow arcpy.env. """
+    if strCompress is not None or bolOverviews or bolCOG:
+        raise Exception(f'{strFunc}, strCompress, bolOverviews and bolCOG need GDAL (osgeo), '
+                        'arcpy writes follow arcpy.env.')
+
+def ScratchOptions():
+    """ Return write options for scratch (intermediate) rasters: uncompressed with GDAL,
+            arcpy.env defaults without.
+    """
+    return {'strCompress': 'NONE'} if hasGDAL() else {}
+
+def ArrayToRaster(arr, strPathRast, iDesc, val2NoData=None, bolVerbose=True, strCompress=None,
+                  bolOverviews=False, bolCOG=False):
+    """ Save numpy array arr to raster strPathRast, skip if it exists.
+        GDAL available (any backend): single pass tiled, compressed GeoTIFF (strCompress: DEFLATE
+            (None), LZW, ZSTD, NONE...), optional internal overviews or Cloud Optimized GeoTIFF,
+            see ArrayToRasterGDAL.
+        arcpy only: rasterARCUtility.ArrayToRaster, compression and overviews follow arcpy.env,
+            other options raise.
+        Return strPathRast.
+    """
+    if not hasGDAL():
+        _arcOptions('ArrayToRaster', strCompress, bolOverviews, bolCOG)
+        rastArcU.ArrayToRaster(arr, strPathRast, iDesc, val2NoData, bolVerbose)
+        return strPathRast
+
+    if os.path.exists(strPathRast):
+        print('Already saved: ' + strPathRast)
+        return strPathRast
+    rastGdalU = _gdalU()
+    return rastGdalU.ArrayToRasterGDAL(arr, strPathRast, iDesc, val2NoData,
+                                       strCompress=strCompress or rastGdalU.COMPRESS,
+                                       bolOverviews=bolOverviews, bolCOG=bolCOG)
+
+def MosaicBlocks(lstBlocksIn, strPathOut, iDesc, npType, NoDataVal=None):
+    """ Mosaic block rasters to strPathOut with pixel type of npType. """
+    if isGDAL():
+        return _gdalU().MosaicBlocksGDAL(lstBlocksIn, strPathOut, iDesc, npType, NoDataVal)
+    return rastArcU.MosaicBlocks(lstBlocksIn, strPathOut, iDesc, npType, NoDataVal)
+
+def StackArrays(lstArr, strPathOut, iDesc, lstBandNames, val2NoData=None, strCompress=None,
+                bolOverviews=False, bolCOG=False):
+    """ Save list of 2D arrays lstArr as bands of multiband strPathOut, band names lstBandNames.
+        Skip if strPathOut exists. Options as ArrayToRaster.
+        Return strPathOut.
+    """
+    if os.path.exists(strPathOut):
+        print('Already saved: ' + strPathOut)
+        return strPathOut
+    if hasGDAL():
+        rastGdalU = _gdalU()
+        return rastGdalU.StackArraysGDAL(lstArr, strPathOut, iDesc, lstBandNames, val2NoData,
+                                         strCompress or rastGdalU.COMPRESS, bolOverviews, bolCOG)
+    _arcOptions('StackArrays', strCompress, bolOverviews, bolCOG)
+    rastArcU.StackArrays(lstArr, strPathOut, iDesc, lstBandNames, val2NoData)
+    return strPathOut
+
+def BlockRaster(strPathOut, iDesc, intBands, npType, val2NoData=None, lstBandNames=None,
+                strCompress=None, bolOverviews=False, bolCOG=False):
+    """ Create strPathOut once at full extent of iDesc and return block writer
+            (write(arr, intRow, intCol, intBand), close()), see BlockRasterGDAL.
+        GDAL only (any backend): arcpy only tiled writers mosaic block rasters instead (MosaicBlocks).
+    """
+    if not hasGDAL():
+        raise Exception('BlockRaster, needs GDAL (osgeo).')
+    rastGdalU = _gdalU()
+    return rastGdalU.BlockRasterGDAL(strPathOut, iDesc, intBands, npType, val2NoData, lstBandNames,
+                                     strCompress or rastGdalU.COMPRESS, bolOverviews, bolCOG)
+
+def ClipRaster(strPathIn, strPathOut, strBND, strComment=''):
+    """ Clip raster to rectangle strBND (see rasterGDALUtility.ClipRaster). """
+    if isGDAL():
+        return _gdalU().ClipRaster(strPathIn, strPathOut, strBND, strComment)
+    return rastArcU.ClipRaster(strPathIn, strPathOut, strBND, strComment)
+
+def StackRaster(lstRastIn, strPathOut):
+    """ Stack single band rasters lstRastIn to multiband strPathOut, bands named after inputs. """
+    if isGDAL():
+        return _gdalU().StackRasterGDAL(lstRastIn, strPathOut)
+    rastArcU.StackRaster(lstRastIn, strPathOut)
+    return strPathOut
+
+def DeleteRaster(strPathRast):
+    """ Delete raster strPathRast (and sidecar files) if it exists. """
+    if not os.path.exists(strPathRast):
+        return
+    if isGDAL():
+        _gdalU().DeleteRasterGDAL(strPathRast)
+    else:
+        rastArcU.arcpy.Delete_management(strPathRast)
+
+def ScratchFolder(strPrefix='raster_'):
+    """ Create and return new folder in scratch folder (arcpy.env.scratchFolder or system temp). """
+    strPathBase = None
+    if not isGDAL():
+        strPathBase = rastArcU.arcpy.env.scratchFolder
+    return tempfile.mkdtemp(prefix=strPrefix, dir=strPathBase)
@@ -0,0 +1,56 @@
+"""
+ pytest setup: make this repository importable as package raster (as when cloned to
+    a folder named raster on sys.path) and EDART modules importable by bare name.
+    Fixture envi_writer: small ENVI rasters for envi_header and EDART tests.
+"""
+import os
+import sys
+import importlib.util
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'EDART')]
+
+if 'raster' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('raster', os.path.join(ROOT, '__init__.py'),
+                                                  submodule_search_locations=[ROOT])
+    sys.modules['raster'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['raster'])
+
+import raster.envi_header as envi
+
+ENVIBANDS = ['NBR', 'NDVI', 'dNBR']
+
+def write_envi(strPathRast, arr3, strInterleave='bsq', intByteOrder=0, intDataType=2, intOffset=0,
+               tupMap=(500000.0, 4000000.0, 30.0)):
+    """ Write (bands, lines, samples) arr3 to strPathRast in strInterleave with ENVI header,
+            upper left corner and cell size tupMap, bands named ENVIBANDS.
+        Return HDR.
+    """
+    dicOrder = {'bsq': (0, 1, 2), 'bil': (1, 0, 2), 'bip': (1, 2, 0)}
+    npType = np.dtype(envi.dicENVIDTYPE[intDataType]).newbyteorder('>' if intByteOrder else '<')
+    intBands, intLines, intSamples = arr3.shape
+    with open(strPathRast, 'wb') as f:
+        f.write(b'\0' * intOffset)
+        f.write(arr3.transpose(dicOrder[strInterleave]).astype(npType).tobytes())
+    XMin, YMax, CellSize = tupMap
+    lstHDR = ['ENVI',
+              f'samples = {intSamples}',
+              f'lines = {intLines}',
+              f'bands = {intBands}',
+              f'header offset = {intOffset}',
+              f'data type = {intDataType}',
+              f'interleave = {strInterleave}',
+              f'byte order = {intByteOrder}',
+              f'map info = {{UTM, 1, 1, {XMin!r}, {YMax!r}, {CellSize!r}, {CellSize!r}, 10, North, WGS-84}}',
+              'band names = {',
+              ',\n'.join(ENVIBANDS[:intBands]) + '}']
+    with open(os.path.splitext(strPathRast)[0] + '.hdr', 'w') as f:
+        f.write('\n'.join(lstHDR) + '\n')
+    return envi.HDR(strPathRast)
+
+@pytest.fixture
+def envi_writer():
+    """ Return write_envi. """
+    return write_envi
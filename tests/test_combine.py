@@ -0,0 +1,122 @@
+"""
+ combine VectorCombine against the dictionary path (uniqueDict, RemoveNoDataKeys, WriteLU2).
+"""
+import numpy as np
+import pytest
+import raster.combine as combine
+
+def inputs(intSeed=0, tupShape=(40, 30), intInputs=3, intValues=5):
+    """ Return list of 1D input arrays with few values, so combinations repeat. """
+    rng = np.random.default_rng(intSeed)
+    return [rng.integers(0, intValues, tupShape).reshape(-1) for i in range(intInputs)]
+
+def zones_equal(arrA, arrB):
+    """ Return True if ID arrays arrA and arrB partition pixels into the same zones. """
+    intPairs = np.unique(np.stack((arrA, arrB)), axis=1).shape[1]
+    return intPairs == len(np.unique(arrA)) == len(np.unique(arrB))
+
+def test_ids_value_tuple_order():
+    lstArr = inputs()
+    arrC, arrCombos, arrCounts = combine.VectorCombine(None, *lstArr)
+    # combinations sorted as tuples, ID i + 1 is combination i
+    assert [tuple(c) for c in arrCombos] == sorted(set(zip(*lstArr)))
+    np.testing.assert_array_equal(arrCombos[arrC - 1], np.stack(lstArr, axis=1))
+    np.testing.assert_array_equal(arrCounts, np.bincount(arrC)[1:])
+
+@pytest.mark.parametrize('NoDataVal', [0, 3])
+def test_nodata_excluded(NoDataVal):
+    lstArr = inputs(intSeed=1)
+    arrC, arrCombos, arrCounts = combine.VectorCombine(NoDataVal, *lstArr)
+    arrND = np.any(np.stack(lstArr) == NoDataVal, axis=0)
+    assert (arrC[arrND] == NoDataVal).all()
+    assert not (arrCombos == NoDataVal).any()
+    assert arrCounts.sum() == (~arrND).sum()
+
+@pytest.mark.parametrize('intSeed', range(3))
+def test_zones_match_dictionary_path(intSeed):
+    NoDataVal = 0
+    lstArr = inputs(intSeed=intSeed)
+    dicLUc = combine.RemoveNoDataKeys(combine.uniqueDict(*lstArr), NoDataVal)
+    arrDict = combine.WriteLU2(dicLUc, NoDataVal, *lstArr)
+    arrC, arrCombos, arrCounts = combine.VectorCombine(NoDataVal, *lstArr)
+
+    arrValid = arrC != NoDataVal
+    np.testing.assert_array_equal(arrValid, arrDict != NoDataVal)
+    assert len(arrCombos) == len(dicLUc)
+    assert zones_equal(arrC[arrValid], arrDict[arrValid])
+
+def blocks(lstArr, tupShape, intBlockSize):
+    """ Return list of lists of 1D input blocks, row major as rasterARCUtility.IterBlocks. """
+    iDesc = type('Desc', (), {'height': tupShape[0], 'width': tupShape[1]})
+    lstB = []
+    for r, c, nr, nc in combine.rastArcU.IterBlocks(iDesc, intBlockSize):
+        lstB.append([arr.reshape(tupShape)[r:r + nr, c:c + nc].reshape(-1) for arr in lstArr])
+    return lstB, list(combine.rastArcU.IterBlocks(iDesc, intBlockSize))
+
+def combine_blocks(lstArr, tupShape, intBlockSize, NoDataVal, lstOrder=None):
+    """ Return (global ID raster, CombineTable) of block-wise combine in memory:
+            CombineLocal per block, MergeCombos (blocks in lstOrder) and RemapIDs.
+    """
+    lstB, lstWin = blocks(lstArr, tupShape, intBlockSize)
+    lstLocal = [combine.CombineLocal(NoDataVal, *b) for b in lstB]
+    lstOrder = lstOrder or list(range(len(lstB)))
+    iTable, lstIDs = combine.MergeCombos([lstLocal[i][1] for i in lstOrder],
+                                         [lstLocal[i][2] for i in lstOrder])
+    arrOut = np.zeros(tupShape, dtype=np.int64)
+    for i, arrIDs in zip(lstOrder, lstIDs):
+        r, c, nr, nc = lstWin[i]
+        arrOut[r:r + nr, c:c + nc] = combine.RemapIDs(lstLocal[i][0], arrIDs, NoDataVal).reshape(nr, nc)
+    return arrOut, iTable
+
+@pytest.mark.parametrize('intBlockSize', [4, 7, 16, 64])
+@pytest.mark.parametrize('NoDataVal', [None, 0])
+def test_block_ids_match_one_pass(intBlockSize, NoDataVal):
+    tupShape = (40, 30)
+    lstArr = inputs(intSeed=2, tupShape=tupShape)
+    arrC, arrCombos, arrCounts = combine.VectorCombine(NoDataVal, *lstArr)
+    arrOut, iTable = combine_blocks(lstArr, tupShape, intBlockSize, NoDataVal)
+    np.testing.assert_array_equal(arrOut.reshape(-1), arrC)
+    np.testing.assert_array_equal(iTable.combos, arrCombos)
+    np.testing.assert_array_equal(iTable.counts, arrCounts)
+
+@pytest.mark.parametrize('intSeed', range(3))
+def test_merge_independent_of_block_order(intSeed):
+    # pool results can arrive in any order, and worker count changes the split
+    tupShape = (40, 30)
+    lstArr = inputs(intSeed=intSeed, tupShape=tupShape)
+    arrRef, iTableRef = combine_blocks(lstArr, tupShape, 8, 0)
+    intBlocks = len(blocks(lstArr, tupShape, 8)[0])
+    lstOrder = list(np.random.default_rng(intSeed).permutation(intBlocks))
+    arrOut, iTable = combine_blocks(lstArr, tupShape, 8, 0, lstOrder)
+    np.testing.assert_array_equal(arrOut, arrRef)
+    np.testing.assert_array_equal(iTable.combos, iTableRef.combos)
+    np.testing.assert_array_equal(iTable.counts, iTableRef.counts)
+
+@pytest.mark.parametrize('intBlockSize', [None, 7, 16])
+def test_table_counts(intBlockSize):
+    tupShape = (40, 30)
+    NoDataVal = 0
+    lstArr = inputs(intSeed=3, tupShape=tupShape)
+    if intBlockSize is None:
+        arrC, arrCombos, arrCounts = combine.VectorCombine(NoDataVal, *lstArr)
+        iTable = combine.CombineTable(len(lstArr), arrCombos=arrCombos, arrCounts=arrCounts)
+    else:
+        arrC, iTable = combine_blocks(lstArr, tupShape, intBlockSize, NoDataVal)
+    arrRec = iTable.records(['A', 'B', 'C'])
+    arrValid = combine.NoDataMask(NoDataVal, *lstArr)
+    np.testing.assert_array_equal(arrRec['VALUE'], np.arange(1, len(iTable) + 1))
+    np.testing.assert_array_equal(arrRec['COUNT'], np.bincount(arrC.reshape(-1)[arrValid])[1:])
+    assert arrRec['COUNT'].sum() == arrValid.sum()
+
+def test_table_save(tmp_path, monkeypatch):
+    lstArr = inputs()
+    arrC, arrCombos, arrCounts = combine.VectorCombine(0, *lstArr)
+    iTable = combine.CombineTable(len(lstArr), arrCombos=arrCombos, arrCounts=arrCounts)
+    strPath = iTable.save(str(tmp_path / 'vat.csv'), ['A', 'B', 'C'])
+    arrRead = np.loadtxt(strPath, delimiter=',', skiprows=1, dtype=np.int64)
+    np.testing.assert_array_equal(arrRead[:, 1], arrCounts)
+    np.testing.assert_array_equal(arrRead[:, 2:], arrCombos)
+
+    monkeypatch.setattr(combine, 'arcpy', None)
+    with pytest.raises(Exception, match='require arcpy'):
+        iTable.save(str(tmp_path / 'out.tif.vat.dbf'), ['A', 'B', 'C'])
@@ -0,0 +1,66 @@
+"""
+ edart_utility YearReduce against per year testYear reductions, including negative
+    values and years without values.
+"""
+import numpy as np
+import pytest
+import edart_utility as edU
+
+YEARS = [2008, 2009, 2010, 2011]
+
+def cube(intSeed=0, tupShape=(10, 6, 7)):
+    """ Return event cube (some events outside YEARS) and signed int16 value cube. """
+    rng = np.random.default_rng(intSeed)
+    arr3_Evt = (2007 + rng.integers(0, 72, tupShape) / 12).astype(np.float32)
+    arr3_Val = rng.integers(-50, 50, tupShape, dtype=np.int16)
+    # no event in any year
+    arr3_Evt[:, 0, :] = 0
+    return arr3_Evt, arr3_Val
+
+@pytest.mark.parametrize('strStat, fStat', [('sum', np.sum), ('max', np.max), ('min', np.min),
+                                             ('count', None)])
+@pytest.mark.parametrize('intSeed', range(3))
+def test_year_reduce(strStat, fStat, intSeed):
+    arr3_Evt, arr3_Val = cube(intSeed)
+    arr3_Out = edU.YearReduce(edU.YearBucket(arr3_Evt, YEARS), arr3_Val, len(YEARS), strStat)
+    for i, y in enumerate(YEARS):
+        arr3_In = edU.testYear(arr3_Evt, y).astype(bool)
+        if fStat is None:
+            arrRef = arr3_In.sum(axis=0)
+        else:
+            # statistic of values in year only, 0 where none
+            arrRef = np.where(arr3_In.any(axis=0),
+                              fStat(np.ma.masked_array(arr3_Val, ~arr3_In), axis=0).filled(0), 0)
+        np.testing.assert_array_equal(arr3_Out[i], arrRef)
+    assert not arr3_Out[:, 0, :].any()
+
+def window_reader(iHDR):
+    """ Return RasterToNumPyArray stand in for single band iHDR: window up and right of the
+            pixel holding ptLL (as arcpy), exact float arithmetic, no snapping.
+    """
+    def RasterToNumPyArray(strPathRast, ptLL, ncols, nrows):
+        c = int(np.floor((ptLL.X - iHDR.XMin) / iHDR.CellSizeX))
+        r = int(np.floor((iHDR.YMax - ptLL.Y) / iHDR.CellSizeY))
+        return np.asarray(iHDR.band(0)[r - nrows + 1:r + 1, c:c + ncols])
+    return RasterToNumPyArray
+
+@pytest.mark.parametrize('strReader', ['window', 'gdal'])
+@pytest.mark.parametrize('tupMap', [(500000.0, 4000000.0, 30.0), (612345.67, 4123456.789, 30.0),
+                                    (-2362395.1, 3267405.3, 0.1)])
+def test_read_points_paths_agree(tmp_path, monkeypatch, envi_writer, strReader, tupMap):
+    tupShp = (9, 11)
+    arr3 = np.random.default_rng(0).integers(0, 1000, (1, 12, 11), dtype=np.int16)
+    strPath = str(tmp_path / 'DM.bsq')
+    iHDR = envi_writer(strPath, arr3, tupMap=tupMap)
+    if strReader == 'gdal':
+        pytest.importorskip('osgeo')
+        monkeypatch.setenv('RASTER_BACKEND', 'gdal')
+    else:
+        monkeypatch.setattr(edU.rastIO, 'Point', lambda X, Y: type('Point', (), {'X': X, 'Y': Y}))
+        monkeypatch.setattr(edU.rastIO, 'RasterToNumPyArray', window_reader(iHDR))
+    aRows, aCols = [a.reshape(-1) for a in np.indices(tupShp)]
+    arrMM = edU.ReadPoints(strPath, iHDR, 0, aRows, aCols, tupShp, bMemmap=True)
+    arrWin = edU.ReadPoints(strPath, iHDR, 0, aRows, aCols, tupShp, bMemmap=False)
+    # window shares the raster's lower left corner
+    np.testing.assert_array_equal(arrMM, arr3[0, 3:, :].reshape(-1))
+    np.testing.assert_array_equal(arrWin, arrMM)
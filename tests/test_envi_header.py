@@ -0,0 +1,37 @@
+"""
+ envi_header HDR.memmap and HDR.band on small bsq, bil and bip rasters, both byte orders.
+"""
+import numpy as np
+import pytest
+import raster.envi_header as envi
+
+BANDS = ['NBR', 'NDVI', 'dNBR']
+
+def cube(tupShape=(3, 4, 5)):
+    """ Return (bands, lines, samples) int16 cube with distinct, signed values. """
+    return (np.arange(np.prod(tupShape)) - 20).reshape(tupShape).astype(np.int16)
+
+@pytest.mark.parametrize('intByteOrder', [0, 1])
+@pytest.mark.parametrize('strInterleave', ['bsq', 'bil', 'bip'])
+def test_memmap_band(tmp_path, envi_writer, strInterleave, intByteOrder):
+    arr3 = cube()
+    iHDR = envi_writer(str(tmp_path / f'r_{strInterleave}.bsq'), arr3, strInterleave, intByteOrder)
+    assert iHDR.bandNames() == BANDS
+    assert iHDR.memmap().shape == arr3.shape
+    np.testing.assert_array_equal(iHDR.memmap(), arr3)
+    for i, strBand in enumerate(BANDS):
+        np.testing.assert_array_equal(iHDR.band(strBand), arr3[i])
+        np.testing.assert_array_equal(iHDR.band(i), arr3[i])
+
+@pytest.mark.parametrize('intDataType', [1, 4, 12])
+def test_dtype_offset(tmp_path, envi_writer, intDataType):
+    arr3 = np.abs(cube())
+    iHDR = envi_writer(str(tmp_path / 'r.bsq'), arr3, 'bil', 1, intDataType, intOffset=16)
+    assert iHDR.dtype() == np.dtype(envi.dicENVIDTYPE[intDataType]).newbyteorder('>')
+    np.testing.assert_array_equal(iHDR.band('NDVI'), arr3[1])
+
+def test_header_geometry(tmp_path, envi_writer):
+    iHDR = envi_writer(str(tmp_path / 'r.bsq'), cube())
+    assert (iHDR.lines, iHDR.samples) == (4, 5)
+    assert (iHDR.XMin, iHDR.YMax, iHDR.CellSize) == (500000.0, 4000000.0, 30.0)
+    assert (iHDR.XMax, iHDR.YMin) == (500000.0 + 5 * 30, 4000000.0 - 4 * 30)
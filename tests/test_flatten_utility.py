@@ -0,0 +1,125 @@
+"""
+ Equivalence of flatten_utility LastMatch versions of fLastEV, fMaxConfEV and fMinPPEV
+    with the band loop references (_fLastEVLoop, _fMaxConfEVLoop, _fMinPPEVLoop),
+    and of StatConfGrouped with StatConfTotal.
+"""
+import numpy as np
+import pytest
+import edart_utility as edU
+import flatten_utility as flatU
+
+YEAR = 2010
+PAIRS = [(flatU.fLastEV, flatU._fLastEVLoop),
+         (flatU.fMaxConfEV, flatU._fMaxConfEVLoop),
+         (flatU.fMinPPEV, flatU._fMinPPEVLoop)]
+
+def cube(tupShape=(12, 9, 11), intSeed=0):
+    """ Return masked event, confidence cubes as flatten_conf, with many ties
+            (monthly events, few confidence values), no event and all masked pixels.
+    """
+    rng = np.random.default_rng(intSeed)
+    arr3_Evt = (YEAR - 1 + rng.integers(0, 36, tupShape, dtype=np.int16) / 12).astype(np.float32)
+    arr3_Conf = rng.choice(np.array([0, 20, 40, 40, 90], dtype=np.int16), tupShape)
+    arr3_Evt = np.where(arr3_Conf > 0, arr3_Evt, 0).astype(np.float32)
+    # no event pixels: event and confidence 0 in every band
+    arr3_Evt[:, 0, :] = 0
+    arr3_Conf[:, 0, :] = 0
+    # all masked pixels: events in every band, none in YEAR
+    arr3_Evt[:, 1, :] = YEAR + 1.5
+    return arr3_Evt, arr3_Conf
+
+def check(fVec, fLoop, arr3_Bol, arr3_Evt, arr3_Other):
+    """ Assert vectorized and loop versions give equal values, vectorized keeps dtypes. """
+    tupVec = fVec(arr3_Bol, arr3_Evt, arr3_Other)
+    tupLoop = fLoop(arr3_Bol, arr3_Evt, arr3_Other)
+    for arrVec, arrLoop in zip(tupVec, tupLoop):
+        np.testing.assert_array_equal(arrVec, arrLoop)
+    assert (tupVec[0].dtype, tupVec[1].dtype) == (arr3_Evt.dtype, arr3_Other.dtype)
+    return tupVec
+
+@pytest.mark.parametrize('fVec, fLoop', PAIRS)
+@pytest.mark.parametrize('intSeed', range(4))
+def test_random_ties(fVec, fLoop, intSeed):
+    arr3_Evt, arr3_Conf = cube(intSeed=intSeed)
+    check(fVec, fLoop, edU.testYear(arr3_Evt, YEAR), arr3_Evt, arr3_Conf)
+
+@pytest.mark.parametrize('fVec, fLoop', PAIRS)
+def test_bool_mask(fVec, fLoop):
+    arr3_Evt, arr3_Conf = cube()
+    check(fVec, fLoop, edU.testYear(arr3_Evt, YEAR).astype(bool), arr3_Evt, arr3_Conf)
+
+@pytest.mark.parametrize('fVec, fLoop', PAIRS)
+def test_all_masked(fVec, fLoop):
+    arr3_Evt, arr3_Conf = cube()
+    arr3_Bol = np.zeros(arr3_Evt.shape, dtype=np.uint8)
+    check(fVec, fLoop, arr3_Bol, arr3_Evt, arr3_Conf)
+
+@pytest.mark.parametrize('fVec, fLoop', PAIRS)
+def test_no_events(fVec, fLoop):
+    arr3_Evt = np.zeros((5, 3, 4), dtype=np.float32)
+    arr3_Conf = np.zeros((5, 3, 4), dtype=np.int16)
+    check(fVec, fLoop, edU.testYear(arr3_Evt, YEAR), arr3_Evt, arr3_Conf)
+
+def test_tie_last_band_wins():
+    # pixel: same event in bands 0 and 2 with different confidence, max confidence tied
+    arr3_Evt = np.array([YEAR + .25, YEAR + .1, YEAR + .25, 0], dtype=np.float32).reshape(4, 1, 1)
+    arr3_Conf = np.array([30, 60, 50, 60], dtype=np.int16).reshape(4, 1, 1)
+    arr3_Bol = edU.testYear(arr3_Evt, YEAR)
+
+    arrEvt, arrConf = check(flatU.fLastEV, flatU._fLastEVLoop, arr3_Bol, arr3_Evt, arr3_Conf)
+    assert arrEvt[0, 0] == np.float32(YEAR + .25) and arrConf[0, 0] == 50
+    # band 3 (conf 60, no event) is masked, band 1 holds the tied maximum
+    arrEvt, arrConf = check(flatU.fMaxConfEV, flatU._fMaxConfEVLoop, arr3_Bol, arr3_Evt, arr3_Conf)
+    assert arrEvt[0, 0] == np.float32(YEAR + .1) and arrConf[0, 0] == 60
+
+def test_minpp_negative():
+    arr3_Evt, arr3_Conf = cube(intSeed=5)
+    arr3_PP = (arr3_Conf - 45).astype(np.int16)
+    check(flatU.fMinPPEV, flatU._fMinPPEVLoop, edU.testYear(arr3_Evt, YEAR), arr3_Evt, arr3_PP)
+
+def test_lastmatch_iterable():
+    arr3_Evt, arr3_Conf = cube()
+    arrMax = arr3_Conf.max(axis=0)
+    np.testing.assert_array_equal(flatU.LastMatch(arr3_Conf, arrMax, arr3_Evt),
+                                  flatU.LastMatch(iter(list(arr3_Conf)), arrMax, arr3_Evt))
+
+@pytest.mark.parametrize('intSeed', range(3))
+def test_stat_conf_grouped(intSeed):
+    arr3_Evt, arr3_Conf = cube(intSeed=intSeed)
+    # flagged pixels: first band confidence in flag list
+    arr3_Conf[0, 2, :3] = [-1, 1, 2]
+    arrFlags = flatU.ConfFlags(arr3_Conf, [-1, 1, 2])
+    assert arrFlags.dtype == np.int8 and set(np.unique(arrFlags)) == {0, 1}
+    arr3_Conf = np.maximum(arr3_Conf, 0)
+
+    lstWindows = [(YEAR - 1, YEAR + 1), (YEAR, YEAR + 2), (YEAR + 1, YEAR + 1), (YEAR - 5, YEAR + 5),
+                  (YEAR + .5, YEAR + 1.5)]
+    dicOut = flatU.StatConfGrouped(arr3_Evt, arr3_Conf, lstWindows, flatU.STATS, arrFlags)
+    for intYearS, intYearE in lstWindows:
+        for strStat, fStat in (('sum', np.sum), ('max', np.max)):
+            arrRef = flatU.StatConfTotal(arr3_Evt, arr3_Conf, intYearS, intYearE, fStat, arrFlags)
+            np.testing.assert_array_equal(dicOut[(intYearS, intYearE, strStat)], arrRef)
+        arrCount = edU.testYear(arr3_Evt, intYearS, intYearE).sum(axis=0)
+        np.testing.assert_array_equal(dicOut[(intYearS, intYearE, 'count')],
+                                      np.where(arrFlags != 0, arrFlags, arrCount))
+
+def options(bolMoist=False, bolSum=True, **kw):
+    """ Return flattenOptions, max conf and last event outputs. """
+    return flatU.flattenOptions('W', False, bolMoist, bolSum, True, True, **kw)
+
+def test_fingerprint_output_options():
+    dicFP = options().fingerprint()
+    # which outputs are made, and how, don't change output fingerprints
+    assert options(bolSum=False, boolStackOutputs=True, intBlockSize=256,
+                   boolIncremental=True).fingerprint() == dicFP
+    assert options(bolMoist=True).fingerprint() != dicFP
+    assert options(strCompress='LZW').fingerprint() != dicFP
+
+def test_array_fingerprint():
+    arr = np.arange(12, dtype=np.int16).reshape(3, 4)
+    strFP = flatU.ArrayFingerprint(arr, {})
+    assert strFP == flatU.ArrayFingerprint(arr.copy(), {})
+    assert strFP != flatU.ArrayFingerprint(arr.astype(np.int32), {})
+    assert strFP != flatU.ArrayFingerprint(arr, {'bolDoAsMaxConf': True})
+    arr[1, 1] += 1
+    assert strFP != flatU.ArrayFingerprint(arr, {})
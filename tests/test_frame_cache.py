@@ -0,0 +1,90 @@
+"""
+ frame_cache FrameCache strip storage: window and pixel reads against the cube,
+    strips only read where needed, stale keys.
+"""
+import os
+import time
+import numpy as np
+import pytest
+import frame_cache
+
+SHAPE = (5, 7, 9)
+
+@pytest.fixture
+def frames(tmp_path, monkeypatch):
+    """ Return list of frame files, PIXELSTRIP 3 rows so cubes span several strips. """
+    monkeypatch.setattr(frame_cache, 'PIXELSTRIP', 3)
+    lstFrames = []
+    for i in range(SHAPE[0]):
+        strPath = str(tmp_path / f'DF_2010.01.0{i + 1}_{i}.bsq')
+        with open(strPath, 'w') as f:
+            f.write('x')
+        lstFrames.append(strPath)
+    return lstFrames
+
+def cubes(intSeed=0):
+    """ Return int16 index and bool mask cubes of SHAPE. """
+    rng = np.random.default_rng(intSeed)
+    return rng.integers(-99, 99, SHAPE).astype(np.int16), rng.random(SHAPE) < 0.5
+
+def cache(tmp_path, lstFrames, sMask_='bool', lstKeyFiles=None):
+    """ Return FrameCache of scene 'scene', band NBR. """
+    return frame_cache.FrameCache(str(tmp_path / 'cache'), 'scene', 'NBR', lstFrames, SHAPE[1:],
+                                  sMask_, lstKeyFiles)
+
+@pytest.mark.parametrize('tupFrames, tupWindow', [(None, None), ((1, 4), (2, 3, 4, 5)),
+                                                  ((0, 5), (6, 0, 1, 9)), ((2, 3), (0, 8, 7, 1))])
+def test_read_window(tmp_path, frames, tupFrames, tupWindow):
+    arrI, arrM = cubes()
+    cache(tmp_path, frames).write(arrI, arrM, {1: 0}, {0: '2010.01.01'})
+    iCache = cache(tmp_path, frames)
+    assert iCache.exists()
+    t0, t1 = tupFrames or (0, SHAPE[0])
+    r, c, nr, nc = tupWindow or (0, 0) + SHAPE[1:]
+    arrIR, arrMR = iCache.read(tupFrames, tupWindow)
+    np.testing.assert_array_equal(arrIR, arrI[t0:t1, r:r + nr, c:c + nc])
+    np.testing.assert_array_equal(arrMR, arrM[t0:t1, r:r + nr, c:c + nc])
+    assert iCache.lookups() == ({1: 0}, {0: '2010.01.01'})
+
+def test_read_pixels(tmp_path, frames, monkeypatch):
+    arrI, arrM = cubes(1)
+    iCache = cache(tmp_path, frames)
+    iCache.write(arrI, arrM, {}, {})
+    aRows, aCols = np.array([0, 6, 3, 3, 1]), np.array([8, 0, 2, 2, 4])
+    # strips 0, 1 and 2 of 3 hold points
+    lstRead = []
+    fRead = iCache._readStrip
+    monkeypatch.setattr(iCache, '_readStrip', lambda *a: lstRead.append(a) or fRead(*a))
+    arrIR, arrMR = iCache.read_pixels(aRows, aCols)
+    np.testing.assert_array_equal(arrIR, arrI[:, aRows, aCols])
+    np.testing.assert_array_equal(arrMR, arrM[:, aRows, aCols])
+    assert sorted(lstRead) == sorted([(strCube, s, 'P') for strCube in ('Index', 'Mask')
+                                      for s in range(3)])
+    lstRead.clear()
+    iCache.read_pixels([1], [4])
+    assert lstRead == [('Index', 0, 'P'), ('Mask', 0, 'P')]
+
+def test_index_only(tmp_path, frames):
+    arrI, arrM = cubes()
+    iCache = cache(tmp_path, frames, None)
+    iCache.write(arrI, None, {}, {})
+    assert iCache.read()[1] is None and iCache.read_pixels([1], [1])[1] is None
+    np.testing.assert_array_equal(iCache.read_pixels([1], [1])[0], arrI[:, [1], [1]])
+
+def test_stale_key(tmp_path, frames):
+    lstDM = [f.replace('DF_', 'DM_') for f in frames]
+    for f in lstDM:
+        with open(f, 'w') as txt:
+            txt.write('m')
+    arrI, arrM = cubes()
+    cache(tmp_path, frames, lstKeyFiles=lstDM).write(arrI, arrM, {}, {})
+    assert cache(tmp_path, frames, lstKeyFiles=lstDM).exists()
+    assert not cache(tmp_path, frames, 'sentinel', lstDM).exists()
+    # reprocessed mask, reprocessed frame
+    time.sleep(0.01)
+    with open(lstDM[2], 'w') as txt:
+        txt.write('mm')
+    assert not cache(tmp_path, frames, lstKeyFiles=lstDM).exists()
+    cache(tmp_path, frames).write(arrI, arrM, {}, {})
+    os.utime(frames[0], ns=(0, 0))
+    assert not cache(tmp_path, frames).exists()
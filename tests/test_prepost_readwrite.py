@@ -0,0 +1,134 @@
+"""
+ prepost_readwrite ExtractStore round trip, appends across runs, replaced and missing ROIs,
+    and Results against appendSeries, in memory and streamed to csv.
+"""
+import io
+import numpy as np
+import pandas as pd
+import pytest
+import prepost_readwrite as ppRW
+
+BANDS = ['NBR', 'NDVI', 'NDII']
+FRAMES = 6
+
+def extract(lROIID, intSeed=0, npMask=np.int16):
+    """ Return (roi, frame, band) index and (roi, frame) mask of ROIs lROIID. """
+    rng = np.random.default_rng(intSeed)
+    a3_Index = rng.integers(-500, 500, (len(lROIID), FRAMES, len(BANDS))).astype(np.int16)
+    a2_Mask = rng.integers(0, 255, (len(lROIID), FRAMES)).astype(npMask)
+    return a3_Index, a2_Mask
+
+def test_round_trip(tmp_path):
+    strPath = str(tmp_path / 'store')
+    lROIID = ['a1', 'b2', 17]
+    a3_Index, a2_Mask = extract(lROIID)
+    aDates = np.arange('2010-01-01', '2010-01-07', dtype='datetime64[D]')
+    ppRW.ExtractStore(strPath, BANDS).append(lROIID, a3_Index, a2_Mask, aDates)
+
+    iStore = ppRW.ExtractStore(strPath)
+    assert iStore.bands == BANDS
+    assert iStore.roiids() == ['a1', 'b2', '17'] and len(iStore) == 3
+    assert 17 in iStore and 'c3' not in iStore
+    np.testing.assert_array_equal(iStore.load()['Dates'], aDates)
+    for i, s in enumerate(lROIID):
+        aI, aM = iStore.read(s)
+        np.testing.assert_array_equal(aI, a3_Index[i])
+        np.testing.assert_array_equal(aM, a2_Mask[i])
+
+def test_append_runs(tmp_path):
+    strPath = str(tmp_path / 'store')
+    a3_I1, a2_M1 = extract(['a', 'b', 'c'], 1)
+    a3_I2, a2_M2 = extract(['c', 'd'], 2)
+    ppRW.ExtractStore(strPath, BANDS).append(['a', 'b', 'c'], a3_I1, a2_M1)
+    # resumed run: new instance, c replaced, d added, one part per append
+    ppRW.ExtractStore(strPath, BANDS).append(['c', 'd'], a3_I2, a2_M2)
+    iStore = ppRW.ExtractStore(strPath, BANDS)
+    assert len(iStore._parts()) == 2
+    assert iStore.roiids() == ['a', 'b', 'c', 'd']
+
+    a3_I, a2_M, aExists = iStore.read_cube(['d', 'x', 'a', 'c'], ['NDII', 'NBR'])
+    np.testing.assert_array_equal(aExists, [True, False, True, True])
+    np.testing.assert_array_equal(a3_I[0], a3_I2[1][:, [2, 0]])
+    np.testing.assert_array_equal(a3_I[2], a3_I1[0][:, [2, 0]])
+    np.testing.assert_array_equal(a3_I[3], a3_I2[0][:, [2, 0]])
+    assert not a3_I[1].any() and not a2_M[1].any()
+    np.testing.assert_array_equal(a2_M[3], a2_M2[0])
+
+def test_empty_store(tmp_path):
+    strPath = str(tmp_path / 'store')
+    iStore = ppRW.ExtractStore(strPath, BANDS)
+    # no ROIs: falsy, test against None for "no store"
+    assert not iStore and len(iStore) == 0 and 'a' not in iStore
+    with pytest.raises(Exception, match='no store'):
+        iStore.read_cube(['a'])
+    a3_Index, a2_Mask = extract([])
+    iStore.append([], a3_Index, a2_Mask)
+    assert iStore.exists() and not iStore
+    a3_I, a2_M, aExists = iStore.read_cube(['a', 'b'])
+    assert a3_I.shape == (2, FRAMES, len(BANDS)) and a2_M.shape == (2, FRAMES)
+    assert not aExists.any() and not a3_I.any()
+
+def test_store_checks(tmp_path):
+    strPath = str(tmp_path / 'store')
+    a3_Index, a2_Mask = extract(['a'], npMask=bool)
+    ppRW.ExtractStore(strPath, BANDS).append(['a'], a3_Index, a2_Mask)
+    with pytest.raises(Exception, match='do not match store'):
+        ppRW.ExtractStore(strPath, BANDS[::-1])
+    with pytest.raises(Exception, match='mask dtype'):
+        ppRW.ExtractStore(strPath).append(['b'], *extract(['b']))
+    with pytest.raises(Exception, match='frame count'):
+        ppRW.ExtractStore(strPath).append(['b'], a3_Index[:, :2], a2_Mask[:, :2])
+    assert ppRW.ExtractStore(strPath).read_cube()[1].dtype == bool
+
+HEADER = ['ROIID', 'MedianPre_NBR', 'MedianPost_NBR', 'comment', 'details1']
+
+def records(intN=7):
+    """ Return list of (record, comment), some columns missing. """
+    lRec = []
+    for i in range(intN):
+        dicRec = {'ROIID': f'r{i}', 'MedianPre_NBR': i * 1.5, 'details1': i}
+        if i % 3:
+            dicRec['MedianPost_NBR'] = -i
+        lRec.append((dicRec, 'short' if i % 2 else ''))
+    return lRec
+
+def reference(lRec):
+    """ Return DataFrame of lRec built with appendSeries, as before Results. """
+    df = pd.DataFrame(columns=HEADER)
+    for dicRec, sComment in lRec:
+        df = ppRW.appendSeries(pd.Series(dicRec), df, sComment)
+    return df[HEADER]
+
+@pytest.mark.parametrize('iFlush', [None, 1, 3, 100])
+def test_results_round_trip(tmp_path, iFlush):
+    lRec = records()
+    strPath = str(tmp_path / 'results.csv') if iFlush else None
+    with ppRW.Results(HEADER, strPath, iFlush) as iResults:
+        for dicRec, sComment in lRec:
+            iResults.append(dicRec, sComment)
+    assert len(iResults) == len(lRec)
+    dfRef = reference(lRec)
+    dfOut = iResults.to_frame()
+    assert list(dfOut.columns) == HEADER
+    if strPath:
+        # written once, header with the first flush only
+        dfOut = pd.read_csv(strPath)
+        assert len(dfOut) == len(lRec)
+        dfRef = pd.read_csv(io.StringIO(dfRef.to_csv(index=False)))
+    pd.testing.assert_frame_equal(dfOut.fillna(''), dfRef.fillna(''), check_dtype=False)
+
+def test_results_flush_twice(tmp_path):
+    strPath = str(tmp_path / 'results.csv')
+    iResults = ppRW.Results(HEADER, strPath, 2)
+    for dicRec, sComment in records(3):
+        iResults.append(dicRec, sComment)
+    iResults.flush()
+    iResults.flush()
+    iResults.close()
+    dfOut = pd.read_csv(strPath)
+    assert list(dfOut['ROIID']) == ['r0', 'r1', 'r2']
+    assert list(dfOut['comment'].fillna('')) == ['', 'short', '']
+
+def test_results_flush_requires_path():
+    with pytest.raises(Exception, match='requires sPathCSV'):
+        ppRW.Results(HEADER, iFlush=10)
@@ -0,0 +1,110 @@
+"""
+ prepost_utility keep_mask on the IngestFramesPartial mask forms, and median_prepost_batch
+    against the median_prepost_roi loop (as BenchmarkPrepost), datetime64 date helpers
+    against the datetime.date versions (as BenchmarkDates).
+"""
+import datetime
+import numpy as np
+import pytest
+import edart_utility as edU
+import prepost_utility as ppU
+
+DM = np.array([[0, 1, 150, 199], [200, 201, 255, 3]])
+
+@pytest.mark.parametrize('npType', [np.int16, np.int32, np.uint8, np.uint16])
+def test_keep_mask_raw(npType):
+    arrKeep = np.array([[True, False, False, False], [True, True, True, False]])
+    np.testing.assert_array_equal(ppU.keep_mask(DM.astype(npType)), arrKeep)
+
+def test_keep_mask_forms():
+    arrKeep = edU.MaskKeep(DM)
+    np.testing.assert_array_equal(ppU.keep_mask(arrKeep), arrKeep)
+    np.testing.assert_array_equal(ppU.keep_mask(edU.UnpackMask(np.packbits(arrKeep, axis=-1), 4)), arrKeep)
+    aI = np.ones(DM.shape + (2,), dtype=np.int16)
+    aI[..., 1][~arrKeep] = edU.MASKSENTINEL
+    np.testing.assert_array_equal(ppU.keep_mask(None, aI), arrKeep)
+    with pytest.raises(Exception, match='unsupported mask dtype'):
+        ppU.keep_mask(DM.astype(np.float32))
+
+def prepost_inputs(intSeed=0, iROI=60, iTime=120, iBand=4):
+    """ Return random (roi, time, band) index with zero frames, raw DM mask, shared dates
+            and per ROI t_pre, t_post dates, as BenchmarkPrepost.
+    """
+    rng = np.random.default_rng(intSeed)
+    aD = np.datetime64('2000-01-01') + np.sort(rng.choice(iTime * 16, iTime, replace=False))
+    a3_I = rng.integers(-3, 3, (iROI, iTime, iBand)).astype(np.int16)
+    a2_M = rng.choice(np.array([0, 0, 0, 5, 200], dtype=np.int16), (iROI, iTime))
+    aD0 = aD[0] + rng.integers(0, iTime * 16, iROI)
+    aD1 = aD0 + rng.integers(0, 400, iROI)
+    return a3_I, a2_M, aD, aD0, aD1
+
+@pytest.mark.parametrize('strMask', ['raw', 'bool'])
+@pytest.mark.parametrize('iSampleMin', [1, 5])
+@pytest.mark.parametrize('intSeed', range(3))
+def test_median_batch_matches_roi(strMask, iSampleMin, intSeed):
+    a3_I, a2_M, aD, aD0, aD1 = prepost_inputs(intSeed)
+    if strMask == 'bool':
+        a2_M = edU.MaskKeep(a2_M)
+    tSlice = (0, 2)
+    dicB = ppU.median_prepost_batch(a3_I, a2_M, aD, aD0, aD1, iSampleMin, tSlice)
+    lDates = aD.astype(object)
+    intEmpty = 0
+    for i in range(len(a3_I)):
+        tRes = ppU.median_prepost_roi(a3_I[i], a2_M[i], lDates, aD0[i].astype(object),
+                                      aD1[i].astype(object), iSampleMin, tSlice)
+        assert dicB['Empty'][i] == (tRes is None), i
+        if tRes is None:
+            intEmpty += 1
+            continue
+        aMedians, lDetail1, lDetail2, sComment = tRes
+        np.testing.assert_array_equal(dicB['Median'][i], aMedians)
+        assert dicB['Detail1'][i].tolist() == lDetail1
+        assert dicB['Detail2'][i].tolist() == lDetail2
+        assert ppU.batch_comment(dicB['Count'][i], iSampleMin) == sComment
+    # both paths exercised
+    assert 0 < intEmpty < len(a3_I)
+
+def test_median_batch_nat():
+    a3_I, a2_M, aD, aD0, aD1 = prepost_inputs(iROI=4)
+    aD0 = aD0.astype('datetime64[D]')
+    aD0[1] = np.datetime64('NaT')
+    dicB = ppU.median_prepost_batch(a3_I, a2_M, ppU.DateIndex(aD), aD0, aD1)
+    assert dicB['Empty'][1] and (dicB['Count'][1, 0] == 0) and np.isnan(dicB['Median'][1, 0]).all()
+
+def dates(intSeed=0, iTime=400):
+    """ Return sorted datetime64[D] dates from 1984 and the datetime.date versions. """
+    rng = np.random.default_rng(intSeed)
+    aD64 = np.datetime64('1984-01-01') + np.sort(rng.choice(iTime * 8, iTime, replace=False))
+    return aD64, aD64.astype(object)
+
+@pytest.mark.parametrize('intSeed', range(3))
+def test_split64_matches_date(intSeed):
+    aD64, aD = dates(intSeed)
+    aI = np.arange(len(aD) * 3).reshape(-1, 3)
+    for d64 in aD64[::37]:
+        d = d64.astype(object)
+        for a, a64 in zip(ppU.split_pre(aI, aD, d) + ppU.split_post(aI, aD, d),
+                          ppU.split_pre64(aI, aD64, d64) + ppU.split_post64(aI, aD64, d64)):
+            np.testing.assert_array_equal(np.asarray(a, dtype=a64.dtype), a64)
+    np.testing.assert_array_equal(ppU.isMonth64(aD64), ppU.isMonthV(aD))
+
+def test_date_index():
+    aD64, aD = dates()
+    iDate = ppU.DateIndex(aD64)
+    lD0 = aD64[::23]
+    aPre, aPost = iDate.window_pre(lD0), iDate.window_post(lD0)
+    for i, d64 in enumerate(lD0):
+        d = d64.astype(object)
+        np.testing.assert_array_equal(aPre[i], (aD < d) & (aD > d - datetime.timedelta(548)))
+        np.testing.assert_array_equal(aPost[i], (aD > d) & (aD < d + datetime.timedelta(548)))
+    np.testing.assert_array_equal(iDate.doy, [d.timetuple().tm_yday for d in aD])
+    np.testing.assert_array_equal(iDate.wyear, [d.year - (d.month < 10) for d in aD])
+    np.testing.assert_array_equal(iDate.isMonth(), ppU.isMonthV(aD))
+    # NaT: no window
+    assert not iDate.window_pre(np.array(['NaT'], dtype='datetime64[D]')).any()
+
+def test_parse_dates64():
+    aD64, aD = dates()
+    np.testing.assert_array_equal(ppU.parse_dates64([d.isoformat().replace('-', '.') for d in aD]), aD64)
+    np.testing.assert_array_equal(ppU.parse_dates64(['2010.1.2 ', '1999.12.31']),
+                                  np.array(['2010-01-02', '1999-12-31'], dtype='datetime64[D]'))
@@ -0,0 +1,32 @@
+"""
+ rasterGDALUtility GDALArray dtype mapping, 64 bit ints without GDAL 3.5+ support.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('osgeo')
+import raster.rasterGDALUtility as rastGdalU
+
+@pytest.fixture
+def no_int64(monkeypatch):
+    """ Remove 64 bit int types from dicNP2GDAL, as GDAL before 3.5. """
+    dicNP2GDAL = {k: v for k, v in rastGdalU.dicNP2GDAL.items() if k.itemsize < 8 or k.kind == 'f'}
+    monkeypatch.setattr(rastGdalU, 'dicNP2GDAL', dicNP2GDAL)
+
+@pytest.mark.parametrize('npType, npOut', [(np.int64, np.int32), (np.uint64, np.uint32)])
+def test_int64_narrowed(no_int64, npType, npOut):
+    arr = np.array([[0, 7], [2 ** 31 - 1, 5]], dtype=npType)
+    arrOut = rastGdalU.GDALArray(arr)
+    assert arrOut.dtype == npOut
+    np.testing.assert_array_equal(arrOut, arr)
+    assert rastGdalU.GDALType(npType) == npOut
+
+def test_int64_out_of_range(no_int64):
+    with pytest.raises(Exception, match='outside int32 range'):
+        rastGdalU.GDALArray(np.array([0, 2 ** 40], dtype=np.int64))
+    with pytest.raises(Exception, match='outside int16 range'):
+        rastGdalU.CastGDAL(np.array([0, 2 ** 20], dtype=np.int32), np.int16)
+
+def test_bool_and_float():
+    assert rastGdalU.GDALArray(np.zeros(3, dtype=bool)).dtype == np.uint8
+    assert rastGdalU.GDALArray(np.zeros(3, dtype=np.float16)).dtype == np.float64
@@ -0,0 +1,23 @@
+"""
+ rasterIO write dispatch: write options are refused, not ignored, without GDAL.
+"""
+import numpy as np
+import pytest
+import raster.rasterIO as rastIO
+
+@pytest.mark.parametrize('dicOpt', [{'strCompress': 'LZW'}, {'bolOverviews': True}, {'bolCOG': True}])
+def test_arcpy_only_refuses_options(tmp_path, monkeypatch, dicOpt):
+    monkeypatch.setattr(rastIO, 'hasGDAL', lambda: False)
+    arr = np.zeros((4, 5), dtype=np.uint8)
+    with pytest.raises(Exception, match='need GDAL'):
+        rastIO.ArrayToRaster(arr, str(tmp_path / 'a.tif'), None, **dicOpt)
+    with pytest.raises(Exception, match='need GDAL'):
+        rastIO.StackArrays([arr], str(tmp_path / 's.tif'), None, ['b1'], **dicOpt)
+    with pytest.raises(Exception, match='needs GDAL'):
+        rastIO.BlockRaster(str(tmp_path / 'b.tif'), None, 1, np.uint8, **dicOpt)
+
+def test_scratch_options(monkeypatch):
+    monkeypatch.setattr(rastIO, 'hasGDAL', lambda: False)
+    assert rastIO.ScratchOptions() == {}
+    monkeypatch.setattr(rastIO, 'hasGDAL', lambda: True)
+    assert rastIO.ScratchOptions() == {'strCompress': 'NONE'}